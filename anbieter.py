@@ -0,0 +1,122 @@
+# Anbieter der Geodaten je Bundesland
+# Die Module der Anbieter werden erst beim ersten Auflisten importiert. Jedes Modul bietet
+# auflisten(polygon, puffer), das die Dateienbeschreibung (siehe downloads.get.files) liefert.
+#
+# Schneidet ein Polygon mehrere Bundesländer, wird es an den Landesgrenzen geteilt. Die Teile werden gleichzeitig
+# bei den Anbietern aufgelistet und zu einer Dateienbeschreibung zusammengefasst: Kacheln gleicher Schlüssel
+# (z.B. Gelände) werden mit ihren Quellen unter einem Schlüssel geführt, gemeinsam heruntergeladen und zu einem
+# Mosaik bzw. einer Gebäudetabelle verarbeitet. WMS-Karten bleiben je Bundesland getrennt.
+
+import logging
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+
+import metriken
+import kachelauswahl
+
+# Bundesland -> (Kurzname, Modul des Anbieters)
+ANBIETER = {
+    "Nordrhein-Westfalen": ("NRW", "downloads.nrw.files"),
+    "Niedersachsen": ("NDS", "downloads.nds.files"),
+}
+# Die Teile des Polygons reichen so viele Meter über die Landesgrenze hinaus (die Grenzen sind vereinfacht)
+GRENZE_PUFFER = 100
+
+def unterstuetzt(bundesland):
+    """True, wenn für das Bundesland ein Anbieter eingetragen ist."""
+    return bundesland in ANBIETER
+
+def _modul(bundesland):
+    return importlib.import_module(ANBIETER[bundesland][1])
+
+def teilen(polygon, laender, puffer=0):
+    """
+    Teilt das gepufferte Polygon an den Landesgrenzen.
+
+    Parameters:
+    polygon (shapely.geometry.Polygon): Polygon in EPSG:25832.
+    laender (list of str): Bundesländer, die das Polygon schneiden.
+    puffer (float): Puffer um das Polygon in Metern.
+
+    Returns:
+    dict: Bundesland -> Teil des gepufferten Polygons. Bundesländer ohne Grenze in bundeslaender erhalten das ganze Polygon.
+    """
+    import bundeslaender
+
+    gebiet = polygon.buffer(puffer) if puffer else polygon
+    teile = {}
+    for land in laender:
+        grenze = bundeslaender.grenze(land)
+        teil = gebiet if grenze is None else gebiet.intersection(grenze.buffer(GRENZE_PUFFER))
+        if not teil.is_empty:
+            teile[land] = teil
+    return teile
+
+def zusammenfassen(beschreibungen):
+    """
+    Fasst die Dateienbeschreibungen mehrerer Anbieter zusammen.
+
+    Kacheln gleicher Schlüssel stehen unter "files" in der Reihenfolge der Anbieter (bei Überlappungen
+    gilt im Mosaik die erste Kachel), die Zuordnung zu den Servern unter "quellen".
+    WMS-Karten erhalten den Kurznamen des Bundeslandes im Schlüssel, z.B. "ALKIS NRW".
+
+    Parameters:
+    beschreibungen (dict): Bundesland -> Dateienbeschreibung, in der Reihenfolge des Vorrangs.
+
+    Returns:
+    dict: Dateienbeschreibung (siehe downloads.get.files).
+    """
+    zusammen = {}
+    for land, beschreibung in beschreibungen.items():
+        for key, eintrag in beschreibung.items():
+            if eintrag["type"] != "ressource":
+                zusammen["{} {}".format(key, ANBIETER[land][0])] = eintrag
+                continue
+            if key not in zusammen:
+                zusammen[key] = {"type": "ressource", "url": None, "files": [], "quellen": []}
+            ziel = zusammen[key]
+            ziel["files"].extend(eintrag["files"])
+            ziel["quellen"].extend(eintrag.get("quellen") or [{"url": eintrag["url"], "files": eintrag["files"]}])
+            if eintrag.get("gespart"):
+                gespart = ziel.setdefault("gespart", {"kacheln": 0, "bytes": 0})
+                gespart["kacheln"] += eintrag["gespart"]["kacheln"]
+                gespart["bytes"] += eintrag["gespart"]["bytes"]
+    return zusammen
+
+def auflisten(polygon, laender, puffer=0):
+    """
+    Listet die Dateien für ein Polygon bei den Anbietern der Bundesländer auf.
+
+    Bei einem Bundesland entspricht das Ergebnis dem des Anbieters. Bei mehreren wird das Polygon geteilt
+    (siehe teilen) und die Teile werden gleichzeitig aufgelistet.
+
+    Parameters:
+    polygon (shapely.geometry.Polygon): Polygon in EPSG:25832.
+    laender (list of str): Bundesländer, absteigend nach Anteil am Polygon. Nicht unterstützte werden übergangen.
+    puffer (float): Puffer um das Polygon in Metern für die Auswahl der Kacheln.
+
+    Returns:
+    dict: Dateienbeschreibung oder None, wenn keines der Bundesländer unterstützt wird oder eine Auflistung fehlschlägt.
+    """
+    for land in laender:
+        if not unterstuetzt(land):
+            logging.warning("Für {} ist kein Anbieter eingetragen, der Teil des Polygons wird nicht geladen".format(land))
+    laender = [land for land in laender if unterstuetzt(land)]
+    if not laender:
+        return None
+    if len(laender) == 1:
+        return _modul(laender[0]).auflisten(polygon, puffer)
+
+    teile = teilen(polygon, laender, max(puffer, kachelauswahl.PUFFER))
+    if len(teile) < 2:
+        return _modul(next(iter(teile), laender[0])).auflisten(polygon, puffer)
+    with ThreadPoolExecutor(max_workers=len(teile)) as pool:
+        # Die Teile sind bereits gepuffert
+        futures = {land: pool.submit(metriken.im_kontext(_modul(land).auflisten), teil, 0) for land, teil in teile.items()}
+        beschreibungen = {land: future.result() for land, future in futures.items()}
+    for land, beschreibung in beschreibungen.items():
+        if beschreibung is None:
+            logging.error("Fehler beim Auflisten der Dateien für " + land)
+            return None
+    logging.info("Polygon über {} Bundesländer: {}".format(len(teile), ", ".join(teile)))
+    return zusammenfassen(beschreibungen)
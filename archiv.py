@@ -0,0 +1,177 @@
+# Packen der Ergebnisse in eine ZIP-Datei
+# Die ZIP-Datei wird direkt auf die Festplatte geschrieben (mit ZIP64 für große Dateien).
+# Die Kompression wird je Dateityp gewählt: bereits komprimierte Raster werden unverändert abgelegt,
+# Textdateien (XYZ, GML) werden mit Deflate komprimiert. Die Kompression läuft parallel in Threads
+# (zlib gibt den GIL frei), die Dateien werden in fester Reihenfolge in das Archiv übernommen.
+
+import os
+import time
+import zlib
+import shutil
+import struct
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import metriken
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+# Kompression je Dateiendung, alle anderen Dateien werden komprimiert
+KOMPRESSION = {
+    ".tif": ZIP_STORED,
+    ".tiff": ZIP_STORED,
+    ".png": ZIP_STORED,
+    ".jpg": ZIP_STORED,
+    ".zip": ZIP_STORED,
+    ".gz": ZIP_STORED,
+}
+# Blockgröße beim Lesen und Schreiben
+CHUNK_SIZE = 1024 * 1024
+
+# Ab dieser Größe werden Felder im ZIP64-Zusatzfeld abgelegt, im Header steht dann _ZIP64_MARKE
+_ZIP64_LIMIT = 0xFFFFFFFF
+_ZIP64_MARKE = 0xFFFFFFFF
+
+def _komprimieren(pfad, methode, tmp_dir, level):
+    """
+    Berechnet CRC32 und Größen einer Datei und komprimiert sie bei Bedarf in eine temporäre Datei.
+
+    Returns:
+    dict: crc, groesse, komprimiert und der Pfad der zu übernehmenden Daten.
+    """
+    crc = 0
+    groesse = 0
+    if methode == ZIP_STORED:
+        with open(pfad, "rb") as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                crc = zlib.crc32(chunk, crc)
+                groesse += len(chunk)
+        return {"crc": crc, "groesse": groesse, "komprimiert": groesse, "daten": pfad, "temporaer": False}
+
+    # Roher Deflate-Datenstrom ohne zlib-Header, wie im ZIP-Format vorgesehen
+    komprimierer = zlib.compressobj(level, zlib.DEFLATED, -15)
+    fd, tmp = tempfile.mkstemp(dir=tmp_dir, suffix=".deflate")
+    with os.fdopen(fd, "wb") as out, open(pfad, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+            groesse += len(chunk)
+            out.write(komprimierer.compress(chunk))
+        out.write(komprimierer.flush())
+        komprimiert = out.tell()
+    return {"crc": crc, "groesse": groesse, "komprimiert": komprimiert, "daten": tmp, "temporaer": True}
+
+def _dos_zeit(pfad):
+    t = time.localtime(os.path.getmtime(pfad))
+    jahr = max(t.tm_year, 1980)
+    datum = (jahr - 1980) << 9 | t.tm_mon << 5 | t.tm_mday
+    zeit = t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2
+    return zeit, datum
+
+def _zip64_extra(*werte):
+    werte = [w for w in werte if w is not None]
+    if not werte:
+        return b""
+    return struct.pack("<HH", 0x0001, 8 * len(werte)) + struct.pack("<" + "Q" * len(werte), *werte)
+
+@metriken.stufe("zip")
+def zip_erstellen(quelle_dir, zip_pfad, threads=None, level=6, fortschritt=None):
+    """
+    Packt alle Dateien eines Ordners in eine ZIP-Datei auf der Festplatte.
+
+    Der Speicherbedarf ist unabhängig von der Größe der Dateien.
+
+    Parameters:
+    quelle_dir (str): Ordner, dessen Inhalt gepackt wird.
+    zip_pfad (str): Pfad der ZIP-Datei, darf nicht innerhalb von quelle_dir liegen.
+    threads (int): Anzahl der Threads für die Kompression, Standard Anzahl der CPU-Kerne.
+    level (int): Kompressionsstufe für Deflate.
+    fortschritt (callable): Wird nach jeder Datei mit (erledigt, gesamt) aufgerufen.
+    """
+    dateien = []
+    for root, dirs, files in os.walk(quelle_dir):
+        dirs.sort()
+        for file in sorted(files):
+            pfad = os.path.join(root, file)
+            name = os.path.relpath(pfad, quelle_dir).replace(os.sep, "/")
+            methode = KOMPRESSION.get(os.path.splitext(file)[1].lower(), ZIP_DEFLATED)
+            dateien.append((pfad, name, methode))
+
+    tmp_dir = os.path.dirname(os.path.abspath(zip_pfad))
+    zentral = []
+    with open(zip_pfad, "wb") as out, ThreadPoolExecutor(max_workers=threads or os.cpu_count()) as pool:
+        futures = [pool.submit(_komprimieren, pfad, methode, tmp_dir, level) for pfad, name, methode in dateien]
+        for (pfad, name, methode), future in zip(dateien, futures):
+            info = future.result()
+            offset = out.tell()
+            name_bytes = name.encode("utf-8")
+            zeit, datum = _dos_zeit(pfad)
+            zip64 = info["groesse"] >= _ZIP64_LIMIT or info["komprimiert"] >= _ZIP64_LIMIT
+            version = 45 if zip64 else 20
+            extra = _zip64_extra(info["groesse"], info["komprimiert"]) if zip64 else b""
+
+            # Lokaler Header, Bit 11: Dateiname in UTF-8
+            out.write(struct.pack(
+                "<IHHHHHIIIHH", 0x04034B50, version, 0x0800, methode, zeit, datum, info["crc"],
+                _ZIP64_MARKE if zip64 else info["komprimiert"],
+                _ZIP64_MARKE if zip64 else info["groesse"],
+                len(name_bytes), len(extra)))
+            out.write(name_bytes)
+            out.write(extra)
+            with open(info["daten"], "rb") as f:
+                shutil.copyfileobj(f, out, CHUNK_SIZE)
+            if info["temporaer"]:
+                os.remove(info["daten"])
+            zentral.append((name_bytes, methode, zeit, datum, info, offset, os.stat(pfad).st_mode))
+            if fortschritt is not None:
+                fortschritt(len(zentral), len(dateien))
+
+        # Zentrales Verzeichnis
+        cd_offset = out.tell()
+        for name_bytes, methode, zeit, datum, info, offset, mode in zentral:
+            groesse = info["groesse"] if info["groesse"] >= _ZIP64_LIMIT else None
+            komprimiert = info["komprimiert"] if info["komprimiert"] >= _ZIP64_LIMIT else None
+            lokal = offset if offset >= _ZIP64_LIMIT else None
+            extra = _zip64_extra(groesse, komprimiert, lokal)
+            version = 45 if extra else 20
+            out.write(struct.pack(
+                "<IHHHHHHIIIHHHHHII", 0x02014B50, 3 << 8 | 45, version, 0x0800, methode, zeit, datum, info["crc"],
+                _ZIP64_MARKE if komprimiert is not None else info["komprimiert"],
+                _ZIP64_MARKE if groesse is not None else info["groesse"],
+                len(name_bytes), len(extra), 0, 0, 0, (mode & 0xFFFF) << 16,
+                _ZIP64_MARKE if lokal is not None else offset))
+            out.write(name_bytes)
+            out.write(extra)
+        cd_groesse = out.tell() - cd_offset
+
+        anzahl = len(zentral)
+        if anzahl >= 0xFFFF or cd_offset >= _ZIP64_LIMIT or cd_groesse >= _ZIP64_LIMIT:
+            # ZIP64-Endsatz und Locator
+            eocd64_offset = out.tell()
+            out.write(struct.pack("<IQHHIIQQQQ", 0x06064B50, 44, 3 << 8 | 45, 45, 0, 0, anzahl, anzahl, cd_groesse, cd_offset))
+            out.write(struct.pack("<IIQI", 0x07064B50, 0, eocd64_offset, 1))
+        out.write(struct.pack(
+            "<IHHHHIIH", 0x06054B50, 0, 0, min(anzahl, 0xFFFF), min(anzahl, 0xFFFF),
+            _ZIP64_MARKE if cd_groesse >= _ZIP64_LIMIT else cd_groesse,
+            _ZIP64_MARKE if cd_offset >= _ZIP64_LIMIT else cd_offset, 0))
+        metriken.zaehlen("bytes", out.tell())
+
+def aufraeumen(ordner, max_alter=24 * 3600):
+    """
+    Entfernt Dateien in ordner, die älter als max_alter Sekunden sind.
+    """
+    if not os.path.isdir(ordner):
+        return
+    for file in os.listdir(ordner):
+        pfad = os.path.join(ordner, file)
+        try:
+            if time.time() - os.path.getmtime(pfad) > max_alter:
+                os.remove(pfad)
+        except FileNotFoundError:
+            pass
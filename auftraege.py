@@ -0,0 +1,334 @@
+# Ausführung der Aufträge im Hintergrund
+# Die Streamlit-Anwendung reicht einen Auftrag (Download, Verarbeitung, ZIP) mit einreichen() ein und zeigt
+# anschließend nur noch dessen Status an. Die Aufträge laufen in einem Pool aus Prozessen, unabhängig vom
+# Ablauf des Streamlit-Skripts: Neuladen, Bedienung anderer Elemente oder eine neue Verbindung unterbrechen
+# die Verarbeitung nicht.
+#
+# Die Kennung eines Auftrags ist der Hash der normalisierten Anfrage (Polygon, Dateien und Optionen).
+# Gleiche Anfragen, die gleichzeitig eingereicht werden, werden dadurch zu einer Ausführung zusammengefasst.
+# Ist eine gleiche Anfrage bereits fertig, wird ihre ZIP-Datei sofort wieder geliefert. Die Dateinamen der Kacheln
+# (bei NRW mit Erfassungsjahr) sind Teil der Anfrage, nach einer neuen Befliegung ergibt sich also eine neue Kennung.
+# Ergebnisse mit ersetzten Kacheln werden zusätzlich mit verwerfen() entfernt, sobald der Katalog die Änderung sieht.
+# Fertige Ergebnisse werden nach Alter (seit dem letzten Abruf) und Gesamtgröße entfernt.
+#
+# Der Status jedes Auftrags (Zustand, Stufe, Fortschritt, Ergebnis) liegt als JSON-Datei in AUFTRAG_DIR und wird
+# vom ausführenden Prozess atomar aktualisiert. Damit kann der Status aus jeder Sitzung und jedem Prozess gelesen werden.
+# Auch in Stufen ohne Fortschritt (COG, Geländeraster, Gebäude) wird er regelmäßig erneuert (siehe _lebenszeichen),
+# damit ein lange laufender Auftrag nicht als verwaist gilt und erneut gestartet wird.
+
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import contextlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import metriken
+
+# Ordner für Status und Zwischenergebnisse der Aufträge
+AUFTRAG_DIR = os.environ.get("GEODATEN_AUFTRAG_DIR", "auftraege")
+# Ordner der fertigen ZIP-Dateien
+ERGEBNIS_DIR = "ergebnisse"
+# Anzahl der Prozesse, in denen Aufträge gleichzeitig ausgeführt werden
+AUFTRAG_PROZESSE = int(os.environ.get("GEODATEN_AUFTRAG_PROZESSE", 2))
+# Ein laufender Auftrag ohne Aktualisierung des Status seit dieser Zeit in Sekunden gilt als abgebrochen
+VERWAIST_NACH = 600
+# Abstand, in dem ein laufender Auftrag seinen Status auch ohne Fortschritt erneuert, in Sekunden
+LEBENSZEICHEN_ALLE = 60
+# Status und Ergebnisse werden nach dieser Zeit in Sekunden seit dem letzten Abruf entfernt
+AUFBEWAHREN = int(os.environ.get("GEODATEN_AUFBEWAHREN", 24 * 3600))
+# Maximale Gesamtgröße der fertigen ZIP-Dateien in Bytes, die am längsten nicht abgerufenen werden zuerst entfernt
+ERGEBNIS_MAX_BYTES = int(os.environ.get("GEODATEN_ERGEBNIS_MAX_BYTES", 10 * 1024 ** 3))
+# Maximale Größe einer ZIP-Datei für den Download über die Streamlit-Anwendung in Bytes. Streamlit hält die
+# Datei beim Download vollständig im Speicher, größere Ergebnisse werden dort nicht angeboten (Batch-Modus nutzen).
+DOWNLOAD_MAX_BYTES = int(os.environ.get("GEODATEN_DOWNLOAD_MAX_BYTES", 1024 ** 3))
+# Mindestabstand zwischen zwei Aktualisierungen des Status innerhalb einer Stufe in Sekunden
+MELDEN_ALLE = 0.5
+
+# Beschreibung der Stufen für die Anzeige
+STUFEN = {
+    "wartend": "Wartet auf einen freien Prozess",
+    "download": "Dateien herunterladen",
+    "xyz": "Geländedatei erzeugen",
+    "zip": "ZIP-Datei erstellen",
+}
+
+_pool = None
+_laufend = {}
+_lock = threading.RLock()
+
+def kennung(dateienbeschreibung, polygon, **optionen):
+    """
+    Kennung eines Auftrags aus der normalisierten Anfrage.
+
+    Parameters:
+    dateienbeschreibung (dict): Zu ladende Dateien je Schlüssel.
+    polygon (shapely.geometry.Polygon): Untersuchungsgebiet in EPSG:25832.
+    optionen: Optionen der Verarbeitung (spacing, puffer, gelaende_tif, gelaende_grid, gebaeude_gml, xyz_gzip).
+
+    Returns:
+    str: Hexadezimaler Hash.
+    """
+    import shapely
+
+    # Koordinaten auf Zentimeter gerundet, Anfangspunkt und Umlaufrichtung vereinheitlicht
+    geometrie = shapely.normalize(shapely.set_precision(polygon, 0.01))
+    anfrage = {
+        "polygon": shapely.to_wkt(geometrie, rounding_precision=2),
+        "dateien": dateienbeschreibung,
+        "optionen": optionen,
+    }
+    text = json.dumps(anfrage, sort_keys=True, default=list, ensure_ascii=False)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+def _gueltig(kennung):
+    return re.fullmatch(r"[0-9a-f]{32}", str(kennung)) is not None
+
+def _status_pfad(kennung):
+    return os.path.join(AUFTRAG_DIR, kennung + ".json")
+
+def _dateinamen(dateienbeschreibung):
+    """Dateinamen (ohne Pfad) aller Kacheln einer Dateienbeschreibung, sortiert."""
+    return sorted({os.path.basename(datei) for beschreibung in dateienbeschreibung.values()
+                   if beschreibung.get("type") == "ressource" for datei in beschreibung["files"]})
+
+def status(kennung):
+    """
+    Status eines Auftrags.
+
+    Returns:
+    dict: zustand ("wartend", "laufend", "fertig", "fehler"), stufe, erledigt, gesamt, zip, fehler,
+          erstellt und aktualisiert. None, wenn der Auftrag unbekannt ist.
+    """
+    if not _gueltig(kennung):
+        # Kennungen stammen auch aus der URL
+        return None
+    try:
+        with open(_status_pfad(kennung), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _schreiben(kennung, **felder):
+    # Status aktualisieren, atomar über eine temporäre Datei. Die Sperre verhindert, dass das Lebenszeichen
+    # eine gleichzeitige Änderung mit dem zuvor gelesenen Stand überschreibt.
+    with _lock:
+        eintrag = status(kennung) or {"kennung": kennung, "erstellt": time.time()}
+        eintrag.update(felder, aktualisiert=time.time())
+        os.makedirs(AUFTRAG_DIR, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=AUFTRAG_DIR, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(eintrag, f)
+        os.replace(tmp, _status_pfad(kennung))
+    return eintrag
+
+@contextlib.contextmanager
+def _lebenszeichen(kennung):
+    """Erneuert den Status alle LEBENSZEICHEN_ALLE Sekunden in einem Thread, solange der Block läuft."""
+    ende = threading.Event()
+
+    def erneuern():
+        while not ende.wait(LEBENSZEICHEN_ALLE):
+            _schreiben(kennung)
+
+    thread = threading.Thread(target=erneuern, name="lebenszeichen", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        ende.set()
+        thread.join()
+
+def _melder(kennung, stufe):
+    """Rückruf (erledigt, gesamt) für den Fortschritt einer Stufe, schreibt höchstens alle MELDEN_ALLE Sekunden."""
+    letzte = [0.0]
+    def melden(erledigt, gesamt):
+        jetzt = time.time()
+        if jetzt - letzte[0] >= MELDEN_ALLE or erledigt >= gesamt:
+            letzte[0] = jetzt
+            _schreiben(kennung, zustand="laufend", stufe=stufe, erledigt=erledigt, gesamt=gesamt)
+    _schreiben(kennung, zustand="laufend", stufe=stufe, erledigt=0, gesamt=None)
+    return melden
+
+def _ausfuehren(kennung, dateienbeschreibung, polygon, optionen):
+    """Führt einen Auftrag aus, läuft in einem Prozess des Pools."""
+    import pipeline
+    import archiv
+    from downloads.get import files
+
+    temp_dir = os.path.join(AUFTRAG_DIR, kennung)
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+    try:
+        # Die Metriken stellt der einreichende Prozess bereit (siehe _beendet)
+        with _lebenszeichen(kennung), metriken.auftrag(kennung, bereitstellen=False) as auftrag:
+            # Von den Rasterkacheln nur den Ausschnitt des (gepufferten) Polygons laden
+            fenster = polygon.buffer(optionen.get("puffer", 0)).bounds
+            files(temp_dir, dateienbeschreibung, fortschritt=_melder(kennung, "download"), fenster=fenster)
+            # Die Kerne auf die gleichzeitig laufenden Aufträge aufteilen, nicht Teil der Kennung
+            prozesse = max(1, (os.cpu_count() or 1) // AUFTRAG_PROZESSE)
+            pipeline.verarbeiten(temp_dir, dateienbeschreibung, polygon, fortschritt=_melder(kennung, "xyz"), prozesse=prozesse, **optionen)
+
+            # ZIP-Datei zuerst unter temporärem Namen, damit nie eine halbe Datei ausgeliefert wird
+            os.makedirs(ERGEBNIS_DIR, exist_ok=True)
+            zip_pfad = os.path.join(ERGEBNIS_DIR, kennung + ".zip")
+            archiv.zip_erstellen(temp_dir, zip_pfad + ".tmp", fortschritt=_melder(kennung, "zip"))
+            os.replace(zip_pfad + ".tmp", zip_pfad)
+        _schreiben(kennung, zustand="fertig", stufe=None, zip=zip_pfad)
+    except Exception as e:
+        logging.exception("Fehler im Auftrag " + kennung)
+        _schreiben(kennung, zustand="fehler", fehler="{}: {}".format(type(e).__name__, e))
+        raise
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return auftrag.zusammenfassung()
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # Neue Prozesse statt fork: der Streamlit-Server läuft mit vielen Threads
+        _pool = ProcessPoolExecutor(max_workers=AUFTRAG_PROZESSE, mp_context=multiprocessing.get_context("spawn"))
+        metriken.exportieren()
+    return _pool
+
+def _beendet(kennung, future):
+    # Metriken des Prozesses übernehmen und bereitstellen, Abbrüche des Prozesses als Fehler vermerken
+    with _lock:
+        if _laufend.get(kennung) is future:
+            del _laufend[kennung]
+    try:
+        metriken.uebernehmen(future.result())
+        metriken.exportieren()
+    except Exception as e:
+        eintrag = status(kennung)
+        if eintrag is None or eintrag.get("zustand") not in ("fertig", "fehler"):
+            _schreiben(kennung, zustand="fehler", fehler="{}: {}".format(type(e).__name__, e))
+
+def laeuft(kennung):
+    """True, wenn der Auftrag wartet oder ausgeführt wird (in diesem oder einem anderen Prozess)."""
+    with _lock:
+        future = _laufend.get(kennung)
+    if future is not None:
+        return not future.done()
+    eintrag = status(kennung)
+    return (eintrag is not None and eintrag["zustand"] in ("wartend", "laufend")
+            and time.time() - eintrag["aktualisiert"] < VERWAIST_NACH)
+
+def fertig(kennung):
+    """True, wenn der Auftrag fertig und seine ZIP-Datei noch vorhanden ist."""
+    eintrag = status(kennung)
+    return eintrag is not None and eintrag["zustand"] == "fertig" and bool(eintrag.get("zip")) and os.path.exists(eintrag["zip"])
+
+def einreichen(dateienbeschreibung, polygon, **optionen):
+    """
+    Reicht einen Auftrag ein. Läuft bereits ein gleicher Auftrag, wird dieser verwendet,
+    ist ein gleicher Auftrag fertig, wird sein Ergebnis ohne erneute Ausführung geliefert.
+
+    Parameters:
+    dateienbeschreibung (dict): Zu ladende Dateien je Schlüssel (siehe downloads.get.files).
+    polygon (shapely.geometry.Polygon): Untersuchungsgebiet in EPSG:25832.
+    optionen: Optionen für pipeline.verarbeiten (spacing, puffer, gelaende_tif, gelaende_grid, gebaeude_gml, xyz_gzip).
+
+    Returns:
+    str: Kennung des Auftrags für status().
+    """
+    schluessel = kennung(dateienbeschreibung, polygon, **optionen)
+    with _lock:
+        if laeuft(schluessel):
+            metriken.zaehlen("auftraege_zusammengefasst")
+            return schluessel
+        if fertig(schluessel):
+            # Letzten Abruf vermerken, die Aufbewahrung beginnt neu
+            os.utime(status(schluessel)["zip"])
+            _schreiben(schluessel)
+            metriken.zaehlen("cache", ergebnis="hit", art="ergebnis")
+            return schluessel
+        metriken.zaehlen("cache", ergebnis="miss", art="ergebnis")
+        aufraeumen()
+        _schreiben(schluessel, zustand="wartend", stufe="wartend", erledigt=None, gesamt=None, zip=None, fehler=None, erstellt=time.time(),
+                   dateien=_dateinamen(dateienbeschreibung))
+        future = _get_pool().submit(_ausfuehren, schluessel, dateienbeschreibung, polygon, optionen)
+        _laufend[schluessel] = future
+    future.add_done_callback(lambda f: _beendet(schluessel, f))
+    return schluessel
+
+def _entfernen(kennung):
+    # Ergebnis und Status eines fertigen Auftrags entfernen
+    for pfad in (os.path.join(ERGEBNIS_DIR, kennung + ".zip"), _status_pfad(kennung)):
+        try:
+            os.remove(pfad)
+        except FileNotFoundError:
+            pass
+
+def verwerfen(dateinamen):
+    """
+    Entfernt fertige Ergebnisse, die eine der Dateien enthalten (z.B. Kacheln, die durch eine neue Befliegung ersetzt wurden).
+
+    Parameters:
+    dateinamen (iterable of str): Dateinamen der Kacheln, ein Pfad wird ignoriert.
+
+    Returns:
+    int: Anzahl der entfernten Ergebnisse.
+    """
+    dateinamen = {os.path.basename(datei) for datei in dateinamen}
+    if not dateinamen or not os.path.isdir(AUFTRAG_DIR):
+        return 0
+    anzahl = 0
+    with _lock:
+        for datei in os.listdir(AUFTRAG_DIR):
+            schluessel, endung = os.path.splitext(datei)
+            if endung != ".json" or not _gueltig(schluessel):
+                continue
+            eintrag = status(schluessel)
+            if eintrag is not None and eintrag["zustand"] == "fertig" and dateinamen.intersection(eintrag.get("dateien") or ()):
+                _entfernen(schluessel)
+                anzahl += 1
+    if anzahl:
+        logging.info("{} Ergebnisse mit ersetzten Kacheln verworfen".format(anzahl))
+        metriken.zaehlen("ergebnisse_verworfen", anzahl)
+    return anzahl
+
+def aufraeumen(max_alter=AUFBEWAHREN, max_bytes=ERGEBNIS_MAX_BYTES):
+    """
+    Entfernt Status, Zwischenergebnisse und ZIP-Dateien von Aufträgen, die älter als max_alter Sekunden sind.
+    Danach werden die am längsten nicht abgerufenen Ergebnisse entfernt, bis die ZIP-Dateien höchstens max_bytes groß sind.
+    """
+    import archiv
+
+    archiv.aufraeumen(ERGEBNIS_DIR, max_alter)
+    if os.path.isdir(AUFTRAG_DIR):
+        for datei in os.listdir(AUFTRAG_DIR):
+            pfad = os.path.join(AUFTRAG_DIR, datei)
+            try:
+                if time.time() - os.path.getmtime(pfad) > max_alter:
+                    if os.path.isdir(pfad):
+                        shutil.rmtree(pfad, ignore_errors=True)
+                    else:
+                        os.remove(pfad)
+            except FileNotFoundError:
+                pass
+
+    if not os.path.isdir(ERGEBNIS_DIR):
+        return
+    ergebnisse = []
+    for datei in os.listdir(ERGEBNIS_DIR):
+        schluessel, endung = os.path.splitext(datei)
+        if endung != ".zip" or not _gueltig(schluessel):
+            continue
+        try:
+            stat = os.stat(os.path.join(ERGEBNIS_DIR, datei))
+        except FileNotFoundError:
+            continue
+        ergebnisse.append((stat.st_mtime, stat.st_size, schluessel))
+    gesamt = sum(groesse for _, groesse, _ in ergebnisse)
+    for _, groesse, schluessel in sorted(ergebnisse):
+        if gesamt <= max_bytes:
+            break
+        _entfernen(schluessel)
+        gesamt -= groesse
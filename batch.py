@@ -0,0 +1,244 @@
+# Batch-Modus ohne Streamlit
+# Verarbeitet alle Polygone einer GeoPackage-Datei in einem Durchlauf:
+# Die benötigten Kacheln aller Polygone werden zusammengefasst und jede Kachel wird nur einmal heruntergeladen.
+# Anschließend werden die Ergebnisse je Polygon parallel auf mehreren Prozessen erzeugt.
+#
+# Aufruf: python batch.py standorte.gpkg ausgabe --spacing 2 --name-spalte name
+
+import os
+import shutil
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pipeline
+import metriken
+
+# Ordner der gemeinsam heruntergeladenen Kacheln im Ausgabeordner, kein Polygon erhält diesen Namen
+KACHEL_ORDNER = "_kacheln"
+
+def _ordnername(name, vergeben):
+    """
+    Name eines Polygons als sicherer, eindeutiger Datei- bzw. Ordnername.
+
+    Zeichen außer Buchstaben, Ziffern, "-", "_" und "." werden durch "_" ersetzt, Punkte am Anfang und Ende entfernt
+    (keine Pfade wie ".."). Bereits vergebene Namen (ohne Beachtung der Groß-/Kleinschreibung) erhalten eine Nummer.
+
+    Parameters:
+    name (str): Name aus der GeoPackage-Datei.
+    vergeben (set of str): Bereits vergebene Namen in Kleinschreibung, wird ergänzt.
+
+    Returns:
+    str: Ordnername.
+    """
+    sicher = "".join(z if z.isalnum() or z in "-_." else "_" for z in name).strip(".") or "polygon"
+    kandidat, nummer = sicher, 1
+    while kandidat.lower() in vergeben:
+        nummer += 1
+        kandidat = "{}_{}".format(sicher, nummer)
+    vergeben.add(kandidat.lower())
+    if kandidat != name:
+        logging.warning("Polygon \"{}\" wird unter dem Namen {} abgelegt".format(name, kandidat))
+    return kandidat
+
+# Schlüssel, die aus heruntergeladenen Kacheln bestehen (im Gegensatz zu WMS-Abfragen je Polygon)
+def _ressourcen(dateienbeschreibung):
+    return {k: v for k, v in dateienbeschreibung.items() if v["type"] == "ressource"}
+
+def planen(polygone, keys=None, puffer=0, gelaende_bbox=False):
+    """
+    Listet die Dateien aller Polygone auf und fasst die Kacheln aller Anbieter zusammen.
+
+    Polygone über mehrere Bundesländer werden bei allen beteiligten Anbietern aufgelistet (siehe anbieter).
+
+    Parameters:
+    polygone (dict): Name -> Polygon in EPSG:25832.
+    keys (list of str): Zu ladende Schlüssel, None für alle. WMS-Karten über mehrere Bundesländer
+                        (z.B. "ALKIS NRW") werden über den Schlüssel ohne Kurzname ausgewählt.
+    puffer (float): Puffer um die Polygone in Metern für die Auswahl der Kacheln.
+    gelaende_bbox (bool): Die Geländekacheln der ganzen Bounding Box je Polygon (siehe pipeline.auflisten).
+
+    Returns:
+    tuple: (Aufträge je Polygon {Name: (Bundesländer, Dateienbeschreibung)}, Dateienbeschreibung aller Kacheln)
+    """
+    from downloads.get import quellen
+
+    auftraege = {}
+    # Schlüssel -> URL des Servers -> Dateien
+    gesamt = {}
+    for name, polygon in polygone.items():
+        try:
+            laender = pipeline.bundeslaender_ermitteln(polygon)
+        except RuntimeError as e:
+            logging.error("{}: {}".format(name, e))
+            continue
+        dateienbeschreibung = pipeline.auflisten(polygon, laender, puffer, gelaende_bbox=gelaende_bbox)
+        if dateienbeschreibung is None:
+            logging.error("{}: Die Bundesländer {} werden noch nicht unterstützt.".format(name, ", ".join(laender) or "(unbekannt)"))
+            continue
+        if keys is not None:
+            dateienbeschreibung = {k: v for k, v in dateienbeschreibung.items() if k in keys or k.rsplit(" ", 1)[0] in keys}
+        auftraege[name] = (laender, dateienbeschreibung)
+
+        # Vereinigung der Kacheln, jede Datei nur einmal
+        for key, beschreibung in _ressourcen(dateienbeschreibung).items():
+            for quelle in quellen(beschreibung):
+                dateien = gesamt.setdefault(key, {}).setdefault(quelle["url"], [])
+                dateien.extend(datei for datei in quelle["files"] if datei not in dateien)
+
+    kacheln = {key: {"type": "ressource", "url": None, "files": [datei for dateien in server.values() for datei in dateien],
+                     "quellen": [{"url": url, "files": dateien} for url, dateien in server.items()]}
+               for key, server in gesamt.items()}
+    return auftraege, kacheln
+
+def _verknuepfen(quelle, ziel):
+    # Hardlink, wenn möglich, sonst Kopie
+    if not os.path.exists(ziel):
+        try:
+            os.link(quelle, ziel)
+        except OSError:
+            shutil.copyfile(quelle, ziel)
+
+def _polygon_verarbeiten(name, polygon, dateienbeschreibung, kachel_dir, ausgabe_dir, spacing, puffer, gelaende_tif, gelaende_grid, gebaeude_gml, packen,
+                         profil=None, xyz_gzip=False, kerne=None):
+    """
+    Erzeugt die Ergebnisse eines Polygons, läuft in einem eigenen Prozess.
+
+    Returns:
+    tuple: (Name, Zusammenfassung der Metriken des Auftrags)
+    """
+    # Die Metriken stellt der Hauptprozess nach uebernehmen() bereit
+    with metriken.auftrag(name, profil=profil, bereitstellen=False) as auftrag:
+        _polygon_ausgeben(name, polygon, dateienbeschreibung, kachel_dir, ausgabe_dir, spacing, puffer, gelaende_tif, gelaende_grid, gebaeude_gml, packen,
+                          xyz_gzip, kerne)
+    return name, auftrag.zusammenfassung()
+
+def _polygon_ausgeben(name, polygon, dateienbeschreibung, kachel_dir, ausgabe_dir, spacing, puffer, gelaende_tif, gelaende_grid, gebaeude_gml, packen,
+                      xyz_gzip=False, kerne=None):
+    from downloads.get import get_wms
+
+    ziel_dir = os.path.join(ausgabe_dir, name)
+    os.makedirs(ziel_dir, exist_ok=True)
+
+    # Kacheln des Polygons aus dem gemeinsamen Ordner übernehmen, das Mosaik (VRT) verweist auf diese Kopien,
+    # der gemeinsame Ordner wird nach dem Lauf gelöscht
+    for key, beschreibung in _ressourcen(dateienbeschreibung).items():
+        os.makedirs(os.path.join(ziel_dir, key), exist_ok=True)
+        for datei in beschreibung["files"]:
+            datei_name = datei.split("/")[-1]
+            quelle = os.path.join(kachel_dir, key, datei_name)
+            if os.path.exists(quelle):
+                _verknuepfen(quelle, os.path.join(ziel_dir, key, datei_name))
+
+    for key, beschreibung in dateienbeschreibung.items():
+        if beschreibung["type"] == "WMS":
+            get_wms(ziel_dir, dateienbeschreibung, key)
+
+    pipeline.verarbeiten(ziel_dir, dateienbeschreibung, polygon, spacing=spacing, puffer=puffer, gelaende_tif=gelaende_tif,
+                         gelaende_grid=gelaende_grid, gebaeude_gml=gebaeude_gml,
+                         xyz_gzip=xyz_gzip, prozesse=kerne)
+
+    if packen:
+        import archiv
+        archiv.zip_erstellen(ziel_dir, ziel_dir + ".zip")
+        shutil.rmtree(ziel_dir)
+
+def batch(gpkg, ausgabe_dir, keys=None, spacing=1, puffer=0, gelaende_tif=False, name_spalte=None, prozesse=None, packen=False,
+          metriken_datei=None, profil=None, gelaende_grid=False, gebaeude_gml=False, xyz_gzip=False):
+    """
+    Verarbeitet alle Polygone einer GeoPackage-Datei.
+
+    Parameters:
+    gpkg (str): Pfad zur GeoPackage-Datei.
+    ausgabe_dir (str): Ausgabeordner, je Polygon entsteht ein Unterordner (bzw. eine ZIP-Datei).
+    keys (list of str): Zu ladende Schlüssel (z.B. "Gelände", "Gebäude"), None für alle.
+    spacing (int): Auflösung der Geländedatei in Pixeln.
+    puffer (float): Puffer um die Polygone in Metern.
+    gelaende_tif (bool): Zusätzlich das zusammengesetzte Gelände je Polygon als Cloud-Optimized GeoTIFF erzeugen.
+    name_spalte (str): Spalte mit den Namen der Polygone, sonst "polygon_<Nummer>". Die Namen werden für Ordner
+                       und ZIP-Dateien bereinigt, doppelte erhalten eine Nummer (siehe _ordnername).
+    prozesse (int): Anzahl der Prozesse, Standard Anzahl der CPU-Kerne.
+    packen (bool): Die Ergebnisse je Polygon als ZIP-Datei ablegen.
+    metriken_datei (str): Prometheus-Textdatei mit den Metriken des gesamten Laufs.
+    profil (str): Profil je Polygon, "cprofile", "tracemalloc" oder beides (siehe metriken.auftrag).
+    gelaende_grid (bool): Zusätzlich das gemittelte Geländeraster je Polygon als Arc/Info ASCII-Grid (AUSTAL) erzeugen.
+    gebaeude_gml (bool): Die CityGML-Kacheln zusätzlich zur Gebäudetabelle je Polygon ablegen.
+    xyz_gzip (bool): Die XYZ-Dateien je Polygon mit gzip komprimieren.
+    """
+    import geopandas as gpd
+    import bundeslaender
+    from downloads.get import files
+
+    if not bundeslaender.verfuegbar():
+        logging.warning("Die Landesgrenzen {} fehlen, die Bundesländer werden über Nominatim ermittelt".format(bundeslaender.DATEN_PFAD))
+    gdf = gpd.read_file(gpkg)
+    if gdf.crs is not None:
+        gdf = gdf.to_crs("EPSG:25832")
+    polygone, vergeben = {}, {KACHEL_ORDNER}
+    for i, zeile in gdf.iterrows():
+        if zeile.geometry is None or zeile.geometry.is_empty:
+            continue
+        # Fehlende Werte (None, NaN) wie ohne Namensspalte
+        wert = zeile[name_spalte] if name_spalte else None
+        name = str(wert) if wert is not None and wert == wert else "polygon_{}".format(i + 1)
+        polygone[_ordnername(name, vergeben)] = zeile.geometry
+
+    kachel_root = os.path.join(ausgabe_dir, KACHEL_ORDNER)
+    with metriken.auftrag("batch " + os.path.basename(gpkg)):
+        # Das Geländeraster (AUSTAL) umfasst die Bounding Box, dafür alle Geländekacheln darin laden
+        auftraege, kacheln = planen(polygone, keys, puffer, gelaende_bbox=gelaende_grid)
+
+        # Jede Kachel einmal herunterladen, die Anbieter aller Bundesländer gleichzeitig
+        for key, beschreibung in kacheln.items():
+            logging.info("{}: {} Kacheln von {} Servern".format(key, len(beschreibung["files"]), len(beschreibung["quellen"])))
+        files(kachel_root, kacheln)
+
+        # Die Kerne auf die gleichzeitig verarbeiteten Polygone aufteilen (Prozesse für die XYZ-Dateien und die Gebäude)
+        gleichzeitig = min(prozesse or os.cpu_count() or 1, max(1, len(auftraege)))
+        kerne = max(1, (os.cpu_count() or 1) // gleichzeitig)
+        # Neue Prozesse statt fork: GDAL und die Threads der Downloads laufen bereits
+        with ProcessPoolExecutor(max_workers=prozesse, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [pool.submit(_polygon_verarbeiten, name, polygone[name], dateienbeschreibung,
+                                   kachel_root, ausgabe_dir, spacing, puffer, gelaende_tif, gelaende_grid, gebaeude_gml, packen, profil,
+                                   xyz_gzip, kerne)
+                       for name, (_, dateienbeschreibung) in auftraege.items()]
+            for future in as_completed(futures):
+                try:
+                    name, zusammenfassung = future.result()
+                    # Metriken der Prozesse in die Metriken des Laufs übernehmen
+                    metriken.uebernehmen(zusammenfassung)
+                    metriken.exportieren()
+                    logging.info("Fertig: " + name)
+                except Exception:
+                    logging.exception("Fehler bei der Verarbeitung eines Polygons")
+
+    shutil.rmtree(kachel_root, ignore_errors=True)
+    if metriken_datei:
+        metriken.textdatei_schreiben(metriken_datei)
+
+def main():
+    parser = argparse.ArgumentParser(description="Download und Aufbereitung von Geodaten für alle Polygone einer GeoPackage-Datei.")
+    parser.add_argument("gpkg", help="GeoPackage-Datei mit einem oder mehreren Polygonen")
+    parser.add_argument("ausgabe", help="Ausgabeordner")
+    parser.add_argument("--keys", nargs="+", help="Zu ladende Daten, z.B. Gelände Gebäude ALKIS (Standard: alle)")
+    parser.add_argument("--spacing", type=int, default=1, help="Auflösung der Geländedatei in Pixeln")
+    parser.add_argument("--puffer", type=float, default=0, help="Puffer um die Polygone in Metern")
+    parser.add_argument("--gelaende-tif", action="store_true", help="Zusammengesetzte Geländedatei (Cloud-Optimized GeoTIFF) erzeugen")
+    parser.add_argument("--gelaende-grid", action="store_true", help="Gemitteltes Geländeraster als Arc/Info ASCII-Grid (AUSTAL) erzeugen")
+    parser.add_argument("--xyz-gzip", action="store_true", help="XYZ-Dateien mit gzip komprimieren (.xyz.gz)")
+    parser.add_argument("--gebaeude-gml", action="store_true", help="CityGML-Kacheln zusätzlich zur Gebäudetabelle ablegen")
+    parser.add_argument("--name-spalte", help="Spalte mit den Namen der Polygone")
+    parser.add_argument("--prozesse", type=int, help="Anzahl der Prozesse (Standard: Anzahl der CPU-Kerne)")
+    parser.add_argument("--zip", action="store_true", help="Ergebnisse je Polygon als ZIP-Datei ablegen")
+    parser.add_argument("--metriken", help="Prometheus-Textdatei mit Laufzeiten und Zählern des Laufs")
+    parser.add_argument("--profil", help="Profil je Polygon: cprofile, tracemalloc oder beides durch Komma getrennt")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    batch(args.gpkg, args.ausgabe, keys=args.keys, spacing=args.spacing, puffer=args.puffer, gelaende_tif=args.gelaende_tif,
+          name_spalte=args.name_spalte, prozesse=args.prozesse, packen=args.zip, metriken_datei=args.metriken, profil=args.profil,
+          gelaende_grid=args.gelaende_grid, gebaeude_gml=args.gebaeude_gml, xyz_gzip=args.xyz_gzip)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2 @@
+# Benchmark der gesamten Verarbeitung mit lokalen Ersatzservern
+# Aufruf: python -m benchmark.lauf --kacheln 1 10 100 400
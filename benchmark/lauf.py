@@ -0,0 +1,273 @@
+# Durchlauf der Benchmark-Szenarien
+# Jedes Szenario (Bundesland, Anzahl der Kacheln) läuft in einem eigenen Prozess mit leeren Caches gegen den
+# lokalen Ersatzserver (siehe benchmark.server). Die Aufrufe entsprechen denen eines Auftrags (auftraege._ausfuehren):
+# Auflisten, Download mit fensterweisem Lesen, pipeline.verarbeiten mit allen Ausgaben (XYZ, COG, Geländeraster,
+# Gebäudetabelle) und ZIP. Gemessen werden die Laufzeit dieser Aufrufe und der Stufen darin (aus den Metriken des
+# Auftrags), die Gesamtlaufzeit, der maximale Speicherbedarf (Peak RSS) und die übertragenen Bytes.
+# Die Ergebnisse werden als JSON-Datei abgelegt und können mit einem früheren Lauf verglichen werden.
+#
+# Aufruf: python -m benchmark.lauf --kacheln 1 10 100 400 --vergleich benchmark/ergebnisse/alt.json
+
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import logging
+import argparse
+import platform
+import subprocess
+import tempfile
+
+# Bundesland und Ursprung des Gebiets (untere linke Kachel in km) je Szenario
+LAENDER = {
+    "nrw": ("Nordrhein-Westfalen", (350, 5700)),
+    "nds": ("Niedersachsen", (550, 5800)),
+}
+# Abstand des Polygons von den äußeren Kachelrändern in Metern, die Randkacheln werden dadurch teilweise
+# fensterweise gelesen (siehe downloads.fenster)
+RAND = 400
+# Stufen in der Reihenfolge der Verarbeitung, "verarbeiten" umfasst xyz, cog, grid und gebaeude
+STUFEN = ["auflisten", "download", "verarbeiten", "xyz", "cog", "grid", "gebaeude", "zip"]
+# Stufen innerhalb von pipeline.verarbeiten, aus den Metriken des Auftrags
+TEILSTUFEN = ["xyz", "cog", "grid", "gebaeude"]
+
+def gitter(anzahl):
+    """Zerlegt die Anzahl der Kacheln in ein möglichst quadratisches Gitter (Spalten, Zeilen)."""
+    spalten = int(math.sqrt(anzahl))
+    while anzahl % spalten:
+        spalten -= 1
+    return anzahl // spalten, spalten
+
+def kacheln(land, anzahl):
+    """Kacheln (x, y) in km eines Szenarios."""
+    (x0, y0), (spalten, zeilen) = LAENDER[land][1], gitter(anzahl)
+    return [(x0 + i, y0 + j) for i in range(spalten) for j in range(zeilen)]
+
+def polygon(land, anzahl, rand=RAND):
+    """Rechteck, das genau die Kacheln des Szenarios schneidet, rand Meter innerhalb der äußeren Kachelränder, in EPSG:25832."""
+    from shapely.geometry import box
+
+    (x0, y0), (spalten, zeilen) = LAENDER[land][1], gitter(anzahl)
+    return box(x0 * 1000 + rand, y0 * 1000 + rand, (x0 + spalten) * 1000 - rand, (y0 + zeilen) * 1000 - rand)
+
+def _peak_rss():
+    # Maximaler Speicherbedarf des Prozesses in Bytes, None unter Windows
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+def szenario(basis, land, anzahl, arbeitsordner, spacing=1):
+    """
+    Führt ein Szenario im aktuellen Prozess aus. Die Caches werden in arbeitsordner angelegt.
+
+    Returns:
+    dict: Laufzeiten je Stufe in Sekunden, Gesamtlaufzeit, Peak RSS und Größen der Ergebnisse.
+    """
+    import pipeline
+    import archiv
+    import metriken
+    import auftraege
+    from downloads import cache
+    from downloads.get import files, ressource_auftraege
+    from downloads.nrw import katalog
+    from downloads.nds import stac
+    from benchmark.server import umleiten
+
+    cache.CACHE_DIR = os.path.join(arbeitsordner, "cache", "tiles")
+    katalog.KATALOG_PFAD = os.path.join(arbeitsordner, "cache", "nrw_katalog.sqlite")
+    stac.CACHE_DIR = os.path.join(arbeitsordner, "cache", "stac")
+    umleiten(basis)
+
+    bundesland = LAENDER[land][0]
+    flaeche = polygon(land, anzahl)
+    temp_dir = os.path.join(arbeitsordner, "auftrag")
+    zip_pfad = os.path.join(arbeitsordner, "ergebnis.zip")
+    # Alle Ausgaben, wie sie ein Auftrag erzeugen kann
+    optionen = {"spacing": spacing, "puffer": 0, "gelaende_tif": True, "gelaende_grid": True, "gebaeude_gml": False}
+    stufen, rss = {}, {}
+
+    def messen(stufe, funktion, *args, **kwargs):
+        start = time.perf_counter()
+        ergebnis = funktion(*args, **kwargs)
+        stufen[stufe] = time.perf_counter() - start
+        rss[stufe] = _peak_rss()
+        return ergebnis
+
+    gesamt = time.perf_counter()
+    with metriken.auftrag("benchmark {} {}".format(land, anzahl), bereitstellen=False) as auftrag:
+        # Wie in der Anwendung: für das Geländeraster alle Geländekacheln der Bounding Box
+        dateienbeschreibung = messen("auflisten", pipeline.auflisten, flaeche, [bundesland], optionen["puffer"], gelaende_bbox=True)
+        if dateienbeschreibung is None:
+            raise RuntimeError("Keine Dateien für {} aufgelistet".format(bundesland))
+
+        # Wie auftraege._ausfuehren: Rasterkacheln nur im Ausschnitt des gepufferten Polygons
+        os.makedirs(temp_dir)
+        fenster = flaeche.buffer(optionen["puffer"]).bounds
+        messen("download", files, temp_dir, dateienbeschreibung, fenster=fenster)
+        prozesse = max(1, (os.cpu_count() or 1) // auftraege.AUFTRAG_PROZESSE)
+        messen("verarbeiten", pipeline.verarbeiten, temp_dir, dateienbeschreibung, flaeche, prozesse=prozesse, **optionen)
+        messen("zip", archiv.zip_erstellen, temp_dir, zip_pfad)
+    gesamt = time.perf_counter() - gesamt
+    for stufe in TEILSTUFEN:
+        stufen[stufe] = sum(auftrag.zusammenfassung()["stufen"].get(stufe, []))
+
+    return {
+        "land": land,
+        "kacheln": anzahl,
+        "dateien": {k: len(v["files"]) for k, v in dateienbeschreibung.items() if v["type"] == "ressource"},
+        "wandzeit": gesamt,
+        "stufen": stufen,
+        "peak_rss": _peak_rss(),
+        "peak_rss_stufen": rss,
+        "bytes": {
+            "kacheln": sum(os.path.getsize(pfad) for k, v in dateienbeschreibung.items() if v["type"] == "ressource"
+                           for _, pfad in ressource_auftraege(temp_dir, dateienbeschreibung, k) if os.path.exists(pfad)),
+            "xyz": os.path.getsize(os.path.join(temp_dir, "Gelände", "dgm.xyz")),
+            "cog": os.path.getsize(os.path.join(temp_dir, "Gelände", "Gelände_zusammen.tif")),
+            "grid": os.path.getsize(os.path.join(temp_dir, "Gelände", "dgm.asc")),
+            "gebaeude": os.path.getsize(os.path.join(temp_dir, "Gebäude", "gebaeude.gpkg")),
+            "zip": os.path.getsize(zip_pfad),
+        },
+    }
+
+def _git_stand():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip() or None
+    except OSError:
+        return None
+
+def vergleichen(alt, neu, toleranz=0.2, mindestzeit=0.05):
+    """
+    Vergleicht zwei Benchmark-Ergebnisse.
+
+    Parameters:
+    alt (dict): Früheres Ergebnis (Inhalt der JSON-Datei).
+    neu (dict): Aktuelles Ergebnis.
+    toleranz (float): Erlaubte relative Verschlechterung.
+    mindestzeit (float): Kürzere Laufzeiten in Sekunden werden nicht bewertet (Messrauschen).
+
+    Returns:
+    list of str: Beschreibung der Verschlechterungen.
+    """
+    vorher = {(e["land"], e["kacheln"]): e for e in alt["ergebnisse"]}
+    regressionen = []
+    for eintrag in neu["ergebnisse"]:
+        alt_eintrag = vorher.get((eintrag["land"], eintrag["kacheln"]))
+        if alt_eintrag is None:
+            continue
+        werte = [("wandzeit", alt_eintrag["wandzeit"], eintrag["wandzeit"])]
+        werte += [("stufe " + s, alt_eintrag["stufen"].get(s), eintrag["stufen"].get(s)) for s in STUFEN]
+        werte += [("peak_rss", alt_eintrag.get("peak_rss"), eintrag.get("peak_rss"))]
+        for name, a, n in werte:
+            if not a or n is None:
+                continue
+            if name != "peak_rss" and max(a, n) < mindestzeit:
+                continue
+            if n > a * (1 + toleranz):
+                regressionen.append("{} {} Kacheln, {}: {:.3g} -> {:.3g} (+{:.0%})".format(
+                    eintrag["land"], eintrag["kacheln"], name, a, n, n / a - 1))
+    return regressionen
+
+def _tabelle(ergebnisse):
+    zeilen = ["{:<5} {:>7} {:>9} ".format("Land", "Kacheln", "Gesamt") + " ".join("{:>9}".format(s[:9]) for s in STUFEN)
+              + " {:>9} {:>10}".format("RSS MiB", "Bytes MiB")]
+    for e in ergebnisse:
+        zeilen.append("{:<5} {:>7} {:>9.2f} ".format(e["land"], e["kacheln"], e["wandzeit"])
+                      + " ".join("{:>9.2f}".format(e["stufen"].get(s, 0)) for s in STUFEN)
+                      + " {:>9.0f} {:>10.1f}".format((e["peak_rss"] or 0) / 1024 ** 2, e["server"]["bytes"] / 1024 ** 2))
+    return "\n".join(zeilen)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark der Verarbeitung mit lokalen Ersatzservern.")
+    parser.add_argument("--kacheln", type=int, nargs="+", default=[1, 10, 100, 400], help="Anzahl der Kacheln je Szenario")
+    parser.add_argument("--laender", nargs="+", choices=sorted(LAENDER), default=["nrw", "nds"], help="Bundesländer")
+    parser.add_argument("--pixel", type=int, default=500, help="Kantenlänge der GeoTIFF-Kacheln in Pixeln (1000 entspricht DGM1)")
+    parser.add_argument("--gebaeude", type=int, default=50, help="Gebäude je CityGML-Kachel")
+    parser.add_argument("--latenz", type=float, default=0.02, help="Verzögerung jeder Antwort des Servers in Sekunden")
+    parser.add_argument("--spacing", type=int, default=1, help="Auflösung der Geländedatei in Pixeln")
+    parser.add_argument("--daten", help="Ordner für die synthetischen Kacheln (wird wiederverwendet), Standard temporär")
+    parser.add_argument("--ausgabe", help="JSON-Datei der Ergebnisse, Standard benchmark/ergebnisse/<Zeitstempel>.json")
+    parser.add_argument("--vergleich", help="Früheres Ergebnis, bei Verschlechterungen über der Toleranz endet der Lauf mit Fehler")
+    parser.add_argument("--toleranz", type=float, default=0.2, help="Erlaubte relative Verschlechterung beim Vergleich")
+    # Interner Aufruf für ein einzelnes Szenario
+    parser.add_argument("--szenario", nargs=4, metavar=("BASIS", "LAND", "KACHELN", "ORDNER"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.szenario:
+        basis, land, anzahl, ordner = args.szenario
+        json.dump(szenario(basis, land, int(anzahl), ordner, spacing=args.spacing), sys.stdout)
+        return
+
+    from benchmark.server import Daten, Testserver, NRW_PRODUKTE, NDS_PRODUKTE
+
+    wurzel = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    arbeit = tempfile.mkdtemp(prefix="benchmark_")
+    daten = Daten(args.daten or os.path.join(arbeit, "daten"), pixel=args.pixel, gebaeude=args.gebaeude)
+    alle = sorted({k for land in args.laender for k in kacheln(land, max(args.kacheln))})
+    server = Testserver(daten, alle, latenz=args.latenz)
+    basis = server.starten()
+
+    ergebnisse = []
+    try:
+        # Kacheln vorab erzeugen, damit die Erzeugung nicht in die Messung eingeht
+        for land in args.laender:
+            vorlagen = NRW_PRODUKTE.values() if land == "nrw" else [v for _, v in NDS_PRODUKTE.values()]
+            for x, y in kacheln(land, max(args.kacheln)):
+                for vorlage in vorlagen:
+                    daten.pfad(vorlage.format(x, y))
+
+        for land in args.laender:
+            for anzahl in args.kacheln:
+                ordner = os.path.join(arbeit, "{}_{}".format(land, anzahl))
+                os.makedirs(ordner)
+                vorher = server.statistik()
+                prozess = subprocess.run(
+                    [sys.executable, "-m", "benchmark.lauf", "--spacing", str(args.spacing), "--szenario", basis, land, str(anzahl), ordner],
+                    cwd=wurzel, capture_output=True, text=True)
+                if prozess.returncode != 0:
+                    sys.stderr.write(prozess.stderr)
+                    raise RuntimeError("Szenario {} mit {} Kacheln fehlgeschlagen".format(land, anzahl))
+                ergebnis = json.loads(prozess.stdout)
+                nachher = server.statistik()
+                anfragen = {k: {s: v[s] - vorher.get(k, {}).get(s, 0) for s in v} for k, v in nachher.items()}
+                ergebnis["server"] = {"anfragen": anfragen, "bytes": sum(v["bytes"] for v in anfragen.values())}
+                ergebnisse.append(ergebnis)
+                shutil.rmtree(ordner, ignore_errors=True)
+    finally:
+        server.stoppen()
+        shutil.rmtree(arbeit, ignore_errors=True)
+
+    lauf = {
+        "zeit": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git": _git_stand(),
+        "python": platform.python_version(),
+        "plattform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "parameter": {"pixel": args.pixel, "gebaeude": args.gebaeude, "latenz": args.latenz, "spacing": args.spacing},
+        "ergebnisse": ergebnisse,
+    }
+    ausgabe = args.ausgabe or os.path.join(wurzel, "benchmark", "ergebnisse", time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(ausgabe)), exist_ok=True)
+    with open(ausgabe, "w", encoding="utf-8") as f:
+        json.dump(lauf, f, indent=2)
+    print(_tabelle(ergebnisse))
+    print("Ergebnisse: " + ausgabe)
+
+    if args.vergleich:
+        with open(args.vergleich, "r", encoding="utf-8") as f:
+            regressionen = vergleichen(json.load(f), lauf, args.toleranz)
+        for regression in regressionen:
+            print("Verschlechterung: " + regression)
+        if regressionen:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
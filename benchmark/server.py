@@ -0,0 +1,438 @@
+# Lokaler Ersatz für die Geodatenserver
+# Ein HTTP-Server bildet alle Dienste nach, die von der Anwendung abgefragt werden:
+#   - index.json der NRW-Produkte (DGM1, LoD1, ABK)
+#   - STAC-Suche des LGLN mit Seiten und "next"-Links
+#   - WMS GetCapabilities und GetMap
+#   - die Kacheln selbst als synthetische GeoTIFF- bzw. CityGML-Dateien, mit Range-Anfragen (206, auch mehrere
+#     Bereiche als multipart/byteranges) für das fensterweise Lesen über GDAL (siehe downloads.fenster)
+# Die Anfragen an die echten Server werden über umleiten() auf diesen Server umgelenkt, der ursprüngliche Host
+# steht dabei als erster Teil im Pfad (https://host/pfad -> http://127.0.0.1:port/host/pfad).
+# Die Kacheln werden einmal im Datenordner erzeugt und danach von der Festplatte ausgeliefert.
+
+import os
+import io
+import re
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, urlencode, parse_qs
+
+import numpy as np
+
+# Kantenlänge der Kacheln in Metern
+KACHEL_METER = 1000
+# Trennzeile der Antworten mit mehreren Bereichen
+GRENZE = "benchmark-bereiche"
+
+# Dateinamen der synthetischen Kacheln
+muster = {
+    "dgm": re.compile(r"dgm1_32_(\d+)_(\d+)_1_(nw|ni)_(\d{4})\.tif"),
+    "abk": re.compile(r"abk_sw_32(\d+)_(\d+)_1\.tif"),
+    "lod": re.compile(r"LoD1_32_(\d+)_(\d+)_1_(NW|NI)\.gml"),
+}
+
+# Produkte der NRW-index.json, erkannt am Pfad
+NRW_PRODUKTE = {
+    "dgm1_tiff": "dgm1_32_{}_{}_1_nw_2023.tif",
+    "lod1_gml": "LoD1_32_{}_{}_1_NW.gml",
+    "abk_sw_tiff": "abk_sw_32{}_{}_1.tif",
+}
+
+# STAC-Sammlungen des LGLN, erkannt am Host
+NDS_PRODUKTE = {
+    "dgm": ("dgm1-tif", "dgm1_32_{}_{}_1_ni_2021.tif"),
+    "lod": ("lod1-gml", "LoD1_32_{}_{}_1_NI.gml"),
+}
+
+WMS_CAPABILITIES = """<?xml version="1.0" encoding="UTF-8"?>
+<WMS_Capabilities version="1.3.0" xmlns="http://www.opengis.net/wms" xmlns:xlink="http://www.w3.org/1999/xlink">
+<Service><Name>WMS</Name><Title>Benchmark</Title><MaxWidth>4096</MaxWidth><MaxHeight>4096</MaxHeight></Service>
+<Capability>
+<Request>
+<GetCapabilities><Format>text/xml</Format><DCPType><HTTP><Get><OnlineResource xlink:href="http://localhost/"/></Get></HTTP></DCPType></GetCapabilities>
+<GetMap><Format>image/png</Format><DCPType><HTTP><Get><OnlineResource xlink:href="http://localhost/"/></Get></HTTP></DCPType></GetMap>
+</Request>
+<Layer><Title>Benchmark</Title><CRS>EPSG:25832</CRS>
+<Layer queryable="0"><Name>adv_alkis_flurstuecke</Name><Title>Flurstücke</Title></Layer>
+<Layer queryable="0"><Name>ALKIS</Name><Title>ALKIS</Title></Layer>
+</Layer>
+</Capability>
+</WMS_Capabilities>
+""".encode("utf-8")
+
+class Daten:
+    """
+    Synthetische Kacheln in einem Ordner.
+
+    Parameters:
+    ordner (str): Ablage der erzeugten Dateien.
+    pixel (int): Kantenlänge der GeoTIFF-Kacheln in Pixeln (1000 entspricht DGM1).
+    gebaeude (int): Anzahl der Gebäude je CityGML-Kachel.
+    """
+    def __init__(self, ordner, pixel=500, gebaeude=50):
+        self.ordner = ordner
+        self.pixel = pixel
+        self.gebaeude = gebaeude
+        self._locks = {}
+        self._lock = threading.Lock()
+        os.makedirs(ordner, exist_ok=True)
+
+    def pfad(self, name):
+        """Pfad einer Kachel, die Datei wird beim ersten Zugriff erzeugt. None für unbekannte Namen."""
+        if not any(m.fullmatch(name) for m in muster.values()):
+            return None
+        pfad = os.path.join(self.ordner, name)
+        with self._lock:
+            lock = self._locks.setdefault(name, threading.Lock())
+        with lock:
+            if not os.path.exists(pfad):
+                tmp = pfad + ".tmp"
+                self._erzeugen(name, tmp)
+                os.replace(tmp, pfad)
+        return pfad
+
+    def _erzeugen(self, name, pfad):
+        treffer = muster["dgm"].fullmatch(name)
+        if treffer:
+            self._geotiff(pfad, int(treffer.group(1)), int(treffer.group(2)), "float32")
+            return
+        treffer = muster["abk"].fullmatch(name)
+        if treffer:
+            self._geotiff(pfad, int(treffer.group(1)), int(treffer.group(2)), "uint8")
+            return
+        treffer = muster["lod"].fullmatch(name)
+        self._citygml(pfad, int(treffer.group(1)), int(treffer.group(2)))
+
+    def _geotiff(self, pfad, x, y, dtype):
+        import rasterio
+        from rasterio.transform import from_origin
+
+        groesse = KACHEL_METER / self.pixel
+        links, oben = x * KACHEL_METER, (y + 1) * KACHEL_METER
+        # Durchgehendes Gelände über die Kachelgrenzen, dazu ein reproduzierbares Rauschen je Kachel
+        achse = (np.arange(self.pixel) + 0.5) * groesse
+        ost = links + achse
+        nord = oben - achse
+        werte = 80 + 20 * np.sin(ost / 700)[None, :] + 15 * np.cos(nord / 900)[:, None]
+        rng = np.random.default_rng(x * 100000 + y)
+        werte = werte + rng.normal(0, 0.3, werte.shape)
+        if dtype == "uint8":
+            werte = np.where(rng.random(werte.shape) < 0.1, 0, 255)
+        with rasterio.open(
+            pfad, "w", driver="GTiff", height=self.pixel, width=self.pixel, count=1, dtype=dtype,
+            crs="EPSG:25832", transform=from_origin(links, oben, groesse, groesse),
+            tiled=True, blockxsize=256, blockysize=256, compress="deflate"
+        ) as dst:
+            dst.write(werte.astype(dtype), 1)
+
+    def _citygml(self, pfad, x, y):
+        rng = np.random.default_rng(x * 100000 + y)
+        with open(pfad, "w", encoding="utf-8") as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                    '<core:CityModel xmlns:core="http://www.opengis.net/citygml/1.0" '
+                    'xmlns:bldg="http://www.opengis.net/citygml/building/1.0" xmlns:gml="http://www.opengis.net/gml">\n'
+                    '<gml:boundedBy><gml:Envelope srsName="urn:adv:crs:ETRS89_UTM32*DE_DHHN2016_NH" srsDimension="3">'
+                    '<gml:lowerCorner>{} {} 0</gml:lowerCorner><gml:upperCorner>{} {} 200</gml:upperCorner>'
+                    '</gml:Envelope></gml:boundedBy>\n'.format(
+                        x * KACHEL_METER, y * KACHEL_METER, (x + 1) * KACHEL_METER, (y + 1) * KACHEL_METER))
+            for i in range(self.gebaeude):
+                ox, oy = x * KACHEL_METER + rng.uniform(0, KACHEL_METER - 30), y * KACHEL_METER + rng.uniform(0, KACHEL_METER - 30)
+                b, t = rng.uniform(8, 25, 2)
+                boden, hoehe = 80 + rng.uniform(-10, 10), rng.uniform(3, 30)
+                ring = [(ox, oy), (ox + b, oy), (ox + b, oy + t), (ox, oy + t), (ox, oy)]
+                flaechen = "".join(
+                    '<gml:surfaceMember><gml:Polygon><gml:exterior><gml:LinearRing><gml:posList srsDimension="3">{}'
+                    '</gml:posList></gml:LinearRing></gml:exterior></gml:Polygon></gml:surfaceMember>'.format(
+                        " ".join("{:.3f} {:.3f} {:.3f}".format(px, py, z) for px, py in (ring if z > boden else ring[::-1])))
+                    for z in (boden, boden + hoehe))
+                f.write('<core:cityObjectMember><bldg:Building gml:id="DENW_{}_{}_{}">'
+                        '<bldg:measuredHeight uom="urn:adv:uom:m">{:.2f}</bldg:measuredHeight>'
+                        '<bldg:lod1Solid><gml:Solid><gml:exterior><gml:CompositeSurface>{}</gml:CompositeSurface>'
+                        '</gml:exterior></gml:Solid></bldg:lod1Solid></bldg:Building></core:cityObjectMember>\n'.format(
+                            x, y, i, hoehe, flaechen))
+            f.write("</core:CityModel>\n")
+
+class Testserver:
+    """
+    Lokaler HTTP-Server, der die Geodatendienste nachbildet.
+
+    Parameters:
+    daten (Daten): Synthetische Kacheln.
+    kacheln (list of tuple): Vorhandene Kacheln (x, y) in km, für index.json und STAC-Suche.
+    latenz (float): Verzögerung jeder Antwort in Sekunden.
+    index_fuellung (int): Zusätzliche Einträge je index.json, damit der Katalog die Größe des echten erreicht.
+    seite_max (int): Höchstzahl der Elemente je STAC-Seite.
+    """
+    def __init__(self, daten, kacheln, latenz=0.02, index_fuellung=35000, seite_max=100):
+        self.daten = daten
+        self.kacheln = list(kacheln)
+        self.latenz = latenz
+        self.index_fuellung = index_fuellung
+        self.seite_max = seite_max
+        self._statistik = {}
+        self._lock = threading.Lock()
+        self._index = {}
+        self._stac_bbox = None
+        self._png = {}
+        self._server = None
+
+    def starten(self):
+        """Startet den Server in einem Hintergrund-Thread und gibt die Basis-URL zurück."""
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server._anfrage(self)
+
+            def do_HEAD(self):
+                server._anfrage(self, kopf=True)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.basis
+
+    @property
+    def basis(self):
+        return "http://127.0.0.1:{}".format(self._server.server_address[1])
+
+    def stoppen(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def statistik(self):
+        """Anfragen und gesendete Bytes je Art der Anfrage (index, stac, wms, kachel, bereich für Range-Anfragen)."""
+        with self._lock:
+            return {k: dict(v) for k, v in self._statistik.items()}
+
+    def _zaehlen(self, art, groesse):
+        with self._lock:
+            eintrag = self._statistik.setdefault(art, {"anfragen": 0, "bytes": 0})
+            eintrag["anfragen"] += 1
+            eintrag["bytes"] += groesse
+
+    def _senden(self, handler, art, status, inhalt, content_type, header=None):
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(inhalt)))
+        for name, wert in (header or {}).items():
+            handler.send_header(name, wert)
+        handler.end_headers()
+        handler.wfile.write(inhalt)
+        self._zaehlen(art, len(inhalt))
+
+    def _anfrage(self, handler, kopf=False):
+        time.sleep(self.latenz)
+        teile = urlsplit(handler.path)
+        pfad = re.sub("/+", "/", teile.path)
+        host = pfad.lstrip("/").split("/", 1)[0]
+        params = {k.lower(): v[0] for k, v in parse_qs(teile.query).items()}
+        name = pfad.rsplit("/", 1)[-1]
+
+        if params.get("service", "").upper() == "WMS":
+            self._wms(handler, params)
+        elif name == "index.json":
+            self._nrw_index(handler, pfad)
+        elif name == "search":
+            self._stac(handler, host, params)
+        else:
+            self._kachel(handler, name, kopf)
+
+    def _nrw_index(self, handler, pfad):
+        produkt = next((p for p in NRW_PRODUKTE if "/" + p + "/" in pfad), None)
+        if produkt is None:
+            self._senden(handler, "index", 404, b"", "text/plain")
+            return
+        if produkt not in self._index:
+            vorlage = NRW_PRODUKTE[produkt]
+            dateien = [{"name": vorlage.format(x, y), "size": 0, "timestamp": "2023-06-01T00:00:00"} for x, y in self.kacheln]
+            # Füllung mit Kacheln außerhalb des Gebiets
+            dateien += [{"name": vorlage.format(100 + i % 500, 1000 + i // 500), "size": 0, "timestamp": "2023-06-01T00:00:00"}
+                        for i in range(self.index_fuellung)]
+            inhalt = json.dumps({"datasets": [{"files": dateien}]}).encode("utf-8")
+            self._index[produkt] = (inhalt, '"{}"'.format(hash(inhalt) & 0xFFFFFFFF))
+        inhalt, etag = self._index[produkt]
+        if handler.headers.get("If-None-Match") == etag:
+            self._senden(handler, "index", 304, b"", "application/json", {"ETag": etag})
+            return
+        self._senden(handler, "index", 200, inhalt, "application/json", {"ETag": etag})
+
+    def _stac_elemente(self, sammlung):
+        from koordinaten import transformer
+
+        if self._stac_bbox is None:
+            t = transformer("EPSG:25832", "EPSG:4326")
+            self._stac_bbox = {(x, y): t.transform_bounds(x * KACHEL_METER, y * KACHEL_METER, (x + 1) * KACHEL_METER, (y + 1) * KACHEL_METER)
+                               for x, y in self.kacheln}
+            # Umriss der Kachel aus den vier Ecken
+            self._stac_umriss = {(x, y): [list(t.transform(ex * KACHEL_METER, ey * KACHEL_METER))
+                                          for ex, ey in ((x, y), (x + 1, y), (x + 1, y + 1), (x, y + 1), (x, y))]
+                                 for x, y in self.kacheln}
+        asset, vorlage = NDS_PRODUKTE[sammlung]
+        return [{
+            "type": "Feature",
+            "id": vorlage.format(x, y)[:-4],
+            "bbox": list(self._stac_bbox[(x, y)]),
+            "geometry": {"type": "Polygon", "coordinates": [self._stac_umriss[(x, y)]]},
+            "properties": {"datetime": "2021-01-01T00:00:00Z"},
+            "assets": {asset: {"href": "https://{}.daten.lgln.niedersachsen.de/{}".format(sammlung, vorlage.format(x, y))}},
+        } for x, y in self.kacheln]
+
+    def _stac(self, handler, host, params):
+        sammlung = host.split(".", 1)[0]
+        if sammlung not in NDS_PRODUKTE or "bbox" not in params:
+            self._senden(handler, "stac", 400, b"", "application/json")
+            return
+        minx, miny, maxx, maxy = (float(v) for v in params["bbox"].split(","))
+        elemente = [e for e in self._stac_elemente(sammlung)
+                    if e["bbox"][0] <= maxx and e["bbox"][2] >= minx and e["bbox"][1] <= maxy and e["bbox"][3] >= miny]
+        limit = min(int(params.get("limit", 10)), self.seite_max)
+        start = int(params.get("token", 0))
+        links = []
+        if start + limit < len(elemente):
+            links.append({"rel": "next", "href": "https://{}/search?{}".format(
+                host, urlencode({"bbox": params["bbox"], "limit": limit, "token": start + limit}))})
+        inhalt = json.dumps({"type": "FeatureCollection", "features": elemente[start:start + limit], "links": links}).encode("utf-8")
+        self._senden(handler, "stac", 200, inhalt, "application/geo+json")
+
+    def _wms(self, handler, params):
+        if params.get("request", "").lower() == "getcapabilities":
+            self._senden(handler, "wms", 200, WMS_CAPABILITIES, "text/xml")
+            return
+        breite, hoehe = int(params["width"]), int(params["height"])
+        with self._lock:
+            inhalt = self._png.get((breite, hoehe))
+        if inhalt is None:
+            from PIL import Image
+            # Raster aus Linien wie bei einer Flurkarte, lässt sich schnell kodieren
+            bild = np.full((hoehe, breite), 255, np.uint8)
+            bild[::64, :] = 0
+            bild[:, ::64] = 0
+            puffer = io.BytesIO()
+            Image.fromarray(bild, "L").convert("RGBA").save(puffer, "PNG")
+            inhalt = puffer.getvalue()
+            with self._lock:
+                self._png[(breite, hoehe)] = inhalt
+        self._senden(handler, "wms", 200, inhalt, "image/png")
+
+    def _kachel(self, handler, name, kopf=False):
+        pfad = self.daten.pfad(name)
+        if pfad is None:
+            self._senden(handler, "kachel", 404, b"", "text/plain")
+            return
+        stat = os.stat(pfad)
+        etag = '"{:x}-{:x}"'.format(int(stat.st_mtime), stat.st_size)
+        if handler.headers.get("If-None-Match") == etag:
+            self._senden(handler, "kachel", 304, b"", "application/octet-stream", {"ETag": etag})
+            return
+        bereiche = _bereiche(handler.headers.get("Range"), stat.st_size)
+        if bereiche == []:
+            self._senden(handler, "kachel", 416, b"", "text/plain", {"Content-Range": "bytes */{}".format(stat.st_size)})
+            return
+        if bereiche is not None and not kopf:
+            self._bereiche_senden(handler, pfad, bereiche, stat.st_size, etag)
+            return
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/octet-stream")
+        handler.send_header("Content-Length", str(stat.st_size))
+        handler.send_header("Accept-Ranges", "bytes")
+        handler.send_header("ETag", etag)
+        handler.end_headers()
+        if kopf:
+            return
+        with open(pfad, "rb") as f:
+            while True:
+                chunk = f.read(1024 * 1024)
+                if not chunk:
+                    break
+                handler.wfile.write(chunk)
+        self._zaehlen("kachel", stat.st_size)
+
+    def _bereiche_senden(self, handler, pfad, bereiche, groesse, etag):
+        # Ein Bereich als einfache Antwort, mehrere als multipart/byteranges
+        with open(pfad, "rb") as f:
+            teile = []
+            for start, ende in bereiche:
+                f.seek(start)
+                teile.append(f.read(ende - start + 1))
+        header = {"Accept-Ranges": "bytes", "ETag": etag}
+        if len(bereiche) == 1:
+            header["Content-Range"] = "bytes {}-{}/{}".format(bereiche[0][0], bereiche[0][1], groesse)
+            self._senden(handler, "bereich", 206, teile[0], "application/octet-stream", header)
+            return
+        inhalt = b"".join(
+            "--{}\r\nContent-Type: application/octet-stream\r\nContent-Range: bytes {}-{}/{}\r\n\r\n".format(
+                GRENZE, start, ende, groesse).encode("ascii") + teil + b"\r\n"
+            for (start, ende), teil in zip(bereiche, teile)) + "--{}--\r\n".format(GRENZE).encode("ascii")
+        self._senden(handler, "bereich", 206, inhalt, "multipart/byteranges; boundary=" + GRENZE, header)
+
+def _bereiche(kopfzeile, groesse):
+    """
+    Bereiche einer Range-Kopfzeile als Liste von (Start, Ende) mit Ende einschließlich.
+
+    Returns:
+    list of tuple: None ohne (gültige) Range-Kopfzeile, leer, wenn kein Bereich in der Datei liegt.
+    """
+    if not kopfzeile or not kopfzeile.strip().startswith("bytes="):
+        return None
+    bereiche = []
+    for teil in kopfzeile.strip()[6:].split(","):
+        start, _, ende = teil.strip().partition("-")
+        try:
+            if start:
+                start, ende = int(start), min(int(ende) if ende else groesse - 1, groesse - 1)
+            else:
+                # Letzte Bytes der Datei
+                start, ende = max(0, groesse - int(ende)), groesse - 1
+        except ValueError:
+            return None
+        if start <= ende:
+            bereiche.append((start, ende))
+    return bereiche
+
+def umleiten(basis, session=None):
+    """
+    Lenkt alle HTTPS-Anfragen der gemeinsamen Session auf den Testserver um.
+
+    Je ursprünglichem Host wird ein eigener Verbindungspool verwendet, damit die Begrenzung der
+    Verbindungen je Host (downloads.get.MAX_PRO_HOST) wie bei den echten Servern wirkt.
+    Das fensterweise Lesen über GDAL wird ebenfalls umgelenkt (downloads.fenster.umleitung).
+    """
+    from requests.adapters import HTTPAdapter
+    from downloads import fenster
+    from downloads.get import get_session, Adapter, MAX_PRO_HOST
+
+    def umlenken(url):
+        teile = urlsplit(url)
+        return "{}/{}{}{}".format(basis, teile.netloc, teile.path, "?" + teile.query if teile.query else "")
+
+    fenster.umleitung = umlenken
+
+    class Umleitung(HTTPAdapter):
+        def __init__(self):
+            super().__init__()
+            self._adapter = {}
+            self._lock = threading.Lock()
+
+        def send(self, request, **kwargs):
+            teile = urlsplit(request.url)
+            with self._lock:
+                adapter = self._adapter.get(teile.netloc)
+                if adapter is None:
+                    adapter = self._adapter[teile.netloc] = Adapter(pool_maxsize=MAX_PRO_HOST, pool_block=True)
+            request.url = umlenken(request.url)
+            return adapter.send(request, **kwargs)
+
+        def close(self):
+            for adapter in self._adapter.values():
+                adapter.close()
+
+    session = session or get_session()
+    session.mount("https://", Umleitung())
+    return session
@@ -0,0 +1,172 @@
+# Ermittlung der Bundesländer eines Polygons
+# Grundlage ist eine GeoPackage-Datei mit den Landesgrenzen in EPSG:25832 (Spalte "name"),
+# die mit erstellen() aus den Verwaltungsgebieten VG250 des BKG (Ebene VG250_LAN) erzeugt wird:
+# https://gdz.bkg.bund.de/index.php/default/verwaltungsgebiete-1-250-000-stand-01-01-vg250-01-01.html
+# Der räumliche Index wird einmal je Prozess aufgebaut.
+#
+# Die Datei wird einmal erzeugt (VG250 herunterladen und entpacken):
+#   python -m bundeslaender vg250_ebenen_0101/VG250_LAN.shp
+# Fehlt die Datei, werden die Bundesländer über Nominatim an den Ecken und in der Mitte des Polygons ermittelt
+# (siehe _nominatim). Die Polygone werden dann nicht an den Landesgrenzen geteilt (grenze liefert None).
+
+import os
+import time
+import logging
+import argparse
+import threading
+import functools
+
+import requests
+
+# Pfad der Landesgrenzen
+DATEN_PFAD = os.path.join(os.path.dirname(os.path.abspath(__file__)), "daten", "bundeslaender.gpkg")
+
+# Nominatim erlaubt höchstens eine Anfrage je Sekunde
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/reverse"
+NOMINATIM_ABSTAND = 1.0
+
+_index = None
+_index_lock = threading.Lock()
+_nominatim_lock = threading.Lock()
+_nominatim_zuletzt = 0.0
+
+def erstellen(quelle, ziel=DATEN_PFAD, toleranz=25):
+    """
+    Erzeugt die Datei der Landesgrenzen aus den VG250-Daten des BKG.
+
+    Parameters:
+    quelle (str): Pfad zur VG250-Datei (z.B. "vg250_ebenen_0101/VG250_LAN.shp" oder die GeoPackage-Ebene).
+    ziel (str): Pfad der erzeugten GeoPackage-Datei.
+    toleranz (float): Toleranz der Vereinfachung der Grenzen in Metern.
+    """
+    import geopandas as gpd
+
+    gdf = gpd.read_file(quelle)
+    # Nur Landflächen (GF 4), ohne Wasserflächen der Küstengewässer
+    if "GF" in gdf.columns:
+        gdf = gdf[gdf["GF"] == 4]
+    gdf = gdf.dissolve(by="GEN", as_index=False)[["GEN", "geometry"]].rename(columns={"GEN": "name"})
+    gdf = gdf.to_crs("EPSG:25832")
+    gdf["geometry"] = gdf.geometry.simplify(toleranz, preserve_topology=True)
+    os.makedirs(os.path.dirname(ziel), exist_ok=True)
+    gdf.to_file(ziel, driver="GPKG")
+
+def _laden():
+    global _index
+    with _index_lock:
+        if _index is None:
+            import geopandas as gpd
+            from shapely import STRtree
+            from shapely.prepared import prep
+
+            gdf = gpd.read_file(DATEN_PFAD).to_crs("EPSG:25832")
+            geometrien = list(gdf.geometry)
+            _index = {
+                "namen": list(gdf["name"]),
+                "geometrien": geometrien,
+                "vorbereitet": [prep(g) for g in geometrien],
+                "baum": STRtree(geometrien),
+            }
+    return _index
+
+def verfuegbar():
+    """Gibt an, ob die Datei der Landesgrenzen vorhanden ist."""
+    return os.path.exists(DATEN_PFAD)
+
+@functools.lru_cache(maxsize=1024)
+def _nominatim_land(lat, lon):
+    # Bundesland eines Punktes, None außerhalb eines Bundeslandes
+    global _nominatim_zuletzt
+    header = { "User-Agent": "RichtersHuels", "Referrer": "info@richtershuels.de", "From": "info@richtershuels.de" }
+    with _nominatim_lock:
+        time.sleep(max(0.0, _nominatim_zuletzt + NOMINATIM_ABSTAND - time.monotonic()))
+        try:
+            response = requests.get(NOMINATIM_URL, params={"format": "json", "lat": lat, "lon": lon, "zoom": 5}, headers=header, timeout=30)
+        finally:
+            _nominatim_zuletzt = time.monotonic()
+    response.raise_for_status()
+    return response.json().get("address", {}).get("state")
+
+def _nominatim(polygon):
+    """
+    Ermittelt die Bundesländer über Nominatim an den Ecken der Bounding Box und einem Punkt im Polygon.
+
+    Die Schnittfläche wird aus dem Anteil der Punkte je Bundesland geschätzt.
+
+    Raises:
+    RuntimeError: Wenn keiner der Punkte abgefragt werden kann.
+    """
+    from koordinaten import epsg25832_to_latlon
+
+    minx, miny, maxx, maxy = polygon.bounds
+    mitte = polygon.representative_point()
+    punkte = list(dict.fromkeys([(mitte.x, mitte.y), (minx, miny), (minx, maxy), (maxx, maxy), (maxx, miny)]))
+    anzahl, abgefragt = {}, 0
+    for x, y in punkte:
+        lat, lon = epsg25832_to_latlon(x, y)
+        try:
+            land = _nominatim_land(round(float(lat), 5), round(float(lon), 5))
+        except (requests.RequestException, ValueError) as e:
+            logging.error("Fehler beim Abrufen des Bundeslandes bei {:.0f}, {:.0f}: {}".format(x, y, e))
+            continue
+        abgefragt += 1
+        if land:
+            anzahl[land] = anzahl.get(land, 0) + 1
+    if abgefragt == 0:
+        raise RuntimeError("Das Bundesland konnte nicht ermittelt werden: Nominatim ist nicht erreichbar und die Landesgrenzen {} fehlen.".format(DATEN_PFAD))
+    ergebnis = [(land, polygon.area * n / abgefragt) for land, n in anzahl.items()]
+    return sorted(ergebnis, key=lambda e: e[1], reverse=True)
+
+def bundeslaender(polygon):
+    """
+    Ermittelt alle Bundesländer, die ein Polygon schneiden.
+
+    Ohne die Datei der Landesgrenzen über Nominatim (siehe _nominatim), die Flächen sind dann geschätzt.
+
+    Parameters:
+    polygon (shapely.geometry.Polygon): Polygon in EPSG:25832.
+
+    Returns:
+    list of tuple: (Bundesland, Schnittfläche in m²), absteigend nach Fläche sortiert.
+
+    Raises:
+    RuntimeError: Wenn die Datei fehlt und Nominatim nicht erreichbar ist.
+    """
+    if not verfuegbar():
+        return _nominatim(polygon)
+    index = _laden()
+    ergebnis = []
+    for i in index["baum"].query(polygon, predicate="intersects"):
+        if index["vorbereitet"][i].contains(polygon):
+            # Häufigster Fall: das Polygon liegt vollständig in einem Land
+            flaeche = polygon.area
+        else:
+            flaeche = index["geometrien"][i].intersection(polygon).area
+        if flaeche > 0:
+            ergebnis.append((index["namen"][i], flaeche))
+    return sorted(ergebnis, key=lambda e: e[1], reverse=True)
+
+def grenze(name):
+    """
+    Fläche eines Bundeslandes in EPSG:25832 (vereinfachte Grenze, siehe erstellen).
+
+    Returns:
+    shapely.geometry.base.BaseGeometry oder None, wenn das Bundesland nicht enthalten ist oder die Datei fehlt.
+    """
+    if not verfuegbar():
+        return None
+    index = _laden()
+    if name not in index["namen"]:
+        return None
+    return index["geometrien"][index["namen"].index(name)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Erzeugt die Landesgrenzen aus den Verwaltungsgebieten VG250 des BKG.")
+    parser.add_argument("quelle", help="VG250-Ebene der Länder, z.B. vg250_ebenen_0101/VG250_LAN.shp")
+    parser.add_argument("--ziel", default=DATEN_PFAD, help="Pfad der GeoPackage-Datei (Standard: {})".format(DATEN_PFAD))
+    parser.add_argument("--toleranz", type=float, default=25, help="Toleranz der Vereinfachung in Metern")
+    args = parser.parse_args()
+    erstellen(args.quelle, args.ziel, args.toleranz)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+# Gemeinsamer Cache für heruntergeladene Kacheln
+# Die Dateien werden über den Hash der vollständigen URL (Anbieter-URL und Dateiname) abgelegt
+# Neben jeder Datei liegt eine JSON-Datei mit ETag, Last-Modified und dem Zeitpunkt der letzten Prüfung
+# Geschrieben wird immer in eine temporäre Datei, die anschließend atomar umbenannt wird.
+# Dadurch können mehrere Streamlit-Sitzungen den Cache gleichzeitig nutzen.
+# Bricht die Übertragung ab, wird sie mit einer Range-Anfrage ab dem bereits geschriebenen Byte fortgesetzt.
+# Jede Datei wird vor der Übernahme geprüft (Größe, Prüfsumme des Servers, Dateikennung).
+
+import os
+import json
+import time
+import base64
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+
+import requests
+
+import metriken
+
+# Ordner des Caches
+CACHE_DIR = os.environ.get("GEODATEN_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "tiles"))
+# Maximale Größe des Caches in Bytes, ältere Einträge werden zuerst entfernt
+CACHE_MAX_BYTES = int(os.environ.get("GEODATEN_CACHE_MAX_BYTES", 20 * 1024 ** 3))
+# Einträge, die vor weniger als REVALIDIEREN_NACH Sekunden geprüft wurden, werden ohne Anfrage verwendet
+REVALIDIEREN_NACH = 24 * 3600
+# Blockgröße beim Schreiben der Downloads
+CHUNK_SIZE = 1024 * 1024
+
+_statistik = {"hits": 0, "revalidiert": 0, "misses": 0}
+_statistik_lock = threading.Lock()
+
+def _zaehlen(name):
+    with _statistik_lock:
+        _statistik[name] += 1
+    metriken.zaehlen("cache", ergebnis={"hits": "hit", "revalidiert": "revalidiert", "misses": "miss"}[name])
+
+def statistik():
+    """
+    Zähler des Caches seit dem Start des Prozesses.
+
+    Returns:
+    dict: hits (ohne Anfrage verwendet), revalidiert (304 vom Server) und misses (heruntergeladen).
+    """
+    with _statistik_lock:
+        return dict(_statistik)
+
+def _pfade(url):
+    schluessel = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    ordner = os.path.join(CACHE_DIR, schluessel[:2])
+    return os.path.join(ordner, schluessel), os.path.join(ordner, schluessel + ".json")
+
+def _lesen_meta(meta_pfad):
+    try:
+        with open(meta_pfad, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _atomar_schreiben(pfad, schreiben):
+    # Temporäre Datei im gleichen Ordner, damit os.replace atomar ist
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(pfad), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            schreiben(f)
+        os.replace(tmp, pfad)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def _schreiben_meta(meta_pfad, meta):
+    _atomar_schreiben(meta_pfad, lambda f: f.write(json.dumps(meta).encode("utf-8")))
+
+# Dateikennungen (Magic Bytes) je Dateiendung
+_KENNUNGEN = {
+    ".tif": (b"II*\x00", b"MM\x00*", b"II+\x00", b"MM\x00+"),
+    ".tiff": (b"II*\x00", b"MM\x00*", b"II+\x00", b"MM\x00+"),
+    ".zip": (b"PK",),
+}
+
+def _pruefsumme(headers):
+    """Prüfsumme des Servers aus Content-MD5 oder Digest / Repr-Digest als (Algorithmus, Bytes), sonst None."""
+    if headers.get("Content-MD5"):
+        return "md5", base64.b64decode(headers["Content-MD5"])
+    for name in ("Repr-Digest", "Digest"):
+        for teil in headers.get(name, "").split(","):
+            algorithmus, _, wert = teil.strip().partition("=")
+            algorithmus = algorithmus.lower()
+            if algorithmus in ("sha-256", "md5") and wert:
+                return algorithmus.replace("-", ""), base64.b64decode(wert.strip(":"))
+    return None
+
+def _pruefen(url, pfad, groesse, erwartet, headers):
+    """
+    Prüft eine heruntergeladene Datei.
+
+    Returns:
+    str: Beschreibung des Fehlers oder None, wenn die Datei vollständig ist.
+    """
+    if erwartet is not None and groesse != erwartet:
+        return "unvollständig ({} von {} Bytes)".format(groesse, erwartet)
+    kennungen = _KENNUNGEN.get(os.path.splitext(url.split("?")[0])[1].lower())
+    with open(pfad, "rb") as f:
+        anfang = f.read(64)
+        if kennungen is not None and not anfang.startswith(kennungen):
+            return "keine gültige Datei (beginnt mit {!r})".format(anfang[:16])
+        if url.split("?")[0].lower().endswith((".gml", ".xml")) and not anfang.lstrip(b"\xef\xbb\xbf \t\r\n").startswith(b"<"):
+            return "keine XML-Datei (beginnt mit {!r})".format(anfang[:16])
+        pruefsumme = _pruefsumme(headers)
+        if pruefsumme is not None:
+            algorithmus, wert = pruefsumme
+            f.seek(0)
+            h = hashlib.new(algorithmus)
+            for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+                h.update(block)
+            if h.digest() != wert:
+                return "Prüfsumme {} stimmt nicht".format(algorithmus)
+    return None
+
+def _herunterladen(url, daten_pfad, session, headers):
+    """
+    Lädt url nach daten_pfad, abgebrochene Übertragungen werden mit Range fortgesetzt.
+
+    Die Anfrage selbst wiederholt der Adapter der Session (siehe downloads.get.Adapter). Bricht die Verbindung
+    während der Übertragung ab, wird nach einer Wartezeit ab dem bereits geschriebenen Byte weitergeladen.
+    Eine unvollständige oder fehlerhafte Datei wird insgesamt neu geladen.
+
+    Returns:
+    tuple: (Status, Header der Antwort), Status 200 (geladen), 304 (nicht geändert) oder None (Fehler).
+    """
+    from downloads.get import WIEDERHOLUNGEN, wartezeit
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(daten_pfad), suffix=".tmp")
+    os.close(fd)
+    geladen, erwartet, kopf = 0, None, None
+    try:
+        for versuch in range(WIEDERHOLUNGEN + 1):
+            if versuch:
+                time.sleep(wartezeit(versuch))
+                metriken.zaehlen("wiederholungen")
+            anfrage = dict(headers)
+            if geladen:
+                # Fortsetzen, aber nur, wenn sich die Datei auf dem Server nicht geändert hat
+                anfrage = {"Range": "bytes={}-".format(geladen)}
+                if kopf.get("ETag") or kopf.get("Last-Modified"):
+                    anfrage["If-Range"] = kopf.get("ETag") or kopf.get("Last-Modified")
+            try:
+                response = session.get(url, stream=True, headers=anfrage)
+            except requests.RequestException as e:
+                # Der Adapter hat die Anfrage bereits wiederholt
+                logging.error("Fehler beim Download von {}: {}".format(url, e))
+                return None, None
+            try:
+                with response:
+                    if response.status_code == 304 and not geladen:
+                        return 304, response.headers
+                    if response.status_code == 206 and geladen and response.headers.get("Content-Range", "").startswith("bytes {}-".format(geladen)):
+                        modus = "ab"
+                    elif response.status_code == 200:
+                        # Vollständige Datei, auch wenn der Server Range nicht unterstützt
+                        geladen, modus, kopf = 0, "wb", response.headers
+                        erwartet = int(kopf["Content-Length"]) if kopf.get("Content-Length") and not kopf.get("Content-Encoding") else None
+                    else:
+                        logging.error("Fehler beim Download von {}: HTTP {}".format(url, response.status_code))
+                        return None, None
+                    with open(tmp, modus) as f:
+                        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                            f.write(chunk)
+                            geladen += len(chunk)
+                            metriken.zaehlen("bytes", len(chunk))
+            except requests.RequestException as e:
+                logging.warning("Download von {} nach {} Bytes abgebrochen, wird fortgesetzt: {}".format(url, geladen, e))
+                continue
+
+            fehler = _pruefen(url, tmp, geladen, erwartet, kopf)
+            if fehler is None:
+                os.replace(tmp, daten_pfad)
+                return 200, kopf
+            logging.warning("Download von {} {}, wird wiederholt".format(url, fehler))
+            geladen = 0
+        logging.error("Download von {} nach {} Wiederholungen fehlgeschlagen".format(url, WIEDERHOLUNGEN))
+        return None, None
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def _bereitstellen(daten_pfad, ziel):
+    # Hardlink, wenn möglich, sonst Kopie
+    if os.path.exists(ziel):
+        os.remove(ziel)
+    try:
+        os.link(daten_pfad, ziel)
+    except OSError:
+        shutil.copyfile(daten_pfad, ziel)
+
+def abrufen(url, ziel, session):
+    """
+    Stellt die Datei hinter url unter ziel bereit, aus dem Cache oder per Download.
+
+    Ein vorhandener Eintrag wird nach REVALIDIEREN_NACH Sekunden mit If-None-Match / If-Modified-Since
+    beim Server geprüft und nur bei Änderungen neu geladen. Einträge, deren Größe nicht mehr stimmt, werden neu geladen.
+
+    Parameters:
+    url (str): Vollständige URL der Datei.
+    ziel (str): Zielpfad der Datei.
+    session (requests.Session): Session für die Anfrage.
+
+    Returns:
+    bool: True, wenn die Datei bereitgestellt wurde.
+    """
+    daten_pfad, meta_pfad = _pfade(url)
+    os.makedirs(os.path.dirname(daten_pfad), exist_ok=True)
+    meta = _lesen_meta(meta_pfad) if os.path.exists(daten_pfad) else None
+    if meta is not None and meta.get("groesse") is not None and os.path.getsize(daten_pfad) != meta["groesse"]:
+        logging.warning("Eintrag im Cache für {} ist beschädigt und wird neu geladen".format(url))
+        meta = None
+
+    if meta is not None and time.time() - meta["geprueft"] < REVALIDIEREN_NACH:
+        _zaehlen("hits")
+    else:
+        headers = {}
+        if meta is not None and meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta is not None and meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+        status, antwort = _herunterladen(url, daten_pfad, session, headers)
+        if status == 304 and meta is not None:
+            _zaehlen("revalidiert")
+            meta["geprueft"] = time.time()
+            _schreiben_meta(meta_pfad, meta)
+        elif status == 200:
+            _zaehlen("misses")
+            _schreiben_meta(meta_pfad, {
+                "url": url,
+                "etag": antwort.get("ETag"),
+                "last_modified": antwort.get("Last-Modified"),
+                "groesse": os.path.getsize(daten_pfad),
+                "geprueft": time.time(),
+            })
+        else:
+            return False
+
+    # Zugriffszeit für die LRU-Verdrängung
+    try:
+        os.utime(daten_pfad)
+        _bereitstellen(daten_pfad, ziel)
+    except FileNotFoundError:
+        # Eintrag wurde zwischenzeitlich von einer anderen Sitzung verdrängt
+        return abrufen(url, ziel, session)
+    return True
+
+def aufraeumen(max_bytes=None):
+    """
+    Entfernt die am längsten nicht verwendeten Einträge, bis der Cache höchstens max_bytes groß ist.
+
+    Parameters:
+    max_bytes (int): Größe des Caches in Bytes, Standard CACHE_MAX_BYTES.
+    """
+    if max_bytes is None:
+        max_bytes = CACHE_MAX_BYTES
+    if not os.path.isdir(CACHE_DIR):
+        return
+
+    eintraege = []
+    gesamt = 0
+    for root, dirs, files in os.walk(CACHE_DIR):
+        for file in files:
+            pfad = os.path.join(root, file)
+            try:
+                stat = os.stat(pfad)
+            except FileNotFoundError:
+                continue
+            if file.endswith(".tmp"):
+                # Reste abgebrochener Downloads
+                if time.time() - stat.st_mtime > 3600:
+                    os.remove(pfad)
+                continue
+            gesamt += stat.st_size
+            if not file.endswith(".json"):
+                eintraege.append((stat.st_mtime, stat.st_size, pfad))
+
+    for _, groesse, pfad in sorted(eintraege):
+        if gesamt <= max_bytes:
+            break
+        for datei in (pfad, pfad + ".json"):
+            try:
+                gesamt -= os.path.getsize(datei)
+                os.remove(datei)
+            except FileNotFoundError:
+                pass
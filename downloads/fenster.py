@@ -0,0 +1,127 @@
+# Fensterweises Lesen entfernter GeoTIFF-Kacheln
+# Statt ganze Kacheln herunterzuladen, werden nur die Pixel im Untersuchungsgebiet über HTTP-Range-Anfragen
+# gelesen (GDAL /vsicurl/) und als kleine GeoTIFF-Datei unter dem Namen der Kachel abgelegt. Die weitere
+# Verarbeitung (VRT, XYZ, Geländeraster) arbeitet mit diesen Ausschnitten wie mit ganzen Kacheln.
+#
+# Unterstützt ein Server keine Range-Anfragen oder deckt der Ausschnitt den größten Teil der Kachel ab,
+# wird die ganze Kachel über den Kachel-Cache geladen (siehe downloads.get.download_datei).
+# Liegt der Ausschnitt außerhalb der Kachel, wird sie übersprungen.
+
+import os
+import math
+import logging
+import threading
+from urllib.parse import urlsplit
+
+import rasterio
+
+import metriken
+
+# Ab diesem Anteil des Ausschnitts an der Kachelfläche wird die ganze Kachel geladen (0 schaltet das fensterweise Lesen ab)
+FENSTER_ANTEIL = float(os.environ.get("GEODATEN_FENSTER_ANTEIL", 0.5))
+# Rand um den Ausschnitt in Metern
+FENSTER_RAND = 50
+# Größe des Blockcaches von GDAL für entfernte Dateien in Bytes
+BLOCK_CACHE = 64 * 1024 ** 2
+
+# GDAL liest nicht über die Session: Funktion URL -> URL zum Umlenken auf einen lokalen Server (siehe benchmark.server)
+umleitung = None
+
+# Range-Unterstützung je Server (Schema und Host), je Server wird nur einmal gefragt
+_range = {}
+_range_locks = {}
+_range_lock = threading.Lock()
+
+def range_unterstuetzt(url):
+    """True, wenn der Server der URL Range-Anfragen beantwortet (206). Das Ergebnis wird je Server gespeichert."""
+    from downloads.get import get_session
+
+    teile = urlsplit(url)
+    server = (teile.scheme, teile.netloc)
+    with _range_lock:
+        lock = _range_locks.setdefault(server, threading.Lock())
+    with lock:
+        if server not in _range:
+            try:
+                # Ohne Range-Unterstützung wird die Antwort nach den Kopfzeilen verworfen
+                with get_session().get(url, headers={"Range": "bytes=0-0"}, stream=True) as response:
+                    _range[server] = response.status_code == 206
+            except Exception as e:
+                logging.warning("Range-Anfrage an {} fehlgeschlagen: {}".format(url, e))
+                _range[server] = False
+            if not _range[server]:
+                logging.info("{} unterstützt keine Range-Anfragen, Kacheln werden ganz geladen".format(teile.netloc))
+        return _range[server]
+
+def _gdal_optionen():
+    """Optionen für /vsicurl/: Zeitlimits und Wiederholungen wie die Session, Blockcache, zusammengefasste Range-Anfragen."""
+    from downloads.get import TIMEOUT, WIEDERHOLUNGEN, WARTEZEIT
+
+    return {
+        "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+        "CPL_VSIL_CURL_ALLOWED_EXTENSIONS": ".tif,.tiff",
+        "CPL_VSIL_CURL_CACHE_SIZE": BLOCK_CACHE,
+        "VSI_CACHE": True,
+        "VSI_CACHE_SIZE": BLOCK_CACHE,
+        "GDAL_INGESTED_BYTES_AT_OPEN": 65536,
+        "GDAL_HTTP_MULTIRANGE": "YES",
+        "GDAL_HTTP_MERGE_CONSECUTIVE_RANGES": "YES",
+        "GDAL_HTTP_CONNECTTIMEOUT": int(TIMEOUT[0]),
+        "GDAL_HTTP_TIMEOUT": int(TIMEOUT[1]),
+        "GDAL_HTTP_MAX_RETRY": WIEDERHOLUNGEN,
+        "GDAL_HTTP_RETRY_DELAY": WARTEZEIT,
+    }
+
+def fenster_laden(url, ziel, bounds):
+    """
+    Stellt den Ausschnitt einer entfernten GeoTIFF-Kachel unter ziel bereit.
+
+    Parameters:
+    url (str): Vollständige URL der Kachel.
+    ziel (str): Zielpfad der Datei.
+    bounds (tuple): (x1, y1, x2, y2) des Ausschnitts in EPSG:25832, wird um FENSTER_RAND vergrößert.
+
+    Returns:
+    bool: True, wenn der Ausschnitt oder die ganze Kachel bereitgestellt wurde oder die Kachel außerhalb des
+          Ausschnitts liegt (dann ohne Datei).
+    """
+    from rasterio.windows import Window
+    from downloads.get import download_datei
+
+    if FENSTER_ANTEIL <= 0 or not range_unterstuetzt(url):
+        return download_datei(url, ziel)
+
+    ganz = False
+    with metriken.stufe("fenster", level=logging.DEBUG, url=url):
+        try:
+            with rasterio.Env(**_gdal_optionen()), rasterio.open("/vsicurl/" + (umleitung(url) if umleitung else url)) as src:
+                # Ausschnitt auf ganze Pixel nach außen gerundet und auf die Kachel begrenzt
+                links, unten, rechts, oben = bounds[0] - FENSTER_RAND, bounds[1] - FENSTER_RAND, bounds[2] + FENSTER_RAND, bounds[3] + FENSTER_RAND
+                spalte0, zeile0 = ~src.transform * (links, oben)
+                spalte1, zeile1 = ~src.transform * (rechts, unten)
+                spalte0, zeile0 = max(0, math.floor(spalte0)), max(0, math.floor(zeile0))
+                spalte1, zeile1 = min(src.width, math.ceil(spalte1)), min(src.height, math.ceil(zeile1))
+                if spalte1 <= spalte0 or zeile1 <= zeile0:
+                    # Kein Pixel der Kachel im Ausschnitt
+                    logging.info("{} liegt außerhalb des Ausschnitts und wird übersprungen".format(url))
+                    metriken.zaehlen("kacheln", art="leer")
+                    return True
+                if (spalte1 - spalte0) * (zeile1 - zeile0) > FENSTER_ANTEIL * src.width * src.height:
+                    ganz = True
+                else:
+                    fenster = Window(spalte0, zeile0, spalte1 - spalte0, zeile1 - zeile0)
+                    daten = src.read(window=fenster)
+                    profil = src.profile
+                    profil.update(driver="GTiff", width=fenster.width, height=fenster.height, transform=src.window_transform(fenster),
+                                  tiled=True, blockxsize=256, blockysize=256, compress="deflate")
+                    tmp = ziel + ".tmp"
+                    with rasterio.open(tmp, "w", **profil) as dst:
+                        dst.write(daten)
+                    os.replace(tmp, ziel)
+                    metriken.zaehlen("kacheln", art="fenster")
+        except rasterio.errors.RasterioError as e:
+            logging.warning("Fensterweises Lesen von {} fehlgeschlagen, die Kachel wird ganz geladen: {}".format(url, e))
+            ganz = True
+    if ganz:
+        return download_datei(url, ziel)
+    return True
@@ -1,61 +1,228 @@
 import os
+import random
 import requests
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from PIL import Image
 from io import BytesIO
 from owslib.wms import WebMapService
 import rasterio
 from rasterio.transform import from_bounds
 import numpy as np
+import metriken
+from downloads import cache
 
-def get_ressource(temp_dir, dateienbeschreibung, key):
-    url = dateienbeschreibung[key]["url"]
-    for datei in dateienbeschreibung[key]["files"]:          
-        fname = key
-        folder_path = os.path.join(temp_dir, fname)
-        os.makedirs(folder_path, exist_ok=True)
-        file_path = os.path.join(folder_path, datei.split("/")[-1])
-        response = requests.get(url + "/" + datei)
-        if response.status_code == 200:
-            with open(file_path, "wb") as f:
-                f.write(response.content)
-        else:
-            logging.error("Fehler beim Download von: " + url)
+# Anzahl gleichzeitiger Downloads über alle Schlüssel
+MAX_WORKERS = 8
+# Anzahl gleichzeitiger Verbindungen je Host
+MAX_PRO_HOST = 4
+# Zeitlimits für den Verbindungsaufbau und zwischen zwei gelesenen Blöcken in Sekunden
+TIMEOUT = (float(os.environ.get("GEODATEN_TIMEOUT_VERBINDEN", 10)), float(os.environ.get("GEODATEN_TIMEOUT_LESEN", 60)))
+# Anzahl der Wiederholungen bei 429, 5xx und Netzwerkfehlern
+WIEDERHOLUNGEN = int(os.environ.get("GEODATEN_WIEDERHOLUNGEN", 5))
+# Wartezeit vor der ersten Wiederholung in Sekunden, verdoppelt sich mit jeder weiteren bis WARTEZEIT_MAX
+WARTEZEIT = 0.5
+WARTEZEIT_MAX = 30
 
-def get_wms(temp_dir, dateienbeschreibung, key):
-    def calculate_dimensions(bbox, max_width=4096, max_height=3072):
-        minx, miny, maxx, maxy = bbox
-        bbox_width = maxx - minx
-        bbox_height = maxy - miny
-        aspect_ratio = bbox_width / bbox_height
+_session = None
+_session_lock = threading.Lock()
 
-        if aspect_ratio > 1:
-            width = max_width
-            height = int(max_width / aspect_ratio)
-        else:
-            height = max_height
-            width = int(max_height * aspect_ratio)
+class DownloadFehler(Exception):
+    """
+    Nicht alle Dateien konnten geladen werden.
 
-        return width, height
-    
-    beschreibung = dateienbeschreibung[key]
-    bbox = beschreibung["bbox"] 
+    Attributes:
+    fehlende (list of str): URLs der Dateien, deren Download fehlgeschlagen ist.
+    ausgelassen (list of str): URLs der Dateien, die nach dem ersten Fehler nicht mehr versucht wurden.
+    """
+    def __init__(self, fehlende, ausgelassen=()):
+        self.fehlende = list(fehlende)
+        self.ausgelassen = list(ausgelassen)
+        namen = [url.rstrip("/").split("/")[-1] for url in self.fehlende]
+        text = "{} Dateien konnten nicht geladen werden: {}".format(len(namen), ", ".join(namen[:20]))
+        if len(namen) > 20:
+            text += " und {} weitere".format(len(namen) - 20)
+        if self.ausgelassen:
+            text += " ({} weitere Dateien nicht versucht)".format(len(self.ausgelassen))
+        super().__init__(text)
+
+def wartezeit(versuch):
+    """Wartezeit vor dem Versuch versuch (ab 1) in Sekunden: exponentiell steigend mit zufälligem Anteil (Jitter)."""
+    return random.uniform(0, min(WARTEZEIT_MAX, WARTEZEIT * 2 ** (versuch - 1)))
+
+def wiederholung():
+    """
+    Wiederholungen der Anfragen im Verbindungspool.
+
+    Verbindungsfehler und die Antworten 429 und 5xx werden bis zu WIEDERHOLUNGEN-mal mit exponentiell steigender
+    Wartezeit und Jitter wiederholt, ein Retry-After des Servers wird beachtet. Nach der letzten Wiederholung wird
+    die Antwort des Servers zurückgegeben.
+    """
+    return Retry(
+        total=WIEDERHOLUNGEN,
+        backoff_factor=WARTEZEIT,
+        backoff_max=WARTEZEIT_MAX,
+        backoff_jitter=WARTEZEIT,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+
+class Adapter(HTTPAdapter):
+    """HTTPAdapter mit Wiederholungen (siehe wiederholung) und den Zeitlimits TIMEOUT für alle Anfragen ohne eigenes Zeitlimit."""
+    def __init__(self, **kwargs):
+        kwargs.setdefault("max_retries", wiederholung())
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = TIMEOUT
+        return super().send(request, **kwargs)
+
+def get_session():
+    """
+    Gemeinsame requests.Session für alle Downloads.
+
+    Die Verbindungen bleiben offen (Keep-Alive) und werden wiederverwendet. Je Host werden höchstens
+    MAX_PRO_HOST Verbindungen geöffnet, weitere Anfragen warten auf eine freie Verbindung.
+    Alle Anfragen haben Zeitlimits und werden bei vorübergehenden Fehlern wiederholt (siehe Adapter).
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = Adapter(pool_connections=16, pool_maxsize=MAX_PRO_HOST, pool_block=True)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+    return _session
 
-    # Vergrößere die Bounding Box in jede Richtung um 500m
+def download_datei(url, file_path):
+    """
+    Stellt eine Datei über den gemeinsamen Kachel-Cache bereit (siehe downloads.cache).
+
+    Nicht vorhandene oder geänderte Dateien werden blockweise heruntergeladen, abgebrochene Übertragungen
+    werden fortgesetzt und jede Datei wird vor der Übernahme geprüft.
+
+    Returns:
+    bool: True, wenn der Download erfolgreich war.
+    """
+    with metriken.stufe("kachel", level=logging.DEBUG, url=url):
+        erfolg = cache.abrufen(url, file_path, get_session())
+        if erfolg:
+            metriken.zaehlen("kacheln")
+        return erfolg
+
+def quellen(beschreibung):
+    """
+    Server und Dateien eines Schlüssels vom Typ "ressource".
+
+    Zusammengefasste Beschreibungen mehrerer Anbieter (siehe anbieter.zusammenfassen) führen die Server unter "quellen",
+    sonst gilt "url" für alle Dateien.
+
+    Returns:
+    list of dict: {"url": URL des Servers, "files": Dateien}
+    """
+    return beschreibung.get("quellen") or [{"url": beschreibung["url"], "files": beschreibung["files"]}]
+
+def ressource_auftraege(temp_dir, dateienbeschreibung, key):
+    """
+    Liefert die Downloads (URL, Zielpfad) eines Schlüssels vom Typ "ressource" und legt den Zielordner an.
+    """
+    folder_path = os.path.join(temp_dir, key)
+    os.makedirs(folder_path, exist_ok=True)
+    auftraege = []
+    for quelle in quellen(dateienbeschreibung[key]):
+        for datei in quelle["files"]:
+            file_path = os.path.join(folder_path, datei.split("/")[-1])
+            auftraege.append((quelle["url"] + "/" + datei, file_path))
+    return auftraege
+
+# Gültigkeit der zwischengespeicherten WMS-Capabilities in Sekunden
+WMS_CAPABILITIES_TTL = 6 * 3600
+
+_wms_capabilities = {}
+_wms_capabilities_lock = threading.Lock()
+
+def wms_capabilities(url, version):
+    """
+    Capabilities eines WMS, je Dienst-URL und Version für WMS_CAPABILITIES_TTL Sekunden zwischengespeichert.
+
+    Returns:
+    dict: Layer, maximale Bildbreite und -höhe (None, wenn der Dienst keine Grenze angibt) und GetMap-Formate.
+          None, wenn die Capabilities nicht abgerufen werden können.
+    """
+    import time
+    import xml.etree.ElementTree as ET
+
+    with _wms_capabilities_lock:
+        eintrag = _wms_capabilities.get((url, version))
+    if eintrag is not None and time.time() - eintrag["zeit"] < WMS_CAPABILITIES_TTL:
+        return eintrag
+
+    response = get_session().get(url, params={"service": "WMS", "request": "GetCapabilities", "version": version})
+    if response.status_code != 200:
+        logging.error("Fehler beim Abrufen der Capabilities von: " + url)
+        return None
+    try:
+        wms = WebMapService(url, version=version, xml=response.content)
+    except Exception:
+        logging.exception("Ungültige Capabilities von: " + url)
+        return None
+
+    # MaxWidth / MaxHeight werden von owslib nicht ausgewertet
+    root = ET.fromstring(response.content)
+    def groesse(name):
+        for element in root.iter():
+            if element.tag.split("}")[-1] == name and element.text:
+                return int(element.text)
+        return None
+
+    try:
+        formate = wms.getOperationByName("GetMap").formatOptions
+    except KeyError:
+        formate = []
+    eintrag = {
+        "zeit": time.time(),
+        "layer": set(wms.contents),
+        "max_width": groesse("MaxWidth"),
+        "max_height": groesse("MaxHeight"),
+        "formate": formate,
+    }
+    with _wms_capabilities_lock:
+        _wms_capabilities[(url, version)] = eintrag
+    return eintrag
+
+def _wms_layer_pruefen(beschreibung, capabilities):
+    layer = beschreibung["layer_name"]
+    layer = [layer] if isinstance(layer, str) else layer
+    fehlend = [l for l in layer if l not in capabilities["layer"]]
+    if fehlend:
+        logging.error("Layer nicht im WMS {} vorhanden: {}".format(beschreibung["url"], ", ".join(fehlend)))
+        return False
+    if capabilities["formate"] and "image/png" not in capabilities["formate"]:
+        logging.warning("Der WMS {} bietet kein image/png an.".format(beschreibung["url"]))
+    return True
+
+# Kantenlänge der Kacheln beim gekachelten WMS-Abruf in Pixeln
+WMS_KACHEL_PIXEL = 2048
+
+def _wms_bbox(bbox):
+    # Vergrößere die Bounding Box in jede Richtung um 20%
     minx, miny, maxx, maxy = bbox
     miny -= (maxy - miny)*0.2
     minx -= (maxx - minx)*0.2
     maxy += (maxy - miny)*0.2
     maxx += (maxx - minx)*0.2
-    bbox = (minx, miny, maxx, maxy)
+    return (minx, miny, maxx, maxy)
 
-    width, height = calculate_dimensions(bbox)
-
-    # Connect to the WMS service
-    wms = WebMapService(beschreibung["url"], version=beschreibung["version"])
-   
+def _wms_params(beschreibung, bbox, width, height):
     # Define the parameters for the WMS request
-    wms_params = {
+    return {
         'service': 'WMS',
         'version': beschreibung["version"],
         'request': 'GetMap',
@@ -68,49 +235,240 @@ def get_wms(temp_dir, dateienbeschreibung, key):
         'format': 'image/png'  # Output format
     }
 
-    # Make the WMS request
-    response = requests.get(beschreibung["url"], params=wms_params)
-    
-    if response.status_code == 200:
-        image = Image.open(BytesIO(response.content))
-        folder_path = os.path.join(temp_dir, key)
-        os.makedirs(folder_path, exist_ok=True)
-        output_png = os.path.join(temp_dir, key, key + ".png")
-        image.save(output_png)
-
-        # Define the transform (georeferencing) based on the bounding box and dimensions
-        transform = from_bounds(*bbox, width, height)
-
-        # Open the PNG file and read its contents
-        with Image.open(output_png) as image:
-            image_data = image.convert('RGB')  # Ensure the image is in RGB mode
-            image_array = np.array(image_data)
-
-        # Create the georeferenced TIFF file
-        output_tif = output_png.replace(".png", ".tif")
+def _wms_antwort_pruefen(response, url, bezeichnung):
+    """
+    Prüft die Antwort einer GetMap-Anfrage: Status 200 und ein Bild. Fehler meldet der Dienst auch mit Status 200
+    als XML (ServiceException).
+
+    Raises:
+    DownloadFehler: Mit bezeichnung als fehlender Datei.
+    """
+    typ = response.headers.get("Content-Type", "")
+    if response.status_code != 200 or not typ.startswith("image/"):
+        logging.error("Fehler beim Download von: {} ({}, Status {}, {}): {}".format(
+            url, bezeichnung, response.status_code, typ or "ohne Content-Type", response.text[:500] if not typ.startswith("image/") else ""))
+        raise DownloadFehler([bezeichnung])
+
+def get_wms_gekachelt(temp_dir, dateienbeschreibung, key, threads=MAX_PRO_HOST):
+    """
+    Ruft eine WMS-Karte mit der Auflösung beschreibung["aufloesung"] (m/Pixel) in Kacheln ab.
+
+    Die Bounding Box wird in Kacheln von höchstens WMS_KACHEL_PIXEL Pixeln zerlegt, die parallel abgerufen
+    und fensterweise in ein gekacheltes, komprimiertes GeoTIFF geschrieben werden. Es werden nie mehr als
+    2 * threads Kacheln gleichzeitig im Speicher gehalten.
+
+    Raises:
+    DownloadFehler: Wenn eine Kachel nicht abgerufen werden kann, die unvollständige Karte wird entfernt.
+    """
+    from concurrent.futures import wait, FIRST_COMPLETED
+    from rasterio.transform import from_origin
+    from rasterio.windows import Window
+
+    beschreibung = dateienbeschreibung[key]
+    aufloesung = float(beschreibung["aufloesung"])
+    minx, miny, maxx, maxy = _wms_bbox(beschreibung["bbox"])
+
+    # Ganze Pixel in der Zielauflösung, ausgehend von der oberen linken Ecke
+    width = int(np.ceil((maxx - minx) / aufloesung))
+    height = int(np.ceil((maxy - miny) / aufloesung))
+    transform = from_origin(minx, maxy, aufloesung, aufloesung)
+
+    # Kachelgröße innerhalb der Grenzen des Servers
+    kachel_breite, kachel_hoehe = WMS_KACHEL_PIXEL, WMS_KACHEL_PIXEL
+    capabilities = wms_capabilities(beschreibung["url"], beschreibung["version"])
+    if capabilities is not None:
+        kachel_breite = min(kachel_breite, capabilities["max_width"] or kachel_breite)
+        kachel_hoehe = min(kachel_hoehe, capabilities["max_height"] or kachel_hoehe)
+
+    fenster = [Window(col, row, min(kachel_breite, width - col), min(kachel_hoehe, height - row))
+               for row in range(0, height, kachel_hoehe)
+               for col in range(0, width, kachel_breite)]
+
+    def abrufen(window):
+        links = minx + window.col_off * aufloesung
+        oben = maxy - window.row_off * aufloesung
+        bbox = (links, oben - window.height * aufloesung, links + window.width * aufloesung, oben)
+        response = get_session().get(beschreibung["url"], params=_wms_params(beschreibung, bbox, window.width, window.height))
+        metriken.zaehlen("bytes", len(response.content))
+        _wms_antwort_pruefen(response, beschreibung["url"], "{} Kachel {}, {}".format(key, window.col_off, window.row_off))
+        with Image.open(BytesIO(response.content)) as image:
+            return window, np.moveaxis(np.asarray(image.convert("RGB")), -1, 0)
+
+    folder_path = os.path.join(temp_dir, key)
+    os.makedirs(folder_path, exist_ok=True)
+    output_tif = os.path.join(folder_path, key + ".tif")
+    offen = set()
+    try:
         with rasterio.open(
-            output_tif,
-            'w',
-            driver='GTiff',
-            height=image_array.shape[0],
-            width=image_array.shape[1],
-            count=3,  # Number of bands (RGB)
-            dtype=image_array.dtype,
-            crs='EPSG:25832',
-            transform=transform,
-        ) as dst:
-            dst.write(image_array[:, :, 0], 1)  # Red channel
-            dst.write(image_array[:, :, 1], 2)  # Green channel
-            dst.write(image_array[:, :, 2], 3)  # Blue channel
-    else:
-        logging.error("Fehler beim Download von: " + beschreibung["url"])
-
-def files(temp_dir, dateienbeschreibung):
-    for key in dateienbeschreibung.keys():
-        if dateienbeschreibung[key]["type"] == "ressource":
-            get_ressource(temp_dir, dateienbeschreibung, key)
-        elif dateienbeschreibung[key]["type"] == "WMS":
-            get_wms(temp_dir, dateienbeschreibung, key)
+            output_tif, "w", driver="GTiff", height=height, width=width, count=3,
+            dtype="uint8", crs="EPSG:25832", transform=transform, tiled=True, blockxsize=256, blockysize=256,
+            compress="deflate", photometric="RGB", BIGTIFF="IF_SAFER"
+        ) as dst, ThreadPoolExecutor(max_workers=threads) as pool:
+            try:
+                for window in fenster:
+                    offen.add(pool.submit(metriken.im_kontext(abrufen), window))
+                    if len(offen) >= 2 * threads:
+                        fertig, offen = wait(offen, return_when=FIRST_COMPLETED)
+                        for future in fertig:
+                            _wms_kachel_schreiben(dst, *future.result())
+                for future in as_completed(offen):
+                    _wms_kachel_schreiben(dst, *future.result())
+            except BaseException:
+                # Keine weiteren Kacheln abrufen
+                for future in offen:
+                    future.cancel()
+                raise
+    except BaseException:
+        if os.path.exists(output_tif):
+            os.remove(output_tif)
+        raise
+
+def _wms_kachel_schreiben(dst, window, daten):
+    dst.write(daten, window=window)
+
+@metriken.stufe("wms")
+def get_wms(temp_dir, dateienbeschreibung, key):
+    def calculate_dimensions(bbox, max_width=4096, max_height=3072):
+        minx, miny, maxx, maxy = bbox
+        bbox_width = maxx - minx
+        bbox_height = maxy - miny
+        aspect_ratio = bbox_width / bbox_height
+
+        if aspect_ratio > 1:
+            width = max_width
+            height = int(max_width / aspect_ratio)
         else:
-            # Unknown type
-            logging.error("Unknown type: " + dateienbeschreibung[key]["type"])
+            height = max_height
+            width = int(max_height * aspect_ratio)
+
+        return width, height
+    
+    beschreibung = dateienbeschreibung[key]
+
+    # Capabilities aus dem Cache: Layer und maximale Bildgröße vor dem Abruf prüfen,
+    # fehlende Layer wie eine fehlerhafte Antwort melden (siehe _wms_antwort_pruefen)
+    capabilities = wms_capabilities(beschreibung["url"], beschreibung["version"])
+    if capabilities is not None and not _wms_layer_pruefen(beschreibung, capabilities):
+        raise DownloadFehler([key])
+
+    if beschreibung.get("aufloesung"):
+        # Zielauflösung in m/Pixel: gekachelter Abruf
+        get_wms_gekachelt(temp_dir, dateienbeschreibung, key)
+        return
+
+    bbox = _wms_bbox(beschreibung["bbox"])
+
+    max_width, max_height = 4096, 3072
+    if capabilities is not None:
+        max_width = min(max_width, capabilities["max_width"] or max_width)
+        max_height = min(max_height, capabilities["max_height"] or max_height)
+    width, height = calculate_dimensions(bbox, max_width, max_height)
+    if width > max_width or height > max_height:
+        # Seitenverhältnis außerhalb der Grenzen des Servers
+        faktor = min(max_width / width, max_height / height)
+        width, height = max(1, int(width * faktor)), max(1, int(height * faktor))
+
+    # Define the parameters for the WMS request
+    wms_params = _wms_params(beschreibung, bbox, width, height)
+
+    # Make the WMS request
+    response = get_session().get(beschreibung["url"], params=wms_params)
+    metriken.zaehlen("bytes", len(response.content))
+    _wms_antwort_pruefen(response, beschreibung["url"], key)
+
+    folder_path = os.path.join(temp_dir, key)
+    os.makedirs(folder_path, exist_ok=True)
+    output_tif = os.path.join(folder_path, key + ".tif")
+    if beschreibung.get("png"):
+        # Die Antwort ist bereits eine PNG-Datei
+        with open(output_tif.replace(".tif", ".png"), "wb") as f:
+            f.write(response.content)
+
+    # Define the transform (georeferencing) based on the bounding box and dimensions
+    transform = from_bounds(*bbox, width, height)
+
+    # Bild direkt aus der Antwort dekodieren
+    with Image.open(BytesIO(response.content)) as image:
+        image_array = np.asarray(image.convert('RGB'))  # Ensure the image is in RGB mode
+
+    # Create the georeferenced TIFF file
+    with rasterio.open(
+        output_tif,
+        'w',
+        driver='GTiff',
+        height=image_array.shape[0],
+        width=image_array.shape[1],
+        count=3,  # Number of bands (RGB)
+        dtype=image_array.dtype,
+        crs='EPSG:25832',
+        transform=transform,
+        tiled=True,
+        compress='deflate',
+        photometric='RGB',
+    ) as dst:
+        # Alle Bänder in einem Aufruf, (Zeilen, Spalten, Bänder) -> (Bänder, Zeilen, Spalten)
+        dst.write(np.moveaxis(image_array, -1, 0))
+
+def files(temp_dir, dateienbeschreibung, max_workers=MAX_WORKERS, fortschritt=None, fenster=None):
+    """
+    Lädt alle Dateien der Beschreibung herunter.
+
+    Die Downloads aller Schlüssel (Dateien und WMS-Abfragen) werden gemeinsam in einem Pool mit
+    max_workers Threads ausgeführt.
+
+    Schlägt der Download einer Datei auch nach den Wiederholungen fehl, werden die noch nicht begonnenen
+    Downloads abgebrochen und DownloadFehler mit der Liste der fehlenden Dateien ausgelöst. Ebenso bei einer
+    WMS-Abfrage, die kein Bild liefert (Status oder ServiceException, siehe _wms_antwort_pruefen) oder deren
+    Layer der Dienst nicht anbietet. Bereits geladene Dateien bleiben im Cache, ein erneuter Aufruf lädt nur die fehlenden.
+
+    Parameters:
+    fortschritt (callable): Wird nach jedem Download mit (erledigt, gesamt) aufgerufen.
+    fenster (tuple): (x1, y1, x2, y2) in EPSG:25832. Von GeoTIFF-Kacheln wird nur dieser Ausschnitt über
+                     Range-Anfragen gelesen (siehe downloads.fenster), None für ganze Kacheln.
+    """
+    from downloads.fenster import fenster_laden
+
+    fehlende, ausgelassen = [], []
+    with metriken.stufe("download"), ThreadPoolExecutor(max_workers=max_workers) as pool:
+        # Future -> URL der Datei, None für WMS-Abfragen
+        futures = {}
+        for key in dateienbeschreibung.keys():
+            if dateienbeschreibung[key]["type"] == "ressource":
+                for url, file_path in ressource_auftraege(temp_dir, dateienbeschreibung, key):
+                    if fenster is not None and url.lower().endswith((".tif", ".tiff")):
+                        futures[pool.submit(metriken.im_kontext(fenster_laden), url, file_path, fenster)] = url
+                    else:
+                        futures[pool.submit(metriken.im_kontext(download_datei), url, file_path)] = url
+            elif dateienbeschreibung[key]["type"] == "WMS":
+                futures[pool.submit(metriken.im_kontext(get_wms), temp_dir, dateienbeschreibung, key)] = None
+            else:
+                # Unknown type
+                logging.error("Unknown type: " + dateienbeschreibung[key]["type"])
+        for erledigt, future in enumerate(as_completed(futures), 1):
+            if future.cancelled():
+                ausgelassen.append(futures[future])
+                continue
+            try:
+                erfolg = future.result()
+            except DownloadFehler as e:
+                # Fehlerhafte Antwort einer WMS-Abfrage
+                fehlende.extend(e.fehlende)
+                erfolg = False
+            else:
+                if futures[future] is None:
+                    erfolg = True
+                elif not erfolg:
+                    fehlende.append(futures[future])
+            if not erfolg:
+                # Schnell scheitern: noch nicht begonnene Downloads nicht mehr ausführen
+                for andere in futures:
+                    andere.cancel()
+            if fortschritt is not None:
+                fortschritt(erledigt, len(futures))
+
+    # Cache auf die maximale Größe begrenzen
+    cache.aufraeumen()
+    if fehlende:
+        fehler = DownloadFehler(fehlende, [url for url in ausgelassen if url is not None])
+        logging.error("{}\nFehlende Dateien:\n{}".format(fehler, "\n".join(fehlende)))
+        raise fehler
@@ -1,27 +1,33 @@
-import requests
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
-def list_lod_filenames(bounds):
-    lod_url = r"https://lod.stac.lgln.niedersachsen.de/search?bbox={}%2C{}%2C{}%2C{}".format(bounds[1], bounds[0], bounds[3], bounds[2])
-    # Set the accept header
-    headers = {'Accept': 'application/json'}
-    response = requests.get(lod_url, headers=headers)
+import metriken
+import kachelauswahl
+from downloads.nds import stac
 
-    if response.status_code != 200:
-        return response.status_code, None
-    
+lod_search_url = "https://lod.stac.lgln.niedersachsen.de/search"
+dgm_search_url = "https://dgm.stac.lgln.niedersachsen.de/search"
+
+def _filenames(features, asset_key, produkt, gebiet=None):
     filenames = {
         "type": "ressource",
         "url": None,
         "files": []
     }
 
-    features = response.json()["features"]
+    kandidaten, bytes_gespart = 0, 0
     for feature in features:
         assets = feature["assets"]
-        if "lod1-gml" in assets.keys():
+        if asset_key in assets.keys():
+            kandidaten += 1
+            if gebiet is not None:
+                # Nur Elemente, deren Umriss das Polygon schneidet
+                umriss = kachelauswahl.umriss_25832(feature)
+                if umriss is not None and not kachelauswahl.schneidet(gebiet, umriss):
+                    bytes_gespart += assets[asset_key].get("file:size") or 0
+                    continue
             # Get the URL of the asset
-            asset_url = assets["lod1-gml"]["href"]
+            asset_url = assets[asset_key]["href"]
             # Splitting the URL
             split_index = asset_url.index('/', 8)  # Find the first '/' after 'https://'
             url = asset_url[:split_index + 1]  # Include the '/'
@@ -32,88 +38,53 @@ def list_lod_filenames(bounds):
             else:
                 # Check if the URL is the same
                 if filenames["url"] != url:
-                    logging("URLs are not the same")
+                    logging.error("URLs are not the same")
                     return 400, None
             filenames["files"].append(filename)
+    metriken.zaehlen("kacheln", len(filenames["files"]))
+    if gebiet is not None:
+        filenames["gespart"] = kachelauswahl.bericht(produkt, kandidaten, len(filenames["files"]), bytes_gespart)
     return 200, filenames
 
-def list_dgm_filenames(bounds):
-    dgm_url = r"https://dgm.stac.lgln.niedersachsen.de/search?bbox={}%2C{}%2C{}%2C{}".format(bounds[1], bounds[0], bounds[3], bounds[2])
-    # Set the accept header
-    headers = {'Accept': 'application/json'}
-    response = requests.get(dgm_url, headers=headers)
-
-    print(dgm_url)
-
-    if response.status_code != 200:
-        return response.status_code, None
-    
-    features = response.json()["features"]
+def list_lod_filenames(bounds, gebiet=None):
+    # bounds: (lat, lon, lat, lon), die STAC-Suche erwartet (lon, lat, lon, lat)
+    code, features = stac.suchen(lod_search_url, (bounds[1], bounds[0], bounds[3], bounds[2]))
+    if code != 200:
+        return code, None
+    return _filenames(features, "lod1-gml", "Gebäude", gebiet)
 
-    def next_page(url):
-        response = requests.get(url, headers=headers)
-        if response.status_code != 200:
-            return response.status_code, None
-        return 200, response
+def list_dgm_filenames(bounds, gebiet=None):
+    # bounds: (lat, lon, lat, lon), die STAC-Suche erwartet (lon, lat, lon, lat)
+    code, features = stac.suchen(dgm_search_url, (bounds[1], bounds[0], bounds[3], bounds[2]))
+    if code != 200:
+        return code, None
+    return _filenames(features, "dgm1-tif", "Gelände", gebiet)
 
-    while True:
-        json_response = response.json()
-        
-        # Find the "next" link (it may not be at index 0)
-        next_link = None
-        for link in json_response.get("links", []):
-            if link.get("rel") == "next":
-                next_link = link["href"]
-                break
-        
-        if next_link is None:
-            break  # No more pages
-        
-        code, response = next_page(next_link)
+@metriken.stufe("auflisten", land="NDS")
+def list_filenames(bounds4326, bounds25832, polygon=None, puffer=kachelauswahl.PUFFER):
+    # bounds4326: (lat, lon, lat, lon), None für die Umhüllende von bounds25832
+    # polygon: Polygon in EPSG:25832, nur Elemente, deren Umriss das um puffer Meter vergrößerte Polygon schneidet
+    gebiet = None
+    if polygon is not None:
+        gebiet = kachelauswahl.gebiet(polygon, puffer)
+        bounds25832 = gebiet.bounds
+    if bounds4326 is None:
+        from koordinaten import bounds_latlon
+        bounds4326 = bounds_latlon(bounds25832)
+    filenames = {}
+    # Beide Suchen gleichzeitig
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        lod = pool.submit(metriken.im_kontext(list_lod_filenames), bounds4326, gebiet)
+        dgm = pool.submit(metriken.im_kontext(list_dgm_filenames), bounds4326, gebiet)
+        code, lod_filenames = lod.result()
+        filenames["Gebäude"] = lod_filenames
         if code != 200:
-            break  # Error fetching next page
-        
-        for f in response.json()["features"]:
-            features.append(f)
-
-    
-    filenames = {
-        "type": "ressource",
-        "url": None,
-        "files": []
-    }
-
-    for feature in features:
-        assets = feature["assets"]
-        if "dgm1-tif" in assets.keys():
-            # Get the URL of the asset
-            asset_url = assets["dgm1-tif"]["href"]
-            # Splitting the URL
-            split_index = asset_url.index('/', 8)  # Find the first '/' after 'https://'
-            url = asset_url[:split_index + 1]  # Include the '/'
-            filename = asset_url[split_index + 1:]
+            return None
 
-            if filenames["url"] is None:
-                filenames["url"] = url
-            else:
-                # Check if the URL is the same
-                if filenames["url"] != url:
-                    logging("URLs are not the same")
-                    return 400, None
-            filenames["files"].append(filename)
-    return 200, filenames
-
-def list_filenames(bounds4326, bounds25832):
-    filenames = {}
-    code, lod_filenames = list_lod_filenames(bounds4326)
-    filenames["Gebäude"] = lod_filenames
-    if code != 200:
-        return None
-    
-    code, dgm_filenames = list_dgm_filenames(bounds4326)
-    filenames["Gelände"] = dgm_filenames
-    if code != 200:
-        return None
+        code, dgm_filenames = dgm.result()
+        filenames["Gelände"] = dgm_filenames
+        if code != 200:
+            return None
     
     filenames["ALKIS"] = {
         "type": "WMS",
@@ -125,4 +96,8 @@ def list_filenames(bounds4326, bounds25832):
         "version": "1.3.0"
     }
 
-    return filenames
\ No newline at end of file
+    return filenames
+
+def auflisten(polygon, puffer=kachelauswahl.PUFFER):
+    # Einheitlicher Aufruf für die Anbieter (siehe anbieter)
+    return list_filenames(None, polygon.bounds, polygon, puffer)
@@ -0,0 +1,160 @@
+# STAC-Suche für die Endpunkte des LGLN
+# Die Suche läuft für eine auf STAC_RASTER Grad vergrößerte Bounding Box, das Ergebnis wird je Endpunkt
+# und vergrößerter Bounding Box für CACHE_TTL Sekunden auf der Festplatte gespeichert.
+# Die Elemente werden anschließend lokal auf die angefragte Bounding Box gefiltert.
+# Die nächste Seite wird abgerufen, sobald ihr Link bekannt ist, während die aktuelle Seite ausgewertet wird.
+# Fehlen nach dem Erneuern eines abgelaufenen Eintrags Dateien (neue Befliegung), werden sie an die mit ersetzt_melden
+# registrierten Rückrufe gemeldet (in der Streamlit-Anwendung auftraege.verwerfen).
+
+import os
+import json
+import math
+import time
+import hashlib
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import metriken
+
+# Ordner des Caches
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "stac")
+# Gültigkeit der Einträge in Sekunden
+CACHE_TTL = 24 * 3600
+# Raster in Grad, auf das die Bounding Box vergrößert wird
+STAC_RASTER = 0.01
+# Anzahl der Elemente je Seite
+SEITEN_GROESSE = 500
+
+headers = {'Accept': 'application/json'}
+
+# Rückrufe für ersetzte Dateien (siehe ersetzt_melden)
+_rueckrufe = []
+
+def ersetzt_melden(rueckruf):
+    """
+    Registriert einen Rückruf für Dateien, die nach dem Erneuern eines Eintrags fehlen.
+
+    Parameters:
+    rueckruf (callable): Wird mit der Menge der URLs aufgerufen.
+    """
+    if rueckruf not in _rueckrufe:
+        _rueckrufe.append(rueckruf)
+
+def _raster(bbox):
+    minx, miny, maxx, maxy = bbox
+    return (
+        round(math.floor(minx / STAC_RASTER) * STAC_RASTER, 6),
+        round(math.floor(miny / STAC_RASTER) * STAC_RASTER, 6),
+        round(math.ceil(maxx / STAC_RASTER) * STAC_RASTER, 6),
+        round(math.ceil(maxy / STAC_RASTER) * STAC_RASTER, 6),
+    )
+
+def _cache_pfad(search_url, bbox):
+    schluessel = hashlib.sha256("{} {}".format(search_url, bbox).encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, schluessel + ".json")
+
+def _reduzieren(feature):
+    # Nur die benötigten Teile eines Elements speichern
+    return {
+        "id": feature.get("id"),
+        "bbox": feature.get("bbox"),
+        "geometry": feature.get("geometry"),
+        "properties": {k: v for k, v in feature.get("properties", {}).items() if k in ("datetime", "start_datetime", "end_datetime")},
+        "assets": {k: {f: v[f] for f in ("href", "file:size") if f in v} for k, v in feature.get("assets", {}).items()},
+    }
+
+def _seiten(search_url, bbox):
+    """Ruft alle Seiten einer Suche ab. Gibt (Status, Elemente) zurück."""
+    from downloads.get import get_session
+
+    session = get_session()
+    url = search_url
+    params = {"bbox": ",".join(str(v) for v in bbox), "limit": SEITEN_GROESSE}
+    response = session.get(url, params=params, headers=headers)
+    if response.status_code == 400:
+        # Server ohne Unterstützung für limit
+        metriken.zaehlen("wiederholungen")
+        del params["limit"]
+        response = session.get(url, params=params, headers=headers)
+
+    features = []
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        while True:
+            metriken.zaehlen("bytes", len(response.content))
+            if response.status_code != 200:
+                return response.status_code, None
+            json_response = response.json()
+
+            # Find the "next" link (it may not be at index 0)
+            next_link = None
+            for link in json_response.get("links", []):
+                if link.get("rel") == "next":
+                    next_link = link["href"]
+                    break
+
+            # Nächste Seite abrufen, während diese Seite ausgewertet wird
+            naechste = pool.submit(session.get, next_link, headers=headers) if next_link else None
+            features.extend(_reduzieren(f) for f in json_response["features"])
+            if naechste is None:
+                break
+            response = naechste.result()
+    return 200, features
+
+def suchen(search_url, bbox):
+    """
+    Sucht alle Elemente eines STAC-Endpunkts, die eine Bounding Box schneiden.
+
+    Parameters:
+    search_url (str): URL der Suche, z.B. "https://dgm.stac.lgln.niedersachsen.de/search".
+    bbox (tuple): (minlon, minlat, maxlon, maxlat) in EPSG:4326.
+
+    Returns:
+    tuple: (HTTP-Status, Liste der Elemente mit id, bbox, geometry, properties und assets)
+    """
+    raster_bbox = _raster(bbox)
+    pfad = _cache_pfad(search_url, raster_bbox)
+    features, alt = None, None
+    try:
+        with open(pfad, "r", encoding="utf-8") as f:
+            eintrag = json.load(f)
+        if time.time() - eintrag["zeit"] < CACHE_TTL:
+            features = eintrag["features"]
+        else:
+            alt = eintrag["features"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    metriken.zaehlen("cache", ergebnis="miss" if features is None else "hit")
+    if features is None:
+        code, features = _seiten(search_url, raster_bbox)
+        if code != 200:
+            logging.error("Fehler bei der STAC-Suche von: " + search_url)
+            return code, None
+        # Atomar schreiben, damit parallele Sitzungen keine halben Dateien lesen
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"zeit": time.time(), "features": features}, f)
+        os.replace(tmp, pfad)
+        if alt:
+            ersetzt = _dateien(alt) - _dateien(features)
+            if ersetzt:
+                for rueckruf in _rueckrufe:
+                    rueckruf(ersetzt)
+
+    # Auf die angefragte Bounding Box filtern
+    return 200, [f for f in features if _schneidet(f["bbox"], bbox)]
+
+def _dateien(features):
+    # URLs aller Dateien der Elemente
+    return {asset["href"] for feature in features for asset in feature["assets"].values() if "href" in asset}
+
+def _schneidet(item_bbox, bbox):
+    if item_bbox is None:
+        return True
+    if len(item_bbox) == 6:
+        # Bounding Box mit Höhenangaben
+        item_bbox = (item_bbox[0], item_bbox[1], item_bbox[3], item_bbox[4])
+    minx, miny, maxx, maxy = bbox
+    return item_bbox[0] <= maxx and item_bbox[2] >= minx and item_bbox[1] <= maxy and item_bbox[3] >= miny
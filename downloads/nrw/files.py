@@ -6,17 +6,30 @@
 # x Koordinate hat 7 Stellen, die y Koordinate hat 8 Stellen
 # Die Anzahl der Stellen wird durch kachelMeter reduziert, d.h. kachelMeter=1000 -> X Koordinate hat 3 und y Koordinate hat 4 Stellen
 # Es müssen alle unteren linken Ecken der Kacheln ermittelt werden, die das Polygon schneiden
-# Die Bounds werden direkt als Parameter übergeben
-def get_kacheln(bounds):
+# Die Bounds werden direkt als Parameter übergeben, mit einem Polygon werden nur die Kacheln geliefert,
+# deren Fläche das (gepufferte) Polygon schneidet (siehe kachelauswahl)
+
+import math
+import logging
+
+import metriken
+import kachelauswahl
+
+def get_kacheln(bounds, gebiet=None):
     kachel_meter = 1000
     kacheln = []
     x1, y1, x2, y2 = bounds
-    x1 = int(x1 / kachel_meter) * kachel_meter
-    y1 = int(y1 / kachel_meter) * kachel_meter
-    x2 = int(x2 / kachel_meter) * kachel_meter
-    y2 = int(y2 / kachel_meter) * kachel_meter
-    for x in range(x1, x2 + kachel_meter, kachel_meter):
-        for y in range(y1, y2 + kachel_meter, kachel_meter):
+    x1 = math.floor(x1 / kachel_meter) * kachel_meter
+    y1 = math.floor(y1 / kachel_meter) * kachel_meter
+    # Eine Kachel, deren linker bzw. unterer Rand auf dem Ende der Bounding Box liegt, schneidet diese nicht
+    x2 = max(math.ceil(x2 / kachel_meter) * kachel_meter, x1 + kachel_meter)
+    y2 = max(math.ceil(y2 / kachel_meter) * kachel_meter, y1 + kachel_meter)
+    if gebiet is not None:
+        from shapely.geometry import box
+    for x in range(x1, x2, kachel_meter):
+        for y in range(y1, y2, kachel_meter):
+            if gebiet is not None and not kachelauswahl.schneidet(gebiet, box(x, y, x + kachel_meter, y + kachel_meter)):
+                continue
             kacheln.append((x/kachel_meter, y/kachel_meter))
     return kacheln
 
@@ -36,47 +49,66 @@ dateien = [{
 }]
 
 def dgm_filename_aus_html(x, y):
-    import requests
-    import pandas as pd
-    import re
-
-    # URL der JSON-Datei
-    url = "https://www.opengeodata.nrw.de/produkte/geobasis/hm/dgm1_tiff/dgm1_tiff/index.json"
+    # Dateiname der DGM-Kachel aus dem lokalen Katalog der index.json
+    from downloads.nrw.katalog import abfragen
 
-    # JSON-Daten abrufen
-    response = requests.get(url)
-    response.raise_for_status()
-    json_data = response.json()
+    kachel_meter = 1000
+    return abfragen("Gelände", (x * kachel_meter, y * kachel_meter, x * kachel_meter, y * kachel_meter))[(x, y)]["name"]
 
-    # Nur die Dateinamen extrahieren
-    df = pd.DataFrame(json_data["datasets"][0]["files"])
 
-    pattern = re.compile(r"dgm1_32_(\d+)_(\d+)_1_nw_\d{4}\.tif")
-    df[["x", "y"]] = df["name"].str.extract(pattern).astype(int)
-    print(df)
+@metriken.stufe("auflisten", land="NRW")
+def list_filenames(bounds, polygon=None, puffer=kachelauswahl.PUFFER):
+    """
+    Listet die Dateien der Kacheln für eine Bounding Box oder ein Polygon auf.
 
-    return df[(df["x"] == x) & (df["y"] == y)]["name"].values[0]
+    Parameters:
+    bounds (tuple): (x1, y1, x2, y2) in EPSG:25832, Ausschnitt der ALKIS-Karte.
+    polygon (shapely.geometry.Polygon): Polygon in EPSG:25832. Nur Kacheln, die das Polygon schneiden, None für die Bounding Box.
+    puffer (float): Puffer um das Polygon in Metern für die Auswahl der Kacheln.
 
+    Returns:
+    dict: Dateienbeschreibung je Schlüssel (siehe downloads.get.files).
+    """
+    from downloads.nrw.katalog import abfragen
 
-def list_filenames(bounds):
-    kacheln = get_kacheln(bounds)
+    gebiet = None
+    if polygon is not None:
+        gebiet = kachelauswahl.gebiet(polygon, puffer)
+        bounds = gebiet.bounds
+    alle = get_kacheln(bounds)
+    kacheln = get_kacheln(bounds, gebiet) if gebiet is not None else alle
+    kachel_meter = 1000
+    x1, y1 = alle[0]
+    x2, y2 = alle[-1]
     filenames = {}
-    for kachel in kacheln:
-        for datei in dateien:
-            if datei["fname"] not in filenames:
-                filenames[datei["fname"]] = {
-                    "type": "ressource",
-                    "url": datei["url"],
-                    "files": []
-                }
-            x, y = kachel
-            if datei["fname"] == "Gelände":
-                datei_name = dgm_filename_aus_html(int(x), int(y))
+    for datei in dateien:
+        filenames[datei["fname"]] = {
+            "type": "ressource",
+            "url": datei["url"],
+            "files": []
+        }
+        # Eine Abfrage des Katalogs für alle Kacheln
+        katalog = abfragen(datei["fname"], (x1 * kachel_meter, y1 * kachel_meter, x2 * kachel_meter, y2 * kachel_meter))
+        for kachel in kacheln:
+            x, y = int(kachel[0]), int(kachel[1])
+            if (x, y) in katalog:
+                datei_name = katalog[(x, y)]["name"]
+            elif "datei" in datei and len(katalog) == 0:
+                # Katalog nicht verfügbar, Dateiname nach Schema
+                datei_name = datei["datei"].format(x, y)
             else:
-                datei_name = datei["datei"].format(int(x), int(y))
+                logging.warning("Keine Datei für {} in Kachel {}, {}".format(datei["fname"], x, y))
+                continue
             filenames[datei["fname"]]["files"].append(datei_name)
-
-    
+        metriken.zaehlen("kacheln", len(filenames[datei["fname"]]["files"]))
+        if gebiet is not None:
+            # Kacheln der Bounding Box mit Datei, die durch die Auswahl am Polygon nicht geladen werden
+            gewaehlt = set(kacheln)
+            weggelassen = [(int(x), int(y)) for x, y in alle if (x, y) not in gewaehlt
+                           and ((int(x), int(y)) in katalog or (len(katalog) == 0 and "datei" in datei))]
+            anzahl = len(filenames[datei["fname"]]["files"])
+            filenames[datei["fname"]]["gespart"] = kachelauswahl.bericht(
+                datei["fname"], anzahl + len(weggelassen), anzahl, sum(katalog.get(k, {}).get("groesse") or 0 for k in weggelassen))
 
     filenames["ALKIS"] = {
         "type": "WMS",
@@ -87,4 +119,8 @@ def list_filenames(bounds):
         "styles": "Grau",
         "version": "1.3.0"
     }
-    return filenames
\ No newline at end of file
+    return filenames
+
+def auflisten(polygon, puffer=kachelauswahl.PUFFER):
+    # Einheitlicher Aufruf für die Anbieter (siehe anbieter)
+    return list_filenames(polygon.bounds, polygon, puffer)
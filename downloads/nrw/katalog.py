@@ -0,0 +1,178 @@
+# Lokaler Katalog der NRW-Kacheln (DGM1, LoD1, ABK)
+# Die index.json der Produkte wird einmal geladen und in einer SQLite-Datenbank abgelegt,
+# indiziert nach Produkt und Kachelkoordinate (untere linke Ecke in km).
+# Bei einer Aktualisierung wird die index.json nur bei Änderungen (ETag / Last-Modified) neu geladen
+# und nur die Differenz der Dateinamen in die Datenbank übernommen.
+# Entfernte Dateien und ältere Dateien einer Kachel, für die eine neue Datei hinzukommt (neue Befliegung),
+# werden an die mit ersetzt_melden registrierten Rückrufe gemeldet. Die Streamlit-Anwendung registriert
+# auftraege.verwerfen, damit fertige Ergebnisse mit diesen Kacheln nicht mehr geliefert werden.
+
+import os
+import re
+import time
+import sqlite3
+import logging
+from contextlib import contextmanager
+
+import metriken
+
+# Pfad der Datenbank
+KATALOG_PFAD = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "nrw_katalog.sqlite")
+# Nach dieser Zeit in Sekunden wird beim Server nachgefragt, ob sich die index.json geändert hat
+AKTUALISIEREN_NACH = 3600
+# Kantenlänge der Kacheln in Metern
+KACHEL_METER = 1000
+
+# Rückrufe für entfernte und ersetzte Dateien (siehe ersetzt_melden)
+_rueckrufe = []
+
+# Dateinamen der Produkte: Kachelkoordinaten und gegebenenfalls das Erfassungsjahr
+muster = {
+    "Gebäude": re.compile(r"LoD1_32_(\d+)_(\d+)_1_NW\.gml"),
+    "Gelände": re.compile(r"dgm1_32_(\d+)_(\d+)_1_nw_(\d{4})\.tif"),
+    "ABK": re.compile(r"abk_sw_32(\d+)_(\d+)_1\.tif"),
+}
+
+def ersetzt_melden(rueckruf):
+    """
+    Registriert einen Rückruf für entfernte und ersetzte Dateien.
+
+    Parameters:
+    rueckruf (callable): Wird nach einer Aktualisierung mit der Liste der Dateinamen aufgerufen.
+    """
+    if rueckruf not in _rueckrufe:
+        _rueckrufe.append(rueckruf)
+
+def _url(produkt):
+    from downloads.nrw.files import dateien
+    return next(datei["url"] for datei in dateien if datei["fname"] == produkt)
+
+@contextmanager
+def _verbinden():
+    # Eine Transaktion je Verbindung, die Verbindung wird danach geschlossen
+    os.makedirs(os.path.dirname(KATALOG_PFAD), exist_ok=True)
+    conn = sqlite3.connect(KATALOG_PFAD, timeout=30)
+    try:
+        with conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS kacheln (
+                produkt TEXT, x INTEGER, y INTEGER, name TEXT, jahr INTEGER, groesse INTEGER,
+                PRIMARY KEY (produkt, x, y, name))""")
+            conn.execute("""CREATE TABLE IF NOT EXISTS stand (
+                produkt TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, geprueft REAL)""")
+            yield conn
+    finally:
+        conn.close()
+
+def _eintrag(produkt, datei):
+    """Wandelt einen Eintrag der index.json in eine Zeile des Katalogs um, None für fremde Dateien."""
+    treffer = muster[produkt].fullmatch(datei["name"])
+    if treffer is None:
+        return None
+    x, y = int(treffer.group(1)), int(treffer.group(2))
+    if treffer.re.groups >= 3:
+        jahr = int(treffer.group(3))
+    elif datei.get("timestamp"):
+        jahr = int(str(datei["timestamp"])[:4])
+    else:
+        jahr = None
+    return (produkt, x, y, datei["name"], jahr, datei.get("size"))
+
+def aktualisieren(produkt, erzwingen=False):
+    """
+    Gleicht den Katalog eines Produkts mit der index.json des Servers ab.
+
+    Parameters:
+    produkt (str): "Gebäude", "Gelände" oder "ABK".
+    erzwingen (bool): Auch dann nachfragen, wenn die letzte Prüfung kürzer als AKTUALISIEREN_NACH zurückliegt.
+    """
+    from downloads.get import get_session
+
+    with _verbinden() as conn:
+        stand = conn.execute("SELECT etag, last_modified, geprueft FROM stand WHERE produkt = ?", (produkt,)).fetchone()
+    if stand is not None and not erzwingen and time.time() - stand[2] < AKTUALISIEREN_NACH:
+        metriken.zaehlen("cache", ergebnis="hit")
+        return
+
+    headers = {}
+    if stand is not None and stand[0]:
+        headers["If-None-Match"] = stand[0]
+    if stand is not None and stand[1]:
+        headers["If-Modified-Since"] = stand[1]
+
+    response = get_session().get(_url(produkt) + "index.json", headers=headers)
+    metriken.zaehlen("bytes", len(response.content))
+    if response.status_code == 304 and stand is not None:
+        metriken.zaehlen("cache", ergebnis="revalidiert")
+        with _verbinden() as conn:
+            conn.execute("UPDATE stand SET geprueft = ? WHERE produkt = ?", (time.time(), produkt))
+        return
+    if response.status_code != 200:
+        logging.error("Fehler beim Abrufen des Katalogs von: " + _url(produkt))
+        return
+
+    metriken.zaehlen("cache", ergebnis="miss")
+    neu, fehler = {}, "keine Kacheln"
+    try:
+        for datei in response.json()["datasets"][0]["files"]:
+            eintrag = _eintrag(produkt, datei)
+            if eintrag is not None:
+                neu[eintrag[3]] = eintrag
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        neu, fehler = {}, "{}: {}".format(type(e).__name__, e)
+    if not neu:
+        # Bisherigen Katalog behalten (ohne Katalog gilt das Namensschema, siehe downloads.nrw.files),
+        # erneut nachfragen erst nach AKTUALISIEREN_NACH
+        logging.error("Ungültige index.json von {} ({}), der bisherige Katalog wird weiter verwendet".format(_url(produkt), fehler))
+        if stand is not None:
+            with _verbinden() as conn:
+                conn.execute("UPDATE stand SET geprueft = ? WHERE produkt = ?", (time.time(), produkt))
+        return
+
+    with _verbinden() as conn:
+        # Nur die Differenz übernehmen
+        alt = {name: (x, y) for name, x, y in conn.execute("SELECT name, x, y FROM kacheln WHERE produkt = ?", (produkt,))}
+        conn.executemany("DELETE FROM kacheln WHERE produkt = ? AND name = ?", [(produkt, name) for name in alt.keys() - neu.keys()])
+        conn.executemany("INSERT INTO kacheln VALUES (?, ?, ?, ?, ?, ?)", [neu[name] for name in neu.keys() - alt.keys()])
+        conn.execute("INSERT OR REPLACE INTO stand VALUES (?, ?, ?, ?)", (
+            produkt, response.headers.get("ETag"), response.headers.get("Last-Modified"), time.time()))
+
+    if alt:
+        # Entfernte Dateien und die bisherigen Dateien von Kacheln mit neuer Datei
+        geaendert = {neu[name][1:3] for name in neu.keys() - alt.keys()}
+        ersetzt = [name for name, kachel in alt.items() if name not in neu or kachel in geaendert]
+        if ersetzt:
+            for rueckruf in _rueckrufe:
+                rueckruf(ersetzt)
+
+def abfragen(produkt, bounds=None, polygon=None):
+    """
+    Liefert die Kacheln eines Produkts, die eine Bounding Box oder ein Polygon schneiden.
+
+    Gibt es für eine Kachel mehrere Dateien (z.B. verschiedene Befliegungsjahre), wird die neueste geliefert.
+
+    Parameters:
+    produkt (str): "Gebäude", "Gelände" oder "ABK".
+    bounds (tuple): (x1, y1, x2, y2) in EPSG:25832.
+    polygon (shapely.geometry.Polygon): Polygon in EPSG:25832, wird statt bounds verwendet.
+
+    Returns:
+    dict: (x, y) der Kachel in km -> {"name": Dateiname, "jahr": Erfassungsjahr, "groesse": Bytes oder None}
+    """
+    aktualisieren(produkt)
+    if polygon is not None:
+        bounds = polygon.bounds
+    x1, y1, x2, y2 = [int(v // KACHEL_METER) for v in bounds]
+
+    with _verbinden() as conn:
+        zeilen = conn.execute(
+            "SELECT x, y, name, jahr, groesse FROM kacheln WHERE produkt = ? AND x BETWEEN ? AND ? AND y BETWEEN ? AND ? ORDER BY jahr",
+            (produkt, x1, x2, y1, y2)).fetchall()
+
+    if polygon is not None:
+        from shapely.geometry import box
+        from shapely.prepared import prep
+        polygon = prep(polygon)
+        zeilen = [z for z in zeilen if polygon.intersects(box(z[0] * KACHEL_METER, z[1] * KACHEL_METER, (z[0] + 1) * KACHEL_METER, (z[1] + 1) * KACHEL_METER))]
+
+    # Spätere (neuere) Einträge überschreiben ältere
+    return {(x, y): {"name": name, "jahr": jahr, "groesse": groesse} for x, y, name, jahr, groesse in zeilen}
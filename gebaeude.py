@@ -0,0 +1,213 @@
+# Gebäude aus LoD1-CityGML-Kacheln
+# Die GML-Dateien der Anbieter (NRW, LGLN) werden elementweise gelesen (iterparse), verarbeitete Gebäude werden
+# sofort wieder aus dem Baum entfernt. Der Speicherbedarf hängt daher nur vom größten Gebäude ab, nicht von der Kachel.
+# Die Kacheln werden auf mehrere Prozesse verteilt.
+#
+# Ergebnis ist eine Tabelle mit Grundriss und Höhe je Gebäude (bzw. Gebäudeteil), die das Untersuchungsgebiet
+# schneiden, als GeoPackage und CSV (Grundriss als WKT) in EPSG:25832.
+
+import os
+import csv
+import logging
+import functools
+import multiprocessing
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
+import metriken
+
+# Anzahl der Prozesse zum Lesen der Kacheln, Standard Anzahl der CPU-Kerne
+GEBAEUDE_PROZESSE = int(os.environ.get("GEODATEN_GEBAEUDE_PROZESSE", 0)) or None
+# Flächen, deren Höhen sich um weniger als diesen Wert in Metern unterscheiden, gelten als waagerecht
+WAAGERECHT = 0.01
+# Spalten der Ausgabe
+SPALTEN = ["id", "gebaeude", "hoehe", "gelaende", "dach", "flaeche"]
+
+@functools.lru_cache(maxsize=None)
+def _name(tag):
+    # Elementname ohne Namensraum, CityGML 1.0 und 2.0 werden gleich behandelt
+    return tag.rsplit("}", 1)[-1]
+
+def _ring(element):
+    """Koordinaten eines gml:LinearRing als Liste von (x, y, z)."""
+    koordinaten = []
+    for kind in element.iter():
+        name = _name(kind.tag)
+        if name in ("posList", "pos") and kind.text:
+            werte = [float(v) for v in kind.text.split()]
+            dim = int(kind.get("srsDimension") or kind.get("dimension") or (3 if len(werte) % 3 == 0 else 2))
+            koordinaten.extend(tuple(werte[i:i + dim]) + (0.0,) * (3 - dim) for i in range(0, len(werte) - dim + 1, dim))
+    return koordinaten
+
+def _flaechen(element):
+    """Alle gml:Polygon unterhalb von element als Liste von (Außenring, Innenringe)."""
+    flaechen = []
+    for polygon in element.iter():
+        if _name(polygon.tag) != "Polygon":
+            continue
+        aussen, innen = None, []
+        for teil in polygon:
+            ringe = [r for r in teil.iter() if _name(r.tag) == "LinearRing"]
+            if not ringe:
+                continue
+            if _name(teil.tag) in ("exterior", "outerBoundaryIs"):
+                aussen = _ring(ringe[0])
+            elif _name(teil.tag) in ("interior", "innerBoundaryIs"):
+                innen.append(_ring(ringe[0]))
+        if aussen and len(aussen) >= 4:
+            flaechen.append((aussen, innen))
+    return flaechen
+
+def _polygon(aussen, innen=()):
+    from shapely.geometry import Polygon
+
+    polygon = Polygon([p[:2] for p in aussen], [[p[:2] for p in ring] for ring in innen])
+    return polygon if polygon.is_valid else polygon.buffer(0)
+
+def _gebaeude(element, kennung, gebaeude_id, gebiet=None):
+    """
+    Grundriss und Höhen eines Gebäudes oder Gebäudeteils.
+
+    Der Grundriss ist die Vereinigung der waagerechten Flächen (Boden und Dach des LoD1-Körpers) in 2D.
+
+    Returns:
+    dict oder None, wenn das Element keine Geometrie hat oder das Gebiet nicht schneidet.
+    """
+    from shapely.ops import unary_union
+
+    flaechen = _flaechen(element)
+    if not flaechen:
+        return None
+    if gebiet is not None:
+        # Schneller Ausschluss über die Bounding Box, bevor Geometrien erzeugt werden
+        x = [p[0] for aussen, _ in flaechen for p in aussen]
+        y = [p[1] for aussen, _ in flaechen for p in aussen]
+        minx, miny, maxx, maxy = gebiet.bounds
+        if min(x) > maxx or max(x) < minx or min(y) > maxy or max(y) < miny:
+            return None
+    waagerecht, hoehen, gesehen = [], [], set()
+    for aussen, innen in flaechen:
+        z = [p[2] for p in aussen]
+        hoehen.extend(z)
+        if max(z) - min(z) < WAAGERECHT:
+            # Boden und Dach haben beim LoD1-Körper den gleichen Umriss
+            umriss = frozenset(p[:2] for p in aussen)
+            if umriss not in gesehen:
+                gesehen.add(umriss)
+                waagerecht.append(_polygon(aussen, innen))
+    if not waagerecht:
+        # Ohne waagerechte Flächen (z.B. nur Wände): Umhüllende der Projektion
+        waagerecht = [_polygon(aussen) for aussen, _ in flaechen]
+    grundriss = waagerecht[0] if len(waagerecht) == 1 else unary_union(waagerecht)
+    if grundriss.is_empty or (gebiet is not None and not gebiet.intersects(grundriss)):
+        return None
+
+    gemessen = None
+    for kind in element:
+        if _name(kind.tag) == "measuredHeight" and kind.text:
+            gemessen = float(kind.text)
+    gelaende, dach = min(hoehen), max(hoehen)
+    return {
+        "id": kennung,
+        "gebaeude": gebaeude_id,
+        "hoehe": round(gemessen if gemessen is not None else dach - gelaende, 2),
+        "gelaende": round(gelaende, 2),
+        "dach": round(dach, 2),
+        "flaeche": round(grundriss.area, 2),
+        "geometry": grundriss,
+    }
+
+def kachel_lesen(gml_file, gebiet=None):
+    """
+    Liest die Gebäude einer CityGML-Datei elementweise.
+
+    Gebäudeteile (BuildingPart) werden als eigene Zeilen mit der Kennung des Gebäudes geliefert,
+    das Gebäude selbst nur, wenn es eine eigene Geometrie hat.
+
+    Parameters:
+    gml_file (str): Pfad zur CityGML-Datei.
+    gebiet (shapely.geometry.Polygon): Nur Gebäude, deren Grundriss das Gebiet schneidet, None für alle.
+
+    Returns:
+    list of dict: Zeilen mit den Spalten SPALTEN und geometry (Grundriss als WKB).
+    """
+    import shapely
+
+    if gebiet is not None:
+        shapely.prepare(gebiet)
+    zeilen = []
+    offen = []  # Kennungen der umschließenden Gebäude
+    wurzel = None
+    for ereignis, element in ET.iterparse(gml_file, events=("start", "end")):
+        name = _name(element.tag)
+        if ereignis == "start":
+            if wurzel is None:
+                wurzel = element
+            if name in ("Building", "BuildingPart"):
+                offen.append(element.get("{http://www.opengis.net/gml}id") or element.get("id"))
+            continue
+        if name in ("Building", "BuildingPart"):
+            kennung = offen.pop()
+            zeile = _gebaeude(element, kennung, offen[0] if offen else kennung, gebiet)
+            if zeile is not None:
+                zeile["geometry"] = shapely.to_wkb(zeile["geometry"])
+                zeilen.append(zeile)
+            # Verarbeitete Teile entfernen, die Geometrie des Gebäudes enthält danach nur noch die eigene
+            element.clear()
+        elif name == "cityObjectMember" and wurzel is not None:
+            wurzel.clear()
+    return zeilen
+
+@metriken.stufe("gebaeude")
+def gebaeude_extrahieren(gml_files, ausgabe, polygon=None, puffer=0, prozesse=GEBAEUDE_PROZESSE):
+    """
+    Erzeugt die Gebäudetabelle aus LoD1-CityGML-Kacheln.
+
+    Gebäude, die in mehreren Kacheln vorkommen, werden nur einmal geschrieben.
+
+    Parameters:
+    gml_files (list of str): Pfade zu den CityGML-Dateien.
+    ausgabe (str): Pfad der Ausgabe ohne Endung, geschrieben werden <ausgabe>.gpkg und <ausgabe>.csv.
+    polygon (shapely.geometry.Polygon): Untersuchungsgebiet in EPSG:25832, None für alle Gebäude.
+    puffer (float): Puffer um das Polygon in Metern.
+    prozesse (int): Anzahl der Prozesse, None für die Anzahl der CPU-Kerne.
+
+    Returns:
+    int: Anzahl der geschriebenen Gebäude.
+    """
+    import shapely
+    import geopandas as gpd
+
+    gebiet = polygon.buffer(puffer) if polygon is not None and puffer else polygon
+    metriken.zaehlen("kacheln", len(gml_files))
+    metriken.zaehlen("bytes", sum(os.path.getsize(gml_file) for gml_file in gml_files))
+    if len(gml_files) > 1 and prozesse != 1:
+        # Neue Prozesse statt fork: Der Auftrag läuft bereits mit GDAL und Threads
+        with ProcessPoolExecutor(max_workers=min(len(gml_files), prozesse or os.cpu_count() or 1),
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            ergebnisse = list(pool.map(kachel_lesen, gml_files, [gebiet] * len(gml_files)))
+    else:
+        ergebnisse = [kachel_lesen(gml_file, gebiet) for gml_file in gml_files]
+
+    zeilen, gesehen = [], set()
+    for zeile in (z for ergebnis in ergebnisse for z in ergebnis):
+        if zeile["id"] is not None and zeile["id"] in gesehen:
+            continue
+        gesehen.add(zeile["id"])
+        zeilen.append(zeile)
+    metriken.zaehlen("gebaeude", len(zeilen))
+
+    tabelle = gpd.GeoDataFrame(
+        [{k: z[k] for k in SPALTEN} for z in zeilen], columns=SPALTEN,
+        geometry=shapely.from_wkb([z["geometry"] for z in zeilen]), crs="EPSG:25832")
+    if os.path.exists(ausgabe + ".gpkg"):
+        os.remove(ausgabe + ".gpkg")
+    tabelle.to_file(ausgabe + ".gpkg", layer="gebaeude", driver="GPKG")
+
+    with open(ausgabe + ".csv", "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(SPALTEN + ["wkt"])
+        for zeile, geometrie in zip(zeilen, tabelle.geometry):
+            writer.writerow([zeile[k] for k in SPALTEN] + [shapely.to_wkt(geometrie, rounding_precision=3)])
+    logging.info("{} Gebäude aus {} Kacheln geschrieben".format(len(zeilen), len(gml_files)))
+    return len(zeilen)
@@ -0,0 +1,85 @@
+# Auswahl der Kacheln am Polygon
+# Statt aller Kacheln in der Bounding Box werden nur die Kacheln geladen, deren Fläche das (gepufferte) Polygon
+# schneidet. Bei diagonalen, L-förmigen oder langgestreckten Gebieten entfällt so ein Großteil der Kacheln.
+# Kacheln, die das Polygon nur am Rand berühren, werden nicht geladen.
+
+import os
+import logging
+import numpy as np
+
+import metriken
+
+# Standardpuffer um das Polygon in Metern für die Auswahl der Kacheln
+PUFFER = float(os.environ.get("GEODATEN_KACHEL_PUFFER", 0))
+# Kleinere Schnittflächen in m² gelten als Berührung (Rundungsfehler bei umprojizierten Umrissen)
+MIN_FLAECHE = 1.0
+
+def gebiet(polygon, puffer=0):
+    """
+    Gepuffertes Polygon für die Auswahl der Kacheln, vorbereitet für wiederholte Abfragen.
+
+    Parameters:
+    polygon (shapely.geometry.Polygon): Polygon in EPSG:25832.
+    puffer (float): Puffer in Metern.
+
+    Returns:
+    shapely.geometry.Polygon
+    """
+    import shapely
+
+    if puffer:
+        polygon = polygon.buffer(puffer)
+    shapely.prepare(polygon)
+    return polygon
+
+def schneidet(gebiet, umriss):
+    """True, wenn die Fläche des Umrisses (EPSG:25832) das Gebiet schneidet und nicht nur berührt."""
+    if not gebiet.intersects(umriss):
+        return False
+    if gebiet.contains(umriss):
+        return True
+    return gebiet.intersection(umriss).area >= MIN_FLAECHE
+
+def umriss_25832(feature):
+    """
+    Umriss eines STAC-Elements in EPSG:25832, aus der Geometrie oder ersatzweise der Bounding Box.
+
+    Returns:
+    shapely.geometry.base.BaseGeometry oder None, wenn das Element keinen Umriss hat.
+    """
+    import shapely
+    from shapely.geometry import shape, box
+    from koordinaten import transformieren
+
+    if feature.get("geometry"):
+        umriss = shape(feature["geometry"])
+    elif feature.get("bbox"):
+        bbox = feature["bbox"]
+        if len(bbox) == 6:
+            # Bounding Box mit Höhenangaben
+            bbox = (bbox[0], bbox[1], bbox[3], bbox[4])
+        umriss = box(*bbox)
+    else:
+        return None
+    return shapely.transform(umriss, lambda xy: np.column_stack(transformieren(xy[:, 0], xy[:, 1], "EPSG:4326", "EPSG:25832")))
+
+def bericht(produkt, kandidaten, gewaehlt, bytes_gespart=0):
+    """
+    Meldet die durch die Auswahl am Polygon eingesparten Kacheln und Bytes (Log und Metriken).
+
+    Parameters:
+    produkt (str): z.B. "Gelände".
+    kandidaten (int): Anzahl der Kacheln in der Bounding Box.
+    gewaehlt (int): Anzahl der ausgewählten Kacheln.
+    bytes_gespart (int): Größe der nicht geladenen Kacheln, soweit bekannt.
+
+    Returns:
+    dict: {"kacheln": Anzahl, "bytes": Größe} der eingesparten Kacheln.
+    """
+    gespart = {"kacheln": kandidaten - gewaehlt, "bytes": int(bytes_gespart)}
+    if gespart["kacheln"]:
+        logging.info("{}: {} von {} Kacheln der Bounding Box ausgewählt, {} Kacheln ({:.1f} MB) eingespart".format(
+            produkt, gewaehlt, kandidaten, gespart["kacheln"], gespart["bytes"] / 1024 ** 2))
+        metriken.zaehlen("kacheln_gespart", gespart["kacheln"], produkt=produkt)
+        metriken.zaehlen("bytes_gespart", gespart["bytes"], produkt=produkt)
+    return gespart
@@ -0,0 +1,71 @@
+# Koordinatentransformationen
+# Die Transformer werden je Thread und Koordinatensystempaar einmal erzeugt und wiederverwendet
+# (pyproj-Transformer dürfen nicht gleichzeitig von mehreren Threads benutzt werden).
+# Alle Transformer arbeiten mit always_xy=True, d.h. Rechtswert/Länge vor Hochwert/Breite.
+# Ganze Koordinatenarrays werden in einem Aufruf transformiert.
+
+import threading
+import numpy as np
+from pyproj import Transformer
+
+# Bewusst je Thread und nicht ein Cache für den ganzen Prozess: Ein pyproj-Transformer ist nicht threadsicher,
+# ein gemeinsam genutzter Transformer liefert bei gleichzeitigen Aufrufen (z.B. aus den Download-Threads)
+# falsche Ergebnisse oder Fehler. Die Erzeugung je Thread kostet nur einmal wenige Millisekunden.
+_lokal = threading.local()
+
+def transformer(quelle, ziel):
+    """
+    Liefert den zwischengespeicherten Transformer für ein Paar von Koordinatensystemen (always_xy=True).
+    """
+    cache = getattr(_lokal, "transformer", None)
+    if cache is None:
+        cache = _lokal.transformer = {}
+    schluessel = (str(quelle).upper(), str(ziel).upper())
+    if schluessel not in cache:
+        cache[schluessel] = Transformer.from_crs(quelle, ziel, always_xy=True)
+    return cache[schluessel]
+
+def transformieren(x, y, quelle="EPSG:25832", ziel="EPSG:4326"):
+    """
+    Transformiert Koordinaten, einzeln oder als Arrays.
+
+    Returns:
+    tuple: (x, y) im Zielsystem, bei EPSG:4326 also (Länge, Breite).
+    """
+    return transformer(quelle, ziel).transform(x, y)
+
+# Rechne EPSG:25832 in lat und lon um
+def epsg25832_to_latlon(x, y):
+    """
+    Rechnet EPSG:25832 in Breite und Länge um, einzeln oder als Arrays.
+
+    Returns:
+    tuple: (Breite, Länge)
+    """
+    lon, lat = transformieren(x, y)
+    return lat, lon
+
+def polygon_latlon(polygon):
+    """
+    Rechnet die Außengrenze eines Polygons in EPSG:25832 in einem Aufruf in Breite und Länge um.
+
+    Returns:
+    shapely.geometry.Polygon: Polygon mit Koordinaten (Breite, Länge).
+    """
+    from shapely.geometry import Polygon
+
+    coords = np.asarray(polygon.exterior.coords)
+    lat, lon = epsg25832_to_latlon(coords[:, 0], coords[:, 1])
+    return Polygon(np.column_stack([lat, lon]))
+
+def bounds_latlon(bounds):
+    """
+    Umhüllende Bounding Box in Breite und Länge zu einer Bounding Box in EPSG:25832.
+
+    Die Ränder werden verdichtet, damit die Umhüllende auch bei gedrehten Gitterlinien vollständig ist.
+
+    Returns:
+    tuple: (Breite unten, Länge links, Breite oben, Länge rechts)
+    """
+    minlon, minlat, maxlon, maxlat = transformer("EPSG:25832", "EPSG:4326").transform_bounds(*bounds, densify_pts=21)
+    return minlat, minlon, maxlat, maxlon
@@ -1,8 +1,6 @@
 import streamlit as st
-from pyproj import Transformer
-import requests
+import os
 import shutil
-import logging
 import pydeck as pdk
 import pandas as pd
 from shapely.geometry import Polygon
@@ -10,6 +8,79 @@ from shapely.geometry import Polygon
 st.header("Download von Geodaten für Ausbreitungsrechnungen")
 st.markdown("Dieses Tool ermöglicht es, Geodaten für Ausbreitungsrechnungen herunterzuladen. Dazu wird eine Geodaten-Datei im GeoPackage-Format benötigt. Das Tool ermittelt das Bundesland, in dem sich das Polygon befindet, und lädt die entsprechenden Geodaten herunter.")
 
+import auftraege
+import bundeslaender
+from downloads.nrw import katalog
+from downloads.nds import stac
+
+# Ergebnisse mit Kacheln, die die Kataloge als ersetzt melden, nicht mehr ausliefern
+katalog.ersetzt_melden(auftraege.verwerfen)
+stac.ersetzt_melden(auftraege.verwerfen)
+
+# Ohne die Landesgrenzen werden die Bundesländer über Nominatim ermittelt (siehe bundeslaender)
+if not bundeslaender.verfuegbar():
+    st.warning("Die Landesgrenzen fehlen, die Bundesländer werden über Nominatim ermittelt und Polygone über mehrere Bundesländer "
+               "nicht an den Grenzen geteilt. Die Landesgrenzen werden einmal mit python -m bundeslaender erzeugt.")
+
+# Fortschritt eines laufenden Auftrags, wird jede Sekunde aktualisiert
+@st.fragment(run_every=1)
+def auftrag_fortschritt(kennung):
+    eintrag = auftraege.status(kennung)
+    if eintrag is None or not auftraege.laeuft(kennung):
+        # Auftrag beendet: Seite neu aufbauen
+        st.rerun()
+    text = auftraege.STUFEN.get(eintrag["stufe"], eintrag["stufe"])
+    if eintrag.get("gesamt"):
+        st.progress(min(1.0, eintrag["erledigt"] / eintrag["gesamt"]), text="{} ({} von {})".format(text, eintrag["erledigt"], eintrag["gesamt"]))
+    else:
+        st.progress(0, text=text)
+
+def auftrag_anzeigen(kennung):
+    eintrag = auftraege.status(kennung)
+    if eintrag is None:
+        st.warning("Der Auftrag ist nicht mehr vorhanden.")
+    elif eintrag["zustand"] == "fertig" and os.path.exists(eintrag["zip"]):
+        zip_pfad = eintrag["zip"]
+        groesse = os.path.getsize(zip_pfad)
+
+        # Die Datei wird erst beim Klick auf den Button gelesen
+        def zip_lesen():
+            with open(zip_pfad, "rb") as f:
+                return f.read()
+
+        if groesse > auftraege.DOWNLOAD_MAX_BYTES:
+            # Streamlit liefert Downloads aus dem Speicher aus, große Archive nicht über die Anwendung
+            st.error("Die ZIP-Datei ist mit {:.1f} GB zu groß für den Download über die Anwendung (höchstens {:.1f} GB). "
+                     "Bitte das Polygon verkleinern, weniger Daten auswählen oder den Batch-Modus (batch.py) verwenden.".format(
+                         groesse / 1024 ** 3, auftraege.DOWNLOAD_MAX_BYTES / 1024 ** 3))
+        else:
+            st.success("Die Dateien sind bereit ({:.1f} MB).".format(groesse / 1024 ** 2))
+            st.download_button(
+                label="Download",
+                data=zip_lesen,
+                file_name="dateien.zip",
+                mime="application/zip",
+                on_click="ignore"
+            )
+    elif eintrag["zustand"] == "fehler":
+        st.error("Fehler bei der Verarbeitung: " + str(eintrag.get("fehler")))
+    elif auftraege.laeuft(kennung):
+        auftrag_fortschritt(kennung)
+    else:
+        st.error("Der Auftrag wurde abgebrochen.")
+    if st.button("Auftrag schließen"):
+        st.session_state.pop("auftrag", None)
+        st.query_params.pop("auftrag", None)
+        st.rerun()
+
+# Eingereichter Auftrag aus der Sitzung oder aus der URL (nach einer neuen Verbindung)
+auftrag_kennung = st.session_state.get("auftrag") or st.query_params.get("auftrag")
+if auftrag_kennung:
+    st.session_state["auftrag"] = auftrag_kennung
+    st.caption("Auftrag")
+    auftrag_anzeigen(auftrag_kennung)
+    st.markdown("---")
+
 select_with_gpkg = not st.toggle("Koordinaten eingeben", value=False)
 # Upload einer shp / gpkg Datei
 if select_with_gpkg:
@@ -78,29 +149,7 @@ def show_map(polygon):
     # Render the map in Streamlit
     st.pydeck_chart(deck)
 
-# Rechne EPSG:25832 in lat und lon um
-def epsg25832_to_latlon(x, y):
-    transformer = Transformer.from_crs("epsg:25832", "epsg:4326")
-    return transformer.transform(x, y)
-
-# Nutze einen Webservice um für eine geokoordinate das zugehörige Bundesland zu ermitteln
-@st.cache_data
-def get_state(lat, lon):
-    url = "https://nominatim.openstreetmap.org/reverse"
-    params = {
-        "format": "json",
-        "lat": lat,
-        "lon": lon
-    }
-
-    header = { "User-Agent": "RichtersHuels", "Referrer": "info@richtershuels.de", "From": "info@richtershuels.de" }
-    
-    response = requests.get(url, params=params, headers=header)
-    if response.status_code != 200:
-        logging.error("Fehler beim Abrufen des Bundeslandes. Fehler Code: {}".format(response.status_code) + " Inhalt: " + response.text)
-        return response.status_code, None
-    data = response.json()    
-    return response.status_code, data["address"]["state"]
+from koordinaten import polygon_latlon
 
 if uploaded_file is not None or not select_with_gpkg:
 
@@ -133,7 +182,7 @@ if uploaded_file is not None or not select_with_gpkg:
         gdf = None
         
     
-    p4326 = Polygon([epsg25832_to_latlon(x, y) for x, y in polygon.exterior.coords])
+    p4326 = polygon_latlon(polygon)
     for point in p4326.exterior.coords:
         if point[0]<=0 or point[1]<=0:
             st.error("Kein valides Polygon angegeben.")
@@ -149,24 +198,31 @@ if uploaded_file is not None or not select_with_gpkg:
         st.stop()
     
 
-    code, bundesland = get_state(*epsg25832_to_latlon(polygon.bounds[0], polygon.bounds[1]))
-    if code != 200:
-        st.error("Fehler beim Abrufen des Bundeslandes.")
-        st.error("Status Code: ", code)
-        shutil.rmtree(temp_dir)
+    # Anhand der Landesgrenzen, berücksichtigt das gesamte Polygon
+    try:
+        laender = bundeslaender.bundeslaender(polygon)
+    except RuntimeError as e:
+        st.error(str(e))
         st.stop()
+    if len(laender) == 0:
+        st.error("Das Polygon liegt in keinem Bundesland.")
+        st.stop()
+    if len(laender) > 1:
+        st.info("Das Polygon schneidet mehrere Bundesländer, die Daten werden zusammengeführt: " + ", ".join("{} ({:.1f} ha)".format(name, flaeche / 10000) for name, flaeche in laender))
+    laender = [name for name, _ in laender]
 
-    st.write("Bundesland: ", bundesland)
+    import anbieter
+    st.write("Bundesland: ", ", ".join(laender))
+    fehlend = [land for land in laender if not anbieter.unterstuetzt(land)]
+    if fehlend and len(fehlend) < len(laender):
+        st.warning("Für {} werden noch keine Daten angeboten, dieser Teil des Polygons bleibt leer.".format(", ".join(fehlend)))
 
-    if bundesland == "Nordrhein-Westfalen":
-        from downloads.nrw.files import list_filenames
-        dateienbeschreibung = list_filenames(polygon.bounds)
-    elif bundesland == "Niedersachsen":
-        from downloads.nds.files import list_filenames
-        ulx, uly = epsg25832_to_latlon(polygon.bounds[0], polygon.bounds[1])
-        orx, ory = epsg25832_to_latlon(polygon.bounds[2], polygon.bounds[3])
-        dateienbeschreibung = list_filenames((ulx, uly, orx, ory), polygon.bounds)
-    else:
+    # Der Puffer bestimmt auch, welche Kacheln geladen werden
+    puffer = st.number_input("Puffer um das Polygon in Metern", value=0, min_value=0)
+
+    import pipeline
+    dateienbeschreibung = pipeline.auflisten(polygon, laender, puffer)
+    if dateienbeschreibung is None:
         st.error("Das Bundesland wird noch nicht unterstützt.")
         shutil.rmtree(temp_dir)
         st.stop()
@@ -175,16 +231,41 @@ if uploaded_file is not None or not select_with_gpkg:
 
     st.caption("Dateien zum Download:")
     download_keys = []
+    spacing, gelaende_tif, gelaende_grid, gebaeude_gml, xyz_gzip = 1, False, False, False, False
+    wms_aufloesung, wms_png = {}, {}
     for key in dateienbeschreibung.keys():
         v = st.checkbox(f"{key} (Anzahl: {len(dateienbeschreibung[key]['files']) if dateienbeschreibung[key]['type'] == 'ressource' else 1})", value=True)
         if v:
             download_keys.append(key)
+            gespart = dateienbeschreibung[key].get("gespart")
+            if gespart and gespart["kacheln"]:
+                st.caption("{} Kacheln außerhalb des Polygons werden nicht geladen{}.".format(
+                    gespart["kacheln"], " ({:.1f} MB)".format(gespart["bytes"] / 1024 ** 2) if gespart["bytes"] else ""))
             if key == "Gelände":
                 spacing = st.number_input("Auflösung der Geländedatei", value=1) 
+                gelaende_tif = st.checkbox("Zusammengesetzte Geländedatei (Cloud-Optimized GeoTIFF) erstellen", value=False)
+                gelaende_grid = st.checkbox("Geländeraster für AUSTAL (Arc/Info ASCII-Grid, gemittelt) erstellen", value=False)
+                xyz_gzip = st.checkbox("XYZ-Dateien mit gzip komprimieren (.xyz.gz)", value=False)
+            if key == "Gebäude":
+                gebaeude_gml = st.checkbox("CityGML-Kacheln zusätzlich zur Gebäudetabelle beilegen", value=False)
+            if dateienbeschreibung[key]["type"] == "WMS":
+                wms_aufloesung[key] = st.number_input(f"Auflösung der Karte {key} in m/Pixel (0 = automatisch)", value=0.0, min_value=0.0, step=0.1, key="aufloesung_" + key)
+                wms_png[key] = st.checkbox(f"Karte {key} zusätzlich als PNG speichern", value=False, key="png_" + key)
 
     download_dateienbeschreibung = {}
     for k in download_keys:
         download_dateienbeschreibung[k] = dateienbeschreibung[k]
+        if dateienbeschreibung[k]["type"] == "WMS":
+            # Gekachelter Abruf in der gewählten Auflösung (0 = ein Abruf), PNG nur auf Wunsch
+            download_dateienbeschreibung[k] = dict(dateienbeschreibung[k], aufloesung=wms_aufloesung[k], png=wms_png[k])
+    if gelaende_grid and "Gelände" in download_dateienbeschreibung:
+        # Das Geländeraster (AUSTAL) umfasst die Bounding Box, dafür alle Geländekacheln darin laden
+        vollstaendig = pipeline.auflisten(polygon, laender, puffer, gelaende_bbox=True)
+        if vollstaendig is None:
+            st.error("Fehler beim Auflisten der Geländekacheln für das Geländeraster.")
+            st.stop()
+        download_dateienbeschreibung["Gelände"] = vollstaendig["Gelände"]
+        st.caption("Für das Geländeraster werden alle {} Geländekacheln der Bounding Box geladen.".format(len(vollstaendig["Gelände"]["files"])))
 
     if len(download_dateienbeschreibung) == 0:
         st.warning("Keine Dateien ausgewählt.")
@@ -193,39 +274,9 @@ if uploaded_file is not None or not select_with_gpkg:
         starten = st.button("Download starten")
 
     if starten:
-        temp_dir = "temp_" + str(uuid.uuid4())
-        os.makedirs(temp_dir)
-        # Lade Dateien herunter
-        from downloads.get import files
-        files(temp_dir, download_dateienbeschreibung)
-
-        # Processing
-        from processing import merge_tifs
-        if "Gelände" in download_dateienbeschreibung:
-            merge_tifs([temp_dir + "/Gelände/" + file_name.split("/")[-1] for file_name in dateienbeschreibung["Gelände"]["files"]], os.path.join(temp_dir, "Gelände", "Gelände_zusammen.tif"))
-            from processing import tif_to_xyz
-            tif_to_xyz(temp_dir + "/Gelände/Gelände_zusammen.tif", os.path.join(temp_dir, "Gelände", "dgm.xyz"), spacing=spacing)
-        #if "ABK" in download_dateienbeschreibung:
-        #    merge_tifs([temp_dir + "/ABK/" + file_name for file_name in dateienbeschreibung["ABK"]["files"]], os.path.join(temp_dir, "ABK", "abk_zusammen.tif"))
-
-        # Erstelle zip Datei
-        import zipfile
-        import io
-        with io.BytesIO() as zip_buffer:
-            with zipfile.ZipFile(zip_buffer, "w") as zipf:
-                for root, dirs, files in os.walk(temp_dir):
-                    for file in files:
-                        zipf.write(os.path.join(root, file), os.path.relpath(os.path.join(root, file), temp_dir))
-
-            zip_data = zip_buffer.getvalue()
-
-            st.download_button(
-            label="Download",
-            data=zip_data,
-            file_name="dateien.zip",
-            mime="application/zip"
-        )
-
-
-        # Entferne temporären Ordner
-        shutil.rmtree(temp_dir)
+        # Der Auftrag läuft im Hintergrund weiter, auch wenn die Seite neu geladen wird (siehe auftraege)
+        kennung = auftraege.einreichen(download_dateienbeschreibung, polygon, spacing=spacing, puffer=puffer, gelaende_tif=gelaende_tif, gelaende_grid=gelaende_grid,
+                                          gebaeude_gml=gebaeude_gml, xyz_gzip=xyz_gzip)
+        st.session_state["auftrag"] = kennung
+        st.query_params["auftrag"] = kennung
+        st.rerun()
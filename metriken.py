@@ -0,0 +1,374 @@
+# Messung der Verarbeitungsschritte
+# Jeder Auftrag (ein Download in der Streamlit-Anwendung oder ein Polygon im Batch-Modus) wird mit auftrag()
+# geklammert, die einzelnen Schritte (Auflisten, Download einer Kachel, Zusammenfügen, XYZ-Export, ZIP) mit stufe().
+# Gemessen werden die Laufzeit je Stufe und Zähler (Bytes, Kacheln, Wiederholungen, Cache-Treffer).
+#
+# Die Ergebnisse werden auf drei Wegen bereitgestellt:
+#   - als strukturierte Log-Ereignisse (JSON) über den Logger "metriken"
+#   - als Prometheus-Textformat: prometheus_text(), textdatei_schreiben() für den Textfile-Collector
+#     oder http_starten() für einen /metrics-Endpunkt
+#   - als Zusammenfassung des Auftrags (Auftrag.zusammenfassung())
+#
+# Konfiguration über Umgebungsvariablen:
+#   GEODATEN_METRIKEN_DATEI  Prometheus-Textdatei, wird nach jedem Auftrag geschrieben
+#   GEODATEN_METRIKEN_PORT   Port des /metrics-Endpunkts, wird beim ersten Auftrag gestartet
+#   GEODATEN_PROFIL          "cprofile", "tracemalloc" oder beides (durch Komma getrennt) für alle Aufträge
+#   GEODATEN_PROFIL_DIR      Ablage der Profile, Standard "profile"
+#
+# Laufen Aufträge in anderen Prozessen (Auftragspool, Batch-Modus), stellt nur der übergeordnete Prozess die Metriken
+# bereit: Die Prozesse messen mit auftrag(..., bereitstellen=False), der übergeordnete Prozess übernimmt die
+# Zusammenfassungen mit uebernehmen() und ruft danach exportieren() auf. So zählen die Zähler über alle Aufträge
+# und der Port wird nur einmal belegt.
+#
+# Der aktuelle Auftrag und die aktuelle Stufe werden in ContextVars gehalten. In Thread-Pools muss die
+# Funktion mit im_kontext() übergeben werden, damit die Messungen dem Auftrag zugeordnet werden.
+
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+import contextvars
+from contextlib import ContextDecorator, contextmanager
+
+METRIKEN_DATEI = os.environ.get("GEODATEN_METRIKEN_DATEI")
+METRIKEN_PORT = os.environ.get("GEODATEN_METRIKEN_PORT")
+PROFIL = os.environ.get("GEODATEN_PROFIL", "")
+PROFIL_DIR = os.environ.get("GEODATEN_PROFIL_DIR", "profile")
+
+# Grenzen der Histogramm-Klassen für die Laufzeit in Sekunden
+HISTOGRAMM_GRENZEN = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+logger = logging.getLogger("metriken")
+
+_auftrag = contextvars.ContextVar("auftrag", default=None)
+_stufe = contextvars.ContextVar("stufe", default=None)
+
+_lock = threading.Lock()
+# Laufzeiten je Stufe: Name -> [Anzahl je Klasse..., Summe, Anzahl]
+_dauer = {}
+# Zähler: (Name, sortierte Labels) -> Wert
+_zaehler = {}
+_http = None
+
+def _beobachten(stufe, sekunden):
+    with _lock:
+        eintrag = _dauer.get(stufe)
+        if eintrag is None:
+            eintrag = _dauer[stufe] = [0] * len(HISTOGRAMM_GRENZEN) + [0.0, 0]
+        for i, grenze in enumerate(HISTOGRAMM_GRENZEN):
+            if sekunden <= grenze:
+                eintrag[i] += 1
+        eintrag[-2] += sekunden
+        eintrag[-1] += 1
+
+def _ereignis(level, **felder):
+    if logger.isEnabledFor(level):
+        logger.log(level, json.dumps(felder, ensure_ascii=False, default=str), extra={"metriken": felder})
+
+class Auftrag:
+    """Messungen eines Auftrags, Laufzeiten und Summen der Zähler je Stufe."""
+    def __init__(self, kennung):
+        self.kennung = kennung
+        self.start = time.perf_counter()
+        self.sekunden = None
+        self.stufen = {}
+        self.zaehler = {}
+        self._roh = {}
+        self._lock = threading.Lock()
+
+    def _stufe(self, name, sekunden):
+        with self._lock:
+            self.stufen.setdefault(name, []).append(sekunden)
+
+    def _zaehlen(self, schluessel, wert):
+        with self._lock:
+            zaehler = self.zaehler.setdefault(dict(schluessel[1]).get("stufe", ""), {})
+            name = _kurzname(*schluessel)
+            zaehler[name] = zaehler.get(name, 0) + wert
+            self._roh[schluessel] = self._roh.get(schluessel, 0) + wert
+
+    def zusammenfassung(self):
+        """
+        Returns:
+        dict: auftrag, sekunden, stufen (Stufe -> Laufzeiten in Sekunden), zaehler (Stufe -> Name -> Summe)
+              und labels (Liste aus Name, Labels und Wert je Zähler für uebernehmen()).
+        """
+        with self._lock:
+            return {
+                "auftrag": self.kennung,
+                "sekunden": self.sekunden if self.sekunden is not None else time.perf_counter() - self.start,
+                "stufen": {k: list(v) for k, v in self.stufen.items()},
+                "zaehler": {k: dict(v) for k, v in self.zaehler.items()},
+                "labels": [[name, dict(labels), wert] for (name, labels), wert in self._roh.items()],
+            }
+
+class stufe(ContextDecorator):
+    """
+    Misst eine Stufe, als Kontextmanager oder Dekorator.
+
+    Die Laufzeit geht in das Histogramm geodaten_stufe_dauer_sekunden und in den aktuellen Auftrag ein,
+    am Ende wird ein Log-Ereignis mit allen in der Stufe gezählten Werten geschrieben.
+
+    Parameters:
+    name (str): Name der Stufe, z.B. "download" oder "xyz".
+    level (int): Level des Log-Ereignisses, für häufige Stufen (einzelne Kacheln) logging.DEBUG.
+    felder: Weitere Angaben für das Log-Ereignis, z.B. key="Gelände".
+    """
+    def __init__(self, name, level=logging.INFO, **felder):
+        self.name = name
+        self.level = level
+        self.felder = felder
+        self.werte = {}
+
+    def _recreate_cm(self):
+        # Als Dekorator eine eigene Instanz je Aufruf
+        return stufe(self.name, self.level, **self.felder)
+
+    def __enter__(self):
+        self.eltern = _stufe.get()
+        self._token = _stufe.set(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, typ, wert, tb):
+        sekunden = time.perf_counter() - self._start
+        _stufe.reset(self._token)
+        _beobachten(self.name, sekunden)
+        auftrag = _auftrag.get()
+        if auftrag is not None:
+            auftrag._stufe(self.name, sekunden)
+        _ereignis(logging.WARNING if typ is not None else self.level,
+                  ereignis="stufe", auftrag=auftrag.kennung if auftrag else None, stufe=self.name,
+                  sekunden=round(sekunden, 6), fehler=typ.__name__ if typ is not None else None,
+                  **self.felder, **self.werte)
+        return False
+
+def zaehlen(name, wert=1, **labels):
+    """
+    Erhöht den Zähler geodaten_<name>_total, mit der aktuellen Stufe als Label.
+
+    Der Wert wird außerdem im Log-Ereignis der aktuellen und aller umschließenden Stufen ausgegeben.
+
+    Parameters:
+    name (str): z.B. "bytes", "kacheln", "wiederholungen" oder "cache".
+    wert (int): Betrag der Erhöhung.
+    labels: Weitere Labels, z.B. ergebnis="hit".
+    """
+    aktuell = _stufe.get()
+    if aktuell is not None:
+        labels.setdefault("stufe", aktuell.name)
+    schluessel = (name, tuple(sorted(labels.items())))
+    kurz = _kurzname(*schluessel)
+    with _lock:
+        _zaehler[schluessel] = _zaehler.get(schluessel, 0) + wert
+        # Die Werte gehen auch in die umschließenden Stufen ein (z.B. Kachel -> Download)
+        while aktuell is not None:
+            aktuell.werte[kurz] = aktuell.werte.get(kurz, 0) + wert
+            aktuell = aktuell.eltern
+    auftrag = _auftrag.get()
+    if auftrag is not None:
+        auftrag._zaehlen(schluessel, wert)
+
+def _kurzname(name, labels):
+    # Name für Log-Ereignisse und Zusammenfassungen, z.B. "cache_hit"
+    return "_".join([name] + [str(v) for k, v in labels if k != "stufe"])
+
+def im_kontext(funktion):
+    """
+    Bindet eine Funktion an den aktuellen Auftrag und die aktuelle Stufe, für die Übergabe an Thread-Pools.
+    """
+    auftrag, aktuell = _auftrag.get(), _stufe.get()
+    def aufrufen(*args, **kwargs):
+        tokens = _auftrag.set(auftrag), _stufe.set(aktuell)
+        try:
+            return funktion(*args, **kwargs)
+        finally:
+            _stufe.reset(tokens[1])
+            _auftrag.reset(tokens[0])
+    return aufrufen
+
+@contextmanager
+def _profilieren(kennung, profil):
+    arten = {p.strip().lower() for p in (profil or "").split(",") if p.strip()}
+    if not arten:
+        yield
+        return
+
+    os.makedirs(PROFIL_DIR, exist_ok=True)
+    name = "".join(z if z.isalnum() or z in "-_." else "_" for z in str(kennung))
+    profiler = None
+    if "cprofile" in arten:
+        # cProfile erfasst nur den Thread, der den Auftrag ausführt, nicht die Thread-Pools
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if "tracemalloc" in arten:
+        import tracemalloc
+        tracemalloc.start(10)
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(PROFIL_DIR, name + ".prof"))
+        if "tracemalloc" in arten:
+            import tracemalloc
+            snapshot = tracemalloc.take_snapshot()
+            _, spitze = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            with open(os.path.join(PROFIL_DIR, name + ".tracemalloc.txt"), "w", encoding="utf-8") as f:
+                f.write("Spitze: {} Bytes\n".format(spitze))
+                for statistik in snapshot.statistics("traceback")[:25]:
+                    f.write("\n{} Bytes in {} Blöcken\n".format(statistik.size, statistik.count))
+                    f.write("\n".join(statistik.traceback.format()) + "\n")
+        _ereignis(logging.INFO, ereignis="profil", auftrag=kennung, arten=sorted(arten), ordner=PROFIL_DIR)
+
+def exportieren():
+    """
+    Stellt die Metriken des Prozesses wie konfiguriert bereit: startet den /metrics-Endpunkt (einmal je Prozess)
+    und schreibt die Prometheus-Textdatei.
+    """
+    if METRIKEN_PORT:
+        http_starten(int(METRIKEN_PORT))
+    if METRIKEN_DATEI:
+        textdatei_schreiben(METRIKEN_DATEI)
+
+@contextmanager
+def auftrag(kennung, profil=None, bereitstellen=True):
+    """
+    Klammert einen Auftrag. Alle Stufen und Zähler im Kontext werden dem Auftrag zugeordnet.
+
+    Am Ende wird ein Log-Ereignis mit der Zusammenfassung geschrieben und, falls konfiguriert,
+    die Prometheus-Textdatei aktualisiert.
+
+    Parameters:
+    kennung (str): Kennung des Auftrags, z.B. der Name des temporären Ordners.
+    profil (str): "cprofile", "tracemalloc" oder beides durch Komma getrennt, Standard GEODATEN_PROFIL.
+    bereitstellen (bool): Metriken bereitstellen (siehe exportieren()), False in Prozessen eines Pools,
+                          deren Zusammenfassung der übergeordnete Prozess übernimmt.
+
+    Returns:
+    Auftrag: Die Messungen des Auftrags.
+    """
+    if bereitstellen and METRIKEN_PORT:
+        http_starten(int(METRIKEN_PORT))
+    eintrag = Auftrag(kennung)
+    token = _auftrag.set(eintrag)
+    status = "fehler"
+    try:
+        with _profilieren(kennung, profil if profil is not None else PROFIL):
+            yield eintrag
+        status = "ok"
+    finally:
+        _auftrag.reset(token)
+        eintrag.sekunden = time.perf_counter() - eintrag.start
+        _auftrag_beenden(eintrag.sekunden, status)
+        zusammenfassung = eintrag.zusammenfassung()
+        _ereignis(logging.INFO if status == "ok" else logging.WARNING,
+                  ereignis="auftrag", auftrag=kennung, status=status, sekunden=round(eintrag.sekunden, 6),
+                  stufen={k: dict(zusammenfassung["zaehler"].get(k, {}), anzahl=len(v), sekunden=round(sum(v), 6))
+                          for k, v in zusammenfassung["stufen"].items()})
+        if bereitstellen and METRIKEN_DATEI:
+            textdatei_schreiben(METRIKEN_DATEI)
+
+def _auftrag_beenden(sekunden, status):
+    _beobachten("auftrag", sekunden)
+    with _lock:
+        schluessel = ("auftraege", (("status", status),))
+        _zaehler[schluessel] = _zaehler.get(schluessel, 0) + 1
+
+def uebernehmen(zusammenfassung, status="ok"):
+    """
+    Übernimmt die Zusammenfassung eines Auftrags aus einem anderen Prozess (Batch-Modus) in die Metriken dieses Prozesses.
+    """
+    _auftrag_beenden(zusammenfassung["sekunden"], status)
+    for name, laufzeiten in zusammenfassung["stufen"].items():
+        for sekunden in laufzeiten:
+            _beobachten(name, sekunden)
+    with _lock:
+        for name, labels, wert in zusammenfassung["labels"]:
+            schluessel = (name, tuple(sorted(labels.items())))
+            _zaehler[schluessel] = _zaehler.get(schluessel, 0) + wert
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels) + "}"
+
+def prometheus_text():
+    """
+    Alle Metriken des Prozesses im Prometheus-Textformat.
+    """
+    with _lock:
+        dauer = {k: list(v) for k, v in _dauer.items()}
+        zaehler = dict(_zaehler)
+
+    zeilen = [
+        "# HELP geodaten_stufe_dauer_sekunden Laufzeit der Verarbeitungsstufen in Sekunden.",
+        "# TYPE geodaten_stufe_dauer_sekunden histogram",
+    ]
+    for name in sorted(dauer):
+        eintrag = dauer[name]
+        for grenze, anzahl in zip(HISTOGRAMM_GRENZEN, eintrag):
+            zeilen.append("geodaten_stufe_dauer_sekunden_bucket{}".format(_labels((("stufe", name), ("le", grenze)))) + " {}".format(anzahl))
+        zeilen.append("geodaten_stufe_dauer_sekunden_bucket{} {}".format(_labels((("stufe", name), ("le", "+Inf"))), eintrag[-1]))
+        zeilen.append("geodaten_stufe_dauer_sekunden_sum{} {}".format(_labels((("stufe", name),)), eintrag[-2]))
+        zeilen.append("geodaten_stufe_dauer_sekunden_count{} {}".format(_labels((("stufe", name),)), eintrag[-1]))
+
+    for name in sorted({n for n, _ in zaehler}):
+        metrik = "geodaten_{}_total".format(name)
+        zeilen.append("# TYPE {} counter".format(metrik))
+        for (n, labels), wert in sorted(zaehler.items()):
+            if n == name:
+                zeilen.append("{}{} {}".format(metrik, _labels(labels), wert))
+    return "\n".join(zeilen) + "\n"
+
+def textdatei_schreiben(pfad):
+    """
+    Schreibt die Metriken atomar in eine Textdatei (z.B. für den Textfile-Collector des node_exporter).
+    """
+    ordner = os.path.dirname(os.path.abspath(pfad))
+    os.makedirs(ordner, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=ordner, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
+    os.replace(tmp, pfad)
+
+def http_starten(port, adresse="0.0.0.0"):
+    """
+    Startet einmal je Prozess einen HTTP-Server mit den Metriken unter /metrics.
+    """
+    global _http
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    with _lock:
+        if _http is not None:
+            return _http or None
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                inhalt = prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(inhalt)))
+                self.end_headers()
+                self.wfile.write(inhalt)
+
+        try:
+            _http = ThreadingHTTPServer((adresse, port), Handler)
+        except OSError:
+            # Port bereits belegt, z.B. durch einen zweiten Prozess
+            logger.warning("Metriken-Endpunkt auf Port {} nicht verfügbar".format(port))
+            _http = False
+            return None
+        _http.daemon_threads = True
+        threading.Thread(target=_http.serve_forever, daemon=True).start()
+        return _http
@@ -0,0 +1,113 @@
+# Schritte eines Auftrags, gemeinsam genutzt von der Streamlit-Anwendung (main.py) und dem Batch-Modus (batch.py)
+# Auflisten der Dateien je Bundesland (siehe anbieter), Ermitteln der Bundesländer und Verarbeitung der heruntergeladenen Dateien
+
+import os
+import kachelauswahl
+
+def bundeslaender_ermitteln(polygon):
+    """
+    Ermittelt alle Bundesländer, die das Polygon schneiden, über die Landesgrenzen oder Nominatim (siehe bundeslaender).
+
+    Parameters:
+    polygon (shapely.geometry.Polygon): Polygon in EPSG:25832.
+
+    Returns:
+    list of str: Namen der Bundesländer, absteigend nach Anteil am Polygon, leer, wenn das Polygon in keinem liegt.
+
+    Raises:
+    RuntimeError: Wenn die Datei der Landesgrenzen fehlt und Nominatim nicht erreichbar ist.
+    """
+    import bundeslaender
+    return [name for name, _ in bundeslaender.bundeslaender(polygon)]
+
+def auflisten(polygon, bundesland, puffer=0, gelaende_bbox=False):
+    """
+    Listet die Dateien für ein Polygon bei den Anbietern der Bundesländer auf (siehe anbieter).
+
+    Es werden nur die Kacheln geliefert, die das um puffer Meter vergrößerte Polygon schneiden.
+    Die Anzahl und Größe der dadurch eingesparten Kacheln steht unter "gespart" in der Dateienbeschreibung.
+
+    Parameters:
+    bundesland (str or list of str): Bundesland oder alle Bundesländer des Polygons (siehe bundeslaender_ermitteln).
+                                     Bei mehreren wird das Polygon an den Landesgrenzen geteilt.
+    gelaende_bbox (bool): Die Geländekacheln der ganzen (gepufferten) Bounding Box statt nur der am Polygon,
+                          für das Geländeraster (AUSTAL benötigt ein lückenloses Gelände).
+
+    Returns:
+    dict: Dateienbeschreibung je Schlüssel (siehe downloads.get.files) oder None, wenn kein Bundesland unterstützt wird.
+    """
+    import anbieter
+    from shapely.geometry import box
+    laender = [bundesland] if isinstance(bundesland, str) else list(bundesland)
+    puffer = max(puffer, kachelauswahl.PUFFER)
+    dateienbeschreibung = anbieter.auflisten(polygon, laender, puffer)
+    if dateienbeschreibung is not None and gelaende_bbox and "Gelände" in dateienbeschreibung:
+        rechteck = anbieter.auflisten(box(*polygon.buffer(puffer).bounds), laender)
+        if rechteck is None or "Gelände" not in rechteck:
+            return None
+        dateienbeschreibung["Gelände"] = rechteck["Gelände"]
+    return dateienbeschreibung
+
+def verarbeiten(temp_dir, dateienbeschreibung, polygon, spacing=1, puffer=0, gelaende_tif=False, gelaende_grid=False, gebaeude_gml=False,
+                fortschritt=None, xyz_gzip=False, prozesse=None):
+    """
+    Erzeugt die abgeleiteten Dateien aus den heruntergeladenen Kacheln.
+
+    Die Kacheln liegen in temp_dir (z.B. temp_dir/Gelände), damit das virtuelle Mosaik sie relativ referenziert
+    und mit ihnen in die ZIP-Datei gelangt. Der Batch-Modus verknüpft sie dafür aus dem gemeinsamen Ordner.
+
+    Parameters:
+    temp_dir (str): Ausgabeordner des Auftrags.
+    dateienbeschreibung (dict): Heruntergeladene Dateien je Schlüssel.
+    polygon (shapely.geometry.Polygon): Untersuchungsgebiet in EPSG:25832.
+    spacing (int): Auflösung der Geländedatei in Pixeln.
+    puffer (float): Puffer um das Polygon in Metern.
+    gelaende_tif (bool): Zusätzlich das zusammengesetzte Gelände als Cloud-Optimized GeoTIFF erzeugen.
+    gelaende_grid (bool): Zusätzlich das Geländeraster mit Zellen von spacing Pixeln (gemittelt) als Arc/Info ASCII-Grid für AUSTAL erzeugen.
+    gebaeude_gml (bool): Die CityGML-Kacheln zusätzlich zur Gebäudetabelle im Ausgabeordner behalten.
+    fortschritt (callable): Fortschritt der Geländedatei, siehe processing.tifs_to_xyz.
+    xyz_gzip (bool): Die XYZ-Dateien mit gzip komprimieren (dgm.xyz.gz, dgm32.xyz.gz).
+    prozesse (int): Kerne des Auftrags, Anzahl der Prozesse für die XYZ-Dateien und die Gebäude,
+                    None für processing.XYZ_PROZESSE bzw. gebaeude.GEBAEUDE_PROZESSE.
+    """
+    if "Gelände" in dateienbeschreibung:
+        # XYZ-Dateien direkt aus den Kacheln, statt eines zusammengesetzten GeoTIFF nur ein virtuelles Mosaik (VRT).
+        # Das GeoTIFF wird nur auf Wunsch aus dem Mosaik erzeugt.
+        from processing import tifs_to_xyz, vrt_erstellen, XYZ_PROZESSE, XYZ_GZIP_STUFE, cog_erstellen, gelaende_grid as grid_schreiben
+        os.makedirs(os.path.join(temp_dir, "Gelände"), exist_ok=True)
+        tif_files = [os.path.join(temp_dir, "Gelände", file_name.split("/")[-1]) for file_name in dateienbeschreibung["Gelände"]["files"]]
+        # Kacheln außerhalb des gelesenen Ausschnitts gibt es nicht (siehe downloads.fenster)
+        tif_files = [tif_file for tif_file in tif_files if os.path.exists(tif_file)]
+        vrt_file = os.path.join(temp_dir, "Gelände", "Gelände.vrt")
+        vrt_erstellen(tif_files, vrt_file)
+        tifs_to_xyz(
+            tif_files,
+            os.path.join(temp_dir, "Gelände", "dgm.xyz"),
+            polygon=polygon,
+            puffer=puffer,
+            spacing=spacing,
+            max_memory=512 * 1024 ** 2,
+            fortschritt=fortschritt,
+            prozesse=prozesse or XYZ_PROZESSE,
+            gzip_stufe=XYZ_GZIP_STUFE if xyz_gzip else None
+        )
+        if gelaende_tif:
+            cog_erstellen(vrt_file, os.path.join(temp_dir, "Gelände", "Gelände_zusammen.tif"))
+        if gelaende_grid:
+            import rasterio
+            with rasterio.open(vrt_file) as src:
+                zellgroesse = spacing * src.res[0]
+            grid_schreiben(vrt_file, os.path.join(temp_dir, "Gelände", "dgm.asc"), zellgroesse, polygon=polygon, puffer=puffer)
+
+    if "Gebäude" in dateienbeschreibung:
+        # Grundrisse und Höhen der Gebäude im Untersuchungsgebiet statt der ganzen CityGML-Kacheln
+        from gebaeude import gebaeude_extrahieren, GEBAEUDE_PROZESSE
+        os.makedirs(os.path.join(temp_dir, "Gebäude"), exist_ok=True)
+        gml_files = [os.path.join(temp_dir, "Gebäude", file_name.split("/")[-1]) for file_name in dateienbeschreibung["Gebäude"]["files"]]
+        gebaeude_extrahieren(gml_files, os.path.join(temp_dir, "Gebäude", "gebaeude"), polygon=polygon, puffer=puffer,
+                             prozesse=prozesse or GEBAEUDE_PROZESSE)
+        if not gebaeude_gml:
+            for file_name in dateienbeschreibung["Gebäude"]["files"]:
+                pfad = os.path.join(temp_dir, "Gebäude", file_name.split("/")[-1])
+                if os.path.exists(pfad):
+                    os.remove(pfad)
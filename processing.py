@@ -1,28 +1,56 @@
 # Kobiniere eine mehrere tif Dateien zu einer tif Datei
 
+import os
 from PIL import Image
 import numpy as np
 import rasterio
 from rasterio.merge import merge
-import csv
+from concurrent.futures import ThreadPoolExecutor
+import metriken
 
-def merge_tifs(tif_files, output_file):
+# Nodata-Wert der zusammengesetzten Geländedateien
+NODATA = -9999
+# Anzahl der Prozesse für die Formatierung der XYZ-Dateien, Standard Anzahl der CPU-Kerne (1 ohne Prozesse)
+XYZ_PROZESSE = int(os.environ.get("GEODATEN_XYZ_PROZESSE", 0)) or None
+# Ausgabezellen je Aufgabe eines Prozesses
+XYZ_BAND_ZELLEN = 1_000_000
+# Raster mit weniger Ausgabezellen werden im eigenen Prozess formatiert, der Start der Prozesse lohnt sich nicht
+XYZ_PARALLEL_AB = 4_000_000
+# Kompressionsstufe, wenn die XYZ-Dateien mit gzip komprimiert werden
+XYZ_GZIP_STUFE = 6
+
+@metriken.stufe("zusammenfuegen")
+def merge_tifs(tif_files, output_file, max_memory=None, threads=4):
     """
     Merges multiple TIFF files into one and preserves the original georeferencing information of each file.
 
+    Without max_memory the whole mosaic is built in memory. With max_memory the mosaic is built
+    window by window (see merge_tifs_windowed), so peak memory depends on the window size only.
+    If output_file ends with ".vrt", only a virtual mosaic referencing the tiles is written (see vrt_erstellen).
+
     Args:
     tif_files (list of str): List of paths to the TIFF files.
     output_file (str): Path to the output merged TIFF file.
+    max_memory (int): Optional memory ceiling in bytes for the windowed merge.
+    threads (int): Number of threads reading source tiles in the windowed merge.
 
     Returns:
     None
     """
+    metriken.zaehlen("kacheln", len(tif_files))
+    if output_file.lower().endswith(".vrt"):
+        vrt_erstellen(tif_files, output_file)
+        return
+    if max_memory is not None:
+        merge_tifs_windowed(tif_files, output_file, max_memory=max_memory, threads=threads)
+        return
+
     src_files_to_mosaic = []
     for tif in tif_files:
         src = rasterio.open(tif, crs='EPSG:25832')
         src_files_to_mosaic.append(src)
 
-    mosaic, out_trans = merge(src_files_to_mosaic, method='first', nodata=-9999)
+    mosaic, out_trans = merge(src_files_to_mosaic, method='first', nodata=NODATA)
 
     # Update the metadata with the merged mosaic information
     out_meta = src_files_to_mosaic[0].meta.copy()
@@ -42,34 +70,674 @@ def merge_tifs(tif_files, output_file):
     for src in src_files_to_mosaic:
         src.close()
 
-def tif_to_xyz(tif_file, xyz_file, spacing=1):
+def _mosaik_raster(tif_files):
+    """
+    Ermittelt das Ausgaberaster eines Mosaiks aus den Metadaten der Kacheln, ohne Pixel zu lesen.
+
+    Das Raster entspricht dem von rasterio.merge.merge: Vereinigung der Ausdehnungen und Auflösung der ersten Datei.
+
+    Parameters:
+    tif_files (list of str): Pfade zu den TIFF-Dateien.
+
+    Returns:
+    dict: Transformation, Größe, Datentyp, Bandanzahl, CRS und Ausdehnung jeder Quelle.
+    """
+    from rasterio.transform import Affine
+
+    quellen = []
+    formen = []
+    for i, tif in enumerate(tif_files):
+        with rasterio.open(tif) as src:
+            if i == 0:
+                res = src.res
+                dtype = src.dtypes[0]
+                count = src.count
+                crs = src.crs or "EPSG:25832"
+            quellen.append((tif, tuple(src.bounds)))
+            formen.append({"width": src.width, "height": src.height, "block": src.block_shapes[0], "nodata": src.nodata})
+
+    west = min(b[0] for _, b in quellen)
+    south = min(b[1] for _, b in quellen)
+    east = max(b[2] for _, b in quellen)
+    north = max(b[3] for _, b in quellen)
+    return {
+        "transform": Affine.translation(west, north) * Affine.scale(res[0], -res[1]),
+        "width": int(round((east - west) / res[0])),
+        "height": int(round((north - south) / res[1])),
+        "dtype": dtype,
+        "count": count,
+        "crs": crs,
+        "quellen": quellen,
+        "formen": formen,
+    }
+
+def _fenster_seite(max_memory, raster, kachel=256):
+    """
+    Seitenlänge der quadratischen Ausgabefenster für eine Speichergrenze.
+
+    Je Fenster werden das Ausgabefenster und die gelesenen Quellausschnitte (zusammen etwa das Dreifache) gehalten.
+    Die Seitenlänge ist ein Vielfaches der internen Kachelgröße der Ausgabedatei.
+    """
+    pixel_bytes = np.dtype(raster["dtype"]).itemsize * raster["count"]
+    seite = int((max_memory / (3 * pixel_bytes)) ** 0.5) // kachel * kachel
+    return max(kachel, seite)
+
+def _mosaik_fenster(raster, window, pool):
+    """
+    Setzt ein Fenster des Mosaiks aus den überlappenden Kacheln zusammen (Methode "first" wie merge_tifs).
+
+    Es werden nur die Kacheln geöffnet, die das Fenster schneiden. Jede Kachel wird in einem eigenen
+    Thread mit eigenem Dateihandle gelesen, GDAL gibt beim Lesen den GIL frei.
+
+    Parameters:
+    raster (dict): Ausgaberaster aus _mosaik_raster.
+    window (rasterio.windows.Window): Fenster im Ausgaberaster.
+    pool (ThreadPoolExecutor): Threads zum Lesen der Kacheln.
+
+    Returns:
+    np.ndarray: Daten des Fensters (Bänder, Zeilen, Spalten), leere Zellen mit NODATA gefüllt.
+    """
+    from rasterio.windows import bounds as window_bounds, from_bounds
+
+    links, unten, rechts, oben = window_bounds(window, raster["transform"])
+    shape = (raster["count"], int(window.height), int(window.width))
+
+    def lesen(tif):
+        with rasterio.open(tif) as src:
+            src_window = from_bounds(links, unten, rechts, oben, transform=src.transform)
+            src_window = src_window.round_offsets().round_lengths()
+            return src.read(window=src_window, out_shape=shape, boundless=True, masked=True)
+
+    # Nur Kacheln, die das Fenster schneiden
+    treffer = [tif for tif, b in raster["quellen"]
+               if b[0] < rechts and b[2] > links and b[1] < oben and b[3] > unten]
+
+    daten = np.full(shape, NODATA, dtype=raster["dtype"])
+    leer = np.ones(shape, dtype=bool)
+    # Reihenfolge der Kacheln bleibt erhalten: die erste gültige Zelle gewinnt
+    for gelesen in pool.map(lesen, treffer):
+        neu = leer & ~np.ma.getmaskarray(gelesen)
+        np.copyto(daten, gelesen.data, where=neu)
+        leer &= ~neu
+    return daten
+
+def _mosaik_fenster_liste(raster, seite):
+    """Zerlegt das Ausgaberaster in quadratische Fenster mit der Seitenlänge seite."""
+    from rasterio.windows import Window
+
+    return [Window(col, row, min(seite, raster["width"] - col), min(seite, raster["height"] - row))
+            for row in range(0, raster["height"], seite)
+            for col in range(0, raster["width"], seite)]
+
+def merge_tifs_windowed(tif_files, output_file, max_memory=256 * 1024 ** 2, threads=4):
+    """
+    Setzt mehrere TIFF-Dateien fensterweise zu einer gekachelten, komprimierten GeoTIFF-Datei zusammen.
+
+    Das Mosaik wird nie vollständig im Speicher gehalten. Der Speicherbedarf hängt nur von der
+    Fenstergröße ab, die aus max_memory berechnet wird, nicht von der Größe des Gebiets.
+
+    Parameters:
+    tif_files (list of str): Pfade zu den TIFF-Dateien.
+    output_file (str): Pfad zur Ausgabe-TIFF-Datei.
+    max_memory (int): Obergrenze des Speichers je Fenster in Bytes.
+    threads (int): Anzahl der Threads zum Lesen der Kacheln.
+    """
+    raster = _mosaik_raster(tif_files)
+    seite = _fenster_seite(max_memory, raster)
+
+    profile = {
+        "driver": "GTiff",
+        "height": raster["height"],
+        "width": raster["width"],
+        "count": raster["count"],
+        "dtype": raster["dtype"],
+        "crs": raster["crs"],
+        "transform": raster["transform"],
+        "nodata": NODATA,
+        "tiled": True,
+        "blockxsize": 256,
+        "blockysize": 256,
+        "compress": "deflate",
+        "BIGTIFF": "IF_SAFER",
+    }
+    with rasterio.open(output_file, "w", **profile) as dest:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            # Jedes Fenster wird geschrieben, sobald es fertig ist
+            for window in _mosaik_fenster_liste(raster, seite):
+                dest.write(_mosaik_fenster(raster, window, pool), window=window)
+
+# GDAL-Namen der Datentypen für VRT-Dateien
+_GDAL_TYPEN = {
+    "uint8": "Byte", "int8": "Int8", "uint16": "UInt16", "int16": "Int16", "uint32": "UInt32",
+    "int32": "Int32", "float32": "Float32", "float64": "Float64",
+}
+
+def vrt_erstellen(tif_files, vrt_file):
+    """
+    Schreibt ein virtuelles Mosaik (GDAL VRT) über die Kacheln, ohne Pixel zu lesen oder zu kopieren.
+
+    Das Raster entspricht dem von merge_tifs. Bei Überlappungen gilt wie dort der Wert der ersten Kachel.
+    Die Kacheln werden relativ zur VRT-Datei referenziert und erst beim Lesen eines Fensters geöffnet,
+    die VRT-Datei bleibt daher zusammen mit den Kacheln verwendbar (z.B. in der ZIP-Datei).
+
+    Parameters:
+    tif_files (list of str): Pfade zu den TIFF-Dateien.
+    vrt_file (str): Pfad zur Ausgabe-VRT-Datei.
+    """
+    from xml.sax.saxutils import escape
+    from rasterio.crs import CRS
+
+    raster = _mosaik_raster(tif_files)
+    transform = raster["transform"]
+    ordner = os.path.dirname(os.path.abspath(vrt_file))
+    typ = _GDAL_TYPEN[raster["dtype"]]
+
+    def quelle(band, tif, bounds, form):
+        # Zielrechteck im Mosaik aus der Ausdehnung der Kachel
+        links, oben = ~transform * (bounds[0], bounds[3])
+        rechts, unten = ~transform * (bounds[2], bounds[1])
+        nodata = "<NODATA>{}</NODATA>".format(form["nodata"]) if form["nodata"] is not None else ""
+        return (
+            '    <ComplexSource>\n'
+            '      <SourceFilename relativeToVRT="1">{}</SourceFilename>\n'
+            '      <SourceBand>{}</SourceBand>\n'
+            '      <SourceProperties RasterXSize="{}" RasterYSize="{}" DataType="{}" BlockXSize="{}" BlockYSize="{}"/>\n'
+            '      <SrcRect xOff="0" yOff="0" xSize="{}" ySize="{}"/>\n'
+            '      <DstRect xOff="{}" yOff="{}" xSize="{}" ySize="{}"/>\n'
+            '      {}\n'
+            '    </ComplexSource>\n'
+        ).format(
+            escape(os.path.relpath(os.path.abspath(tif), ordner).replace(os.sep, "/")), band,
+            form["width"], form["height"], typ, form["block"][1], form["block"][0],
+            form["width"], form["height"],
+            round(links), round(oben), round(rechts - links), round(unten - oben), nodata)
+
+    with open(vrt_file, "w", encoding="utf-8") as f:
+        f.write('<VRTDataset rasterXSize="{}" rasterYSize="{}">\n'.format(raster["width"], raster["height"]))
+        f.write('  <SRS dataAxisToSRSAxisMapping="1,2">{}</SRS>\n'.format(escape(CRS.from_user_input(raster["crs"]).to_wkt())))
+        f.write("  <GeoTransform>{!r}, {!r}, {!r}, {!r}, {!r}, {!r}</GeoTransform>\n".format(*transform.to_gdal()))
+        for band in range(1, raster["count"] + 1):
+            f.write('  <VRTRasterBand dataType="{}" band="{}">\n'.format(typ, band))
+            f.write("    <NoDataValue>{}</NoDataValue>\n".format(NODATA))
+            # Spätere Quellen überdecken frühere: umgekehrte Reihenfolge, damit die erste Kachel gilt
+            for (tif, bounds), form in reversed(list(zip(raster["quellen"], raster["formen"]))):
+                f.write(quelle(band, tif, bounds, form))
+            f.write("  </VRTRasterBand>\n")
+        f.write("</VRTDataset>\n")
+
+@metriken.stufe("cog")
+def cog_erstellen(quelle, ziel, blockgroesse=512, threads=4):
+    """
+    Schreibt ein Raster (z.B. ein virtuelles Mosaik) als Cloud-Optimized GeoTIFF mit interner Kachelung und Übersichten.
+
+    Die Übersichten werden mit Mittelwertbildung berechnet, das Quellraster wird fensterweise gelesen.
+
+    Parameters:
+    quelle (str): Pfad des Quellrasters, z.B. eine VRT-Datei aus vrt_erstellen.
+    ziel (str): Pfad der Ausgabe-TIFF-Datei.
+    blockgroesse (int): Kantenlänge der internen Kacheln in Pixeln.
+    threads (int): Anzahl der Threads für die Kompression.
+    """
+    from rasterio.shutil import copy
+
+    with rasterio.open(quelle) as src:
+        praediktor = "FLOATING_POINT" if np.dtype(src.dtypes[0]).kind == "f" else "STANDARD"
+    copy(quelle, ziel, driver="COG", COMPRESS="DEFLATE", PREDICTOR=praediktor, BLOCKSIZE=blockgroesse,
+         OVERVIEWS="AUTO", RESAMPLING="AVERAGE", BIGTIFF="IF_SAFER", NUM_THREADS=threads)
+    metriken.zaehlen("bytes", os.path.getsize(ziel))
+
+# Zeilenformat der XYZ-Dateien
+_XYZ_ZEILE = "%d %d %.2f\r\n"
+
+def _ascii_feld(werte, negativ):
+    """
+    Wandelt ganze Zahlen in ASCII-Ziffern um.
+
+    Parameters:
+    werte (np.ndarray): Beträge der Zahlen (int64, nicht negativ).
+    negativ (np.ndarray): Bool-Array, ob ein Minuszeichen vorangestellt wird.
+
+    Returns:
+    tuple of np.ndarray: Zeichenmatrix (1 + Stellen, n) und Maske der zu schreibenden Zeichen.
+    """
+    stellen = len(str(int(werte.max())))
+    zeichen = np.empty((stellen + 1, len(werte)), dtype=np.uint8)
+    behalten = np.empty(zeichen.shape, dtype=bool)
+    zeichen[0] = ord("-")
+    behalten[0] = negativ
+    rest = werte.astype(np.uint32) if stellen < 10 else werte.copy()
+    for i in range(stellen, 0, -1):
+        rest, ziffer = np.divmod(rest, 10)
+        zeichen[i] = ziffer
+        # Führende Nullen entfallen, die Einerstelle bleibt immer stehen
+        behalten[i] = werte >= 10 ** (stellen - i) if i < stellen else True
+    zeichen[1:] += ord("0")
+    return zeichen, behalten
+
+def _format_xyz_numpy(xi, yi, z):
+    """
+    Schnelle Formatierung von _format_xyz vollständig mit NumPy.
+
+    Setzt voraus, dass z * 100 in float64 exakt darstellbar ist (float32-, float16- oder Integer-Raster)
+    und alle Werte endlich sind. Dann entspricht np.rint(z * 100) der Rundung von "%.2f".
+    """
+    n = len(z)
+    z64 = z.astype(np.float64)
+    hundertstel = np.abs(np.rint(z64 * 100)).astype(np.int64)
+
+    leer = (np.full((1, n), ord(" "), dtype=np.uint8), np.ones((1, n), dtype=bool))
+    nachkomma = np.empty((5, n), dtype=np.uint8)
+    nachkomma[0] = ord(".")
+    nachkomma[1] = (hundertstel % 100) // 10 + ord("0")
+    nachkomma[2] = hundertstel % 10 + ord("0")
+    nachkomma[3] = ord("\r")
+    nachkomma[4] = ord("\n")
+    felder = [
+        _ascii_feld(np.abs(xi + 32000000), xi + 32000000 < 0),
+        _ascii_feld(np.abs(xi), xi < 0),
+        leer,
+        _ascii_feld(np.abs(yi), yi < 0),
+        leer,
+        # "%.2f" behält das Vorzeichen auch bei -0.00
+        _ascii_feld(hundertstel // 100, np.signbit(z64)),
+        (nachkomma, np.ones((5, n), dtype=bool)),
+    ]
+
+    # Zeilenweise Anordnung der Zeichen (n, Zeichen je Zeile)
+    zeichen = np.concatenate([f[0] for f in felder]).T.copy()
+    behalten = np.concatenate([f[1] for f in felder]).T.copy()
+
+    # Beide Dateien teilen sich die Zeichenmatrix, sie unterscheiden sich nur im X-Feld
+    breite32 = len(felder[0][0])
+    breite = len(felder[1][0])
+    behalten32 = behalten.copy()
+    behalten32[:, breite32:breite32 + breite] = False
+    behalten[:, :breite32] = False
+    return zeichen[behalten].tobytes(), zeichen[behalten32].tobytes()
+
+def _format_xyz(x, y, z):
+    """
+    Formatiert einen Block von Rasterzellen in die Zeilen von dgm.xyz und dgm32.xyz.
+
+    Die Zeilen entsprechen exakt der bisherigen csv-Ausgabe (Trennzeichen Leerzeichen,
+    Zeilenende "\\r\\n", X und Y abgeschnitten auf ganze Meter, Z mit zwei Nachkommastellen).
+
+    Parameters:
+    x (np.ndarray): X-Koordinaten der Zellen (float64).
+    y (np.ndarray): Y-Koordinaten der Zellen (float64).
+    z (np.ndarray): Höhenwerte der Zellen.
+
+    Returns:
+    tuple of bytes: Inhalt für die XYZ-Datei und die 32-XYZ-Datei.
+    """
+    n = len(z)
+    if n == 0:
+        return b"", b""
+    # int(x) schneidet in Richtung 0 ab
+    xi = np.trunc(x).astype(np.int64)
+    yi = np.trunc(y).astype(np.int64)
+
+    exakt = (z.dtype.kind == "f" and z.dtype.itemsize <= 4) or (z.dtype.kind in "iu" and z.dtype.itemsize <= 4)
+    if exakt and np.isfinite(z).all():
+        return _format_xyz_numpy(xi, yi, z)
+
+    # Allgemeiner Fall (z.B. float64 oder NaN): Formatierung mit dem %-Operator
+    # float(np.float32) entspricht der bisherigen f-String Formatierung
+    zs = z.astype(np.float64) if z.dtype.kind == "f" else z
+
+    werte = np.empty((n, 3), dtype=object)
+    werte[:, 0] = xi.tolist()
+    werte[:, 1] = yi.tolist()
+    werte[:, 2] = zs.tolist()
+    text = (_XYZ_ZEILE * n) % tuple(werte.ravel())
+    # Sechsstellige Rechtswerte: die 32-Variante ist die gleiche Zeile mit vorangestelltem "32"
+    if xi.min() >= 100000 and xi.max() <= 999999:
+        text32 = "32" + text.replace("\r\n", "\r\n32")[:-2]
+    else:
+        werte[:, 0] = (xi + 32000000).tolist()
+        text32 = (_XYZ_ZEILE * n) % tuple(werte.ravel())
+    return text.encode("ascii"), text32.encode("ascii")
+
+def _xyz_dateien(xyz_file, gzip_stufe=None):
+    """Pfade der XYZ-Datei und der 32-XYZ-Datei, mit gzip_stufe mit der Endung .gz."""
+    endung = ".gz" if gzip_stufe is not None else ""
+    return xyz_file + endung, xyz_file[:-4] + "32.xyz" + endung
+
+def _xyz_teil(block, innen, zeile0, cols, spacing, transform, gzip_stufe=None):
+    """
+    Formatiert abgetastete Rasterzeilen in die Zeilen beider XYZ-Dateien.
+
+    Parameters:
+    block (np.ndarray): Abgetastete Höhen (Zeilen, Spalten).
+    innen (np.ndarray): Maske der zu schreibenden Zellen, None für alle.
+    zeile0 (int): Rasterzeile der ersten Zeile von block.
+    cols (np.ndarray): Rasterspalten der Abtastpunkte.
+    spacing (int): Abstand der Abtastpunkte in Pixeln.
+    transform (affine.Affine): Transformation des Rasters.
+    gzip_stufe (int): Kompressionsstufe, die Teile werden als eigene gzip-Member komprimiert, None ohne Kompression.
+
+    Returns:
+    tuple of bytes: Inhalt für die XYZ-Datei und die 32-XYZ-Datei.
+    """
+    rows = zeile0 + np.arange(block.shape[0]) * spacing
+    # Berechnung der x- und y-Koordinaten (gleiche Rechenreihenfolge wie transform * (col, row))
+    c = cols.astype(np.float64)[np.newaxis, :]
+    r = rows.astype(np.float64)[:, np.newaxis]
+    x = c * transform.a + r * transform.b + transform.c
+    y = c * transform.d + r * transform.e + transform.f
+    if innen is None:
+        text, text32 = _format_xyz(x.ravel(), y.ravel(), np.asarray(block).ravel())
+    else:
+        innen = np.asarray(innen)
+        text, text32 = _format_xyz(x[innen], y[innen], np.asarray(block)[innen])
+    if gzip_stufe is not None:
+        import gzip
+        # Aneinandergehängte gzip-Member ergeben eine gültige gzip-Datei
+        text, text32 = gzip.compress(text, gzip_stufe, mtime=0), gzip.compress(text32, gzip_stufe, mtime=0)
+    return text, text32
+
+def _xyz_band(streifen, maske, von, bis, zeile0, cols, spacing, transform, teil, gzip_stufe=None):
+    """
+    Formatiert die Zeilen von bis bis eines Streifens in Teildateien, läuft in einem Prozess des Pools.
+
+    Der Streifen wird aus der .npy-Datei nur eingeblendet (mmap), die Daten werden nicht zwischen den Prozessen kopiert.
+
+    Parameters:
+    streifen (str): .npy-Datei mit den abgetasteten Höhen des Streifens.
+    maske (str): .npy-Datei mit der Maske der zu schreibenden Zellen, None für alle.
+    von, bis (int): Zeilen im Streifen.
+    zeile0 (int): Rasterzeile der ersten Zeile des Streifens.
+    teil (str): Pfad der Teildateien ohne Endung, geschrieben werden <teil>.xyz und <teil>32.xyz.
+
+    Returns:
+    tuple of int: Größe der beiden Teildateien in Bytes.
+    """
+    block = np.load(streifen, mmap_mode="r")[von:bis]
+    innen = np.load(maske, mmap_mode="r")[von:bis] if maske is not None else None
+    text, text32 = _xyz_teil(block, innen, zeile0 + von * spacing, cols, spacing, transform, gzip_stufe)
+    with open(teil + ".xyz", "wb") as f:
+        f.write(text)
+    with open(teil + "32.xyz", "wb") as f:
+        f.write(text32)
+    return len(text), len(text32)
+
+def _anhaengen(ziel, pfad, chunk=1024 * 1024):
+    # Teildatei an die geöffnete Ausgabedatei anhängen und entfernen.
+    # Unter Linux kopiert der Kernel (copy_file_range), die Daten laufen nicht durch den Hauptprozess.
+    import shutil
+
+    with open(pfad, "rb") as f:
+        groesse = os.fstat(f.fileno()).st_size
+        kopiert = 0
+        if hasattr(os, "copy_file_range"):
+            ziel.flush()
+            try:
+                while kopiert < groesse:
+                    n = os.copy_file_range(f.fileno(), ziel.fileno(), groesse - kopiert)
+                    if n == 0:
+                        break
+                    kopiert += n
+            except OSError:
+                # Dateisystem ohne Unterstützung, der Rest wird gelesen und geschrieben
+                pass
+        if kopiert < groesse:
+            f.seek(kopiert)
+            shutil.copyfileobj(f, ziel, chunk)
+    os.remove(pfad)
+
+def _xyz_schreiben(streifen, transform, cols, spacing, xyz_file, hoehe, zellen, prozesse=None, gzip_stufe=None, fortschritt=None):
+    """
+    Schreibt die XYZ-Datei und die 32-XYZ-Datei aus den abgetasteten Streifen eines Rasters.
+
+    Ab XYZ_PARALLEL_AB Ausgabezellen werden die Streifen als .npy-Dateien abgelegt und in Bändern von etwa
+    XYZ_BAND_ZELLEN Zellen auf einen Pool aus Prozessen verteilt. Jeder Prozess blendet seinen Streifen ein und
+    formatiert beide Varianten in Teildateien. Ein Thread hängt die Teildateien in der Reihenfolge der Zeilen an,
+    während die nächsten Streifen gelesen und formatiert werden. Es sind höchstens 2 * prozesse Bänder gleichzeitig offen.
+
+    Parameters:
+    streifen (iterable): Je Streifen (erste Rasterzeile, Anzahl der Rasterzeilen, abgetastete Höhen, Maske oder None).
+    transform (affine.Affine): Transformation des Rasters.
+    cols (np.ndarray): Rasterspalten der Abtastpunkte.
+    spacing (int): Abstand der Abtastpunkte in Pixeln.
+    xyz_file (str): Pfad zur Ausgabe-XYZ-Datei.
+    hoehe (int): Anzahl der Rasterzeilen für den Fortschritt.
+    zellen (int): Anzahl der Ausgabezellen (ohne Maske), entscheidet über die Verteilung auf Prozesse.
+    prozesse (int): Anzahl der Prozesse, None für die Anzahl der CPU-Kerne, 1 ohne Prozesse.
+    gzip_stufe (int): Kompressionsstufe für gzip, None ohne Kompression.
+    fortschritt (callable): Wird mit (erledigte Rasterzeilen, hoehe) aufgerufen.
+
+    Returns:
+    int: Größe beider Dateien in Bytes.
+    """
+    import shutil
+    import tempfile
+    import multiprocessing
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+
+    prozesse = prozesse or os.cpu_count() or 1
+    pfad, pfad32 = _xyz_dateien(xyz_file, gzip_stufe)
+    with open(pfad, mode='wb') as file, open(pfad32, mode='wb') as file32:
+        if prozesse == 1 or zellen < XYZ_PARALLEL_AB:
+            for zeile0, zeilen, block, innen in streifen:
+                text, text32 = _xyz_teil(block, innen, zeile0, cols, spacing, transform, gzip_stufe)
+                file.write(text)
+                file32.write(text32)
+                if fortschritt is not None:
+                    fortschritt(zeile0 + zeilen, hoehe)
+            return file.tell() + file32.tell()
+
+        def anhaengen(future, teil, erledigt, dateien):
+            # Läuft im Thread schreiber, die Aufrufe erfolgen in der Reihenfolge der Zeilen
+            future.result()
+            _anhaengen(file, teil + ".xyz")
+            _anhaengen(file32, teil + "32.xyz")
+            # Nach dem letzten Band eines Streifens wird der Streifen nicht mehr benötigt
+            for datei in dateien or ():
+                os.remove(datei)
+            if fortschritt is not None:
+                fortschritt(erledigt, hoehe)
+
+        tmp_dir = tempfile.mkdtemp(prefix=".xyz_", dir=os.path.dirname(os.path.abspath(xyz_file)))
+        # Offene Bänder in der Reihenfolge der Zeilen: (Formatierung, Anhängen)
+        offen = deque()
+        try:
+            # Neue Prozesse statt fork: GDAL und die Threads zum Lesen laufen bereits
+            with ProcessPoolExecutor(max_workers=prozesse, mp_context=multiprocessing.get_context("spawn")) as pool, \
+                    ThreadPoolExecutor(max_workers=1) as schreiber:
+                try:
+                    for i, (zeile0, zeilen, block, innen) in enumerate(streifen):
+                        dateien = [os.path.join(tmp_dir, "{}.npy".format(i))]
+                        np.save(dateien[0], block)
+                        if innen is not None:
+                            dateien.append(os.path.join(tmp_dir, "{}_maske.npy".format(i)))
+                            np.save(dateien[1], innen)
+                        band = max(1, XYZ_BAND_ZELLEN // max(1, block.shape[1]))
+                        for von in range(0, block.shape[0], band):
+                            bis = min(von + band, block.shape[0])
+                            teil = os.path.join(tmp_dir, "{}_{}".format(i, von))
+                            future = pool.submit(_xyz_band, dateien[0], dateien[1] if innen is not None else None,
+                                                 von, bis, zeile0, cols, spacing, transform, teil, gzip_stufe)
+                            letztes = bis == block.shape[0]
+                            offen.append((future, schreiber.submit(anhaengen, future, teil, zeile0 + zeilen if letztes else zeile0 + bis * spacing,
+                                                                   dateien if letztes else None)))
+                            while len(offen) > 2 * prozesse:
+                                offen.popleft()[1].result()
+                    while offen:
+                        offen.popleft()[1].result()
+                except BaseException:
+                    for future, angehaengt in offen:
+                        angehaengt.cancel()
+                        future.cancel()
+                    raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return file.tell() + file32.tell()
+
+@metriken.stufe("xyz")
+def tif_to_xyz(tif_file, xyz_file, spacing=1, block_cells=1_000_000, prozesse=XYZ_PROZESSE, gzip_stufe=None):
     """
     Tastet die Höhenwerte eines TIFF-Rasters in regelmäßigen Abständen ab und speichert die X- und Y-Koordinaten sowie die Höhe in einer XYZ-Datei.
+    Zusätzlich wird eine XYZ-Datei mit vorangestellter Zonennummer (32) erzeugt.
+
+    Das Raster wird in Blöcken von Zeilen gelesen und formatiert, beide Dateien werden aus demselben Puffer geschrieben.
 
     Parameters:
-    tiff_datei (str): Pfad zur TIFF-Datei.
-    abstand (int): Der Abstand zwischen den Abtastpunkten.
-    output_datei (str): Pfad zur Ausgabe-XYZ-Datei.
+    tif_file (str): Pfad zur TIFF-Datei.
+    xyz_file (str): Pfad zur Ausgabe-XYZ-Datei.
+    spacing (int): Der Abstand zwischen den Abtastpunkten in Pixeln.
+    block_cells (int): Ungefähre Anzahl der Ausgabezellen je Block.
+    prozesse (int): Anzahl der Prozesse für die Formatierung, None für die Anzahl der CPU-Kerne (siehe _xyz_schreiben).
+    gzip_stufe (int): Beide Dateien mit gzip komprimieren (Endung .gz), None ohne Kompression.
     """
+    from rasterio.windows import Window
+
     with rasterio.open(tif_file) as dataset:
-        # Lesen der Rasterdaten
-        raster = dataset.read(1)
-        
-        # Bestimmen der Rastertransformation
-        transform = dataset.transform
-        
-        # Öffnen der Ausgabe-XYZ-Datei
-        xyz_file_without_extension = xyz_file[:-4]
-        with open(xyz_file, mode='w', newline='') as file:
-            with open(xyz_file_without_extension + "32.xyz", mode='w', newline='') as file32:
-                writer = csv.writer(file, delimiter=' ')
-                writer32 = csv.writer(file32, delimiter=' ')
-                # Abtastung in regelmäßigen Abständen
-                for row in range(0, raster.shape[0], spacing):
-                    for col in range(0, raster.shape[1], spacing):
-                        # Berechnung der x- und y-Koordinaten
-                        x, y = transform * (col, row)
-                        höhe = raster[row, col]
-                        # Schreiben der Werte in die Datei (X, Y ohne Nachkommastellen, Z mit zwei Nachkommastellen)
-                        writer.writerow([int(x), int(y), f"{höhe:.2f}"])
-                        writer32.writerow([32000000+ int(x), int(y), f"{höhe:.2f}"])
\ No newline at end of file
+        height, width = dataset.height, dataset.width
+        cols = np.arange(0, width, spacing)
+        # Anzahl der Rasterzeilen je Block, immer ein Vielfaches von spacing
+        block_rows = max(1, block_cells // max(1, len(cols))) * spacing
+
+        def streifen():
+            for row_off in range(0, height, block_rows):
+                h = min(block_rows, height - row_off)
+                # Lesen der Rasterdaten des Blocks, Abtastung in regelmäßigen Abständen
+                yield row_off, h, dataset.read(1, window=Window(0, row_off, width, h))[::spacing, ::spacing], None
+
+        zellen = len(cols) * len(range(0, height, spacing))
+        metriken.zaehlen("bytes", _xyz_schreiben(streifen(), dataset.transform, cols, spacing, xyz_file, height, zellen,
+                                                 prozesse=prozesse, gzip_stufe=gzip_stufe))
+
+@metriken.stufe("xyz")
+def tifs_to_xyz(tif_files, xyz_file, polygon=None, puffer=0, spacing=1, tif_file=None, max_memory=256 * 1024 ** 2, threads=4, fortschritt=None,
+                prozesse=XYZ_PROZESSE, gzip_stufe=None):
+    """
+    Erzeugt die XYZ-Dateien direkt aus den heruntergeladenen Kacheln, ohne ein zusammengesetztes Raster zu schreiben.
+
+    Das Mosaik wird in Streifen über die volle Breite gelesen (gleiche Zeilenfolge wie tif_to_xyz).
+    Mit polygon werden nur Punkte innerhalb des (gepufferten) Polygons geschrieben.
+
+    Parameters:
+    tif_files (list of str): Pfade zu den TIFF-Dateien.
+    xyz_file (str): Pfad zur Ausgabe-XYZ-Datei, die 32-XYZ-Datei wird daneben geschrieben.
+    polygon (shapely.geometry.Polygon): Untersuchungsgebiet in EPSG:25832, None für das ganze Mosaik.
+    puffer (float): Puffer um das Polygon in Metern.
+    spacing (int): Der Abstand zwischen den Abtastpunkten in Pixeln.
+    tif_file (str): Optionaler Pfad, unter dem zusätzlich das zusammengesetzte GeoTIFF geschrieben wird.
+    max_memory (int): Obergrenze des Speichers je Streifen in Bytes.
+    threads (int): Anzahl der Threads zum Lesen der Kacheln.
+    fortschritt (callable): Wird nach jedem Streifen bzw. Band mit (erledigte Zeilen, Zeilen) aufgerufen.
+    prozesse (int): Anzahl der Prozesse für die Formatierung, None für die Anzahl der CPU-Kerne, 1 ohne Prozesse (siehe _xyz_schreiben).
+    gzip_stufe (int): Beide XYZ-Dateien mit gzip komprimieren (Endung .gz), None ohne Kompression.
+    """
+    from contextlib import ExitStack
+    from rasterio.features import geometry_mask
+    from rasterio.transform import Affine
+    from rasterio.windows import Window
+
+    raster = _mosaik_raster(tif_files)
+    transform = raster["transform"]
+    width, height = raster["width"], raster["height"]
+    if polygon is not None and puffer:
+        polygon = polygon.buffer(puffer)
+
+    # Streifenhöhe aus der Speichergrenze, immer ein Vielfaches von spacing
+    pixel_bytes = np.dtype(raster["dtype"]).itemsize * raster["count"]
+    streifen = max(1, int(max_memory / (3 * pixel_bytes * width)) // spacing) * spacing
+
+    cols = np.arange(0, width, spacing)
+
+    with ExitStack() as stack:
+        pool = stack.enter_context(ThreadPoolExecutor(max_workers=threads))
+        dest = None
+        if tif_file is not None:
+            dest = stack.enter_context(rasterio.open(
+                tif_file, "w", driver="GTiff", height=height, width=width, count=raster["count"],
+                dtype=raster["dtype"], crs=raster["crs"], transform=transform, nodata=NODATA,
+                tiled=True, blockxsize=256, blockysize=256, compress="deflate", BIGTIFF="IF_SAFER"))
+
+        def streifen_lesen():
+            for row_off in range(0, height, streifen):
+                window = Window(0, row_off, width, min(streifen, height - row_off))
+                daten = _mosaik_fenster(raster, window, pool)
+                if dest is not None:
+                    dest.write(daten, window=window)
+
+                block = daten[0, ::spacing, ::spacing]
+                innen = None
+                if polygon is not None:
+                    # Raster der Abtastpunkte: die Zellmitten liegen genau auf den geschriebenen Koordinaten
+                    punkte = transform * Affine.translation(-spacing / 2, row_off - spacing / 2) * Affine.scale(spacing)
+                    innen = geometry_mask([polygon], out_shape=block.shape, transform=punkte, invert=True)
+                yield row_off, window.height, block, innen
+
+        zellen = len(cols) * len(range(0, height, spacing))
+        groesse = _xyz_schreiben(streifen_lesen(), transform, cols, spacing, xyz_file, height, zellen,
+                                 prozesse=prozesse, gzip_stufe=gzip_stufe, fortschritt=fortschritt)
+        metriken.zaehlen("kacheln", len(tif_files))
+        metriken.zaehlen("bytes", groesse)
+
+@metriken.stufe("grid")
+def gelaende_grid(quelle, asc_file, zellgroesse, polygon=None, puffer=0, max_memory=256 * 1024 ** 2, fortschritt=None):
+    """
+    Schreibt ein Geländeraster als Arc/Info ASCII-Grid (z.B. für AUSTAL) in der Zielauflösung.
+
+    Jede Zelle ist der Mittelwert der Höhen des Quellrasters in der Zelle (keine Abtastung einzelner Pixel).
+    Das Quellraster wird blockweise direkt in der Zielauflösung gelesen, vorhandene Übersichten (z.B. eines
+    Cloud-Optimized GeoTIFF) nutzt GDAL dabei automatisch. Die Zeilen werden blockweise geschrieben,
+    Speicherbedarf und Dateigröße richten sich nach dem Zielraster.
+
+    Parameters:
+    quelle (str): Pfad des Quellrasters, z.B. die VRT-Datei aus vrt_erstellen.
+    asc_file (str): Pfad zur Ausgabe-Datei (.asc).
+    zellgroesse (float): Kantenlänge der Zellen in Metern, möglichst ein Vielfaches der Pixelgröße.
+    polygon (shapely.geometry.Polygon): Untersuchungsgebiet in EPSG:25832, das Raster umfasst dessen
+                                        (gepufferte) Bounding Box. None für das ganze Quellraster.
+    puffer (float): Puffer um das Polygon in Metern.
+    max_memory (int): Obergrenze des Speichers je Block in Bytes.
+    fortschritt (callable): Wird nach jedem Block mit (erledigte Zeilen, Zeilen) aufgerufen.
+
+    Raises:
+    ValueError: Wenn Zellen ohne Höhe bleiben, z.B. weil Kacheln der Bounding Box fehlen. AUSTAL benötigt ein
+                lückenloses Gelände, die Datei wird dann nicht geschrieben.
+    """
+    import math
+    from rasterio.enums import Resampling
+    from rasterio.windows import Window
+
+    with rasterio.open(quelle) as src:
+        t = src.transform
+        links, unten, rechts, oben = src.bounds
+        if polygon is not None:
+            minx, miny, maxx, maxy = polygon.buffer(puffer).bounds if puffer else polygon.bounds
+            # Auf das Zellraster ab der linken oberen Ecke des Quellrasters ausrichten, auf das Quellraster begrenzen
+            links, oben = (max(links, t.c + math.floor((minx - t.c) / zellgroesse) * zellgroesse),
+                           min(oben, t.f - math.floor((t.f - maxy) / zellgroesse) * zellgroesse))
+            rechts, unten = min(rechts, maxx), max(unten, miny)
+        spalten = max(1, math.ceil((rechts - links) / zellgroesse - 1e-9))
+        zeilen = max(1, math.ceil((oben - unten) / zellgroesse - 1e-9))
+        faktor = zellgroesse / t.a
+
+        # Zeilen je Block aus der Speichergrenze für den gelesenen Ausschnitt des Quellrasters
+        pixel_bytes = np.dtype(src.dtypes[0]).itemsize
+        block = max(1, int(max_memory / (3 * pixel_bytes * spalten * faktor * faktor)))
+        nodata = src.nodata if src.nodata is not None else NODATA
+
+        fehlend = 0
+        with open(asc_file, "w", newline="") as f:
+            f.write("ncols {}\r\nnrows {}\r\nxllcorner {!r}\r\nyllcorner {!r}\r\ncellsize {!r}\r\nNODATA_value {:g}\r\n".format(
+                spalten, zeilen, float(links), float(oben - zeilen * zellgroesse), float(zellgroesse), nodata))
+            for zeile in range(0, zeilen, block):
+                n = min(block, zeilen - zeile)
+                fenster = Window((links - t.c) / t.a, (t.f - oben) / -t.e + zeile * faktor, spalten * faktor, n * faktor)
+                daten = src.read(1, window=fenster, out_shape=(n, spalten), resampling=Resampling.average,
+                                 boundless=True, fill_value=nodata, masked=True)
+                fehlend += int(np.ma.count_masked(daten))
+                np.savetxt(f, daten.filled(nodata).astype(np.float64), fmt="%.2f", delimiter=" ", newline="\r\n")
+                if fortschritt is not None:
+                    fortschritt(zeile + n, zeilen)
+            metriken.zaehlen("bytes", f.tell())
+    if fehlend:
+        os.remove(asc_file)
+        raise ValueError("Im Geländeraster fehlen für {} von {} Zellen die Höhen, die Kacheln decken die Bounding Box nicht ab".format(
+            fehlend, spalten * zeilen))
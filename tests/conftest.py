@@ -0,0 +1,37 @@
+# Gemeinsame Hilfen der Tests
+# Die Module der Anwendung liegen im Wurzelordner des Repositorys und werden ohne Installation importiert.
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+WURZEL = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if WURZEL not in sys.path:
+    sys.path.insert(0, WURZEL)
+
+def geotiff_schreiben(pfad, werte, links, oben, groesse=1.0, nodata=None):
+    """Schreibt ein einbandiges GeoTIFF in EPSG:25832 mit der oberen linken Ecke (links, oben)."""
+    import rasterio
+    from rasterio.transform import from_origin
+
+    with rasterio.open(
+        pfad, "w", driver="GTiff", height=werte.shape[0], width=werte.shape[1], count=1, dtype=werte.dtype,
+        crs="EPSG:25832", transform=from_origin(links, oben, groesse, groesse), nodata=nodata,
+        tiled=True, blockxsize=64, blockysize=64, compress="deflate"
+    ) as dst:
+        dst.write(werte, 1)
+    return pfad
+
+@pytest.fixture
+def kacheln(tmp_path):
+    """Vier aneinandergrenzende float32-Kacheln (2 x 2) mit 200 x 200 Pixeln zu 1 m, mit Rauschen und Werten an Rundungsgrenzen."""
+    rng = np.random.default_rng(1)
+    pfade = []
+    for i, (x, y) in enumerate(((350000, 5700400), (350200, 5700400), (350000, 5700200), (350200, 5700200))):
+        werte = (80 + rng.normal(0, 5, (200, 200))).astype(np.float32)
+        # Werte an der Rundungsgrenze der zweiten Nachkommastelle, negative Höhen und -0.0
+        werte[0, :10] = np.array([0.005, 0.015, 0.125, -0.005, -0.0, 0.0, 99.995, -12.345, 1e-3, 1234.565], dtype=np.float32)
+        pfade.append(geotiff_schreiben(str(tmp_path / "kachel_{}.tif".format(i)), werte, x, y))
+    return pfade
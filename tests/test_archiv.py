@@ -0,0 +1,62 @@
+# Die ZIP-Dateien von zip_erstellen müssen von zipfile und unzip gelesen werden können, auch im ZIP64-Format.
+# ZIP64 wird mit einer herabgesetzten Grenze geprüft, statt Dateien über 4 GB zu schreiben.
+
+import os
+import shutil
+import subprocess
+import zipfile
+
+import pytest
+
+import archiv
+
+@pytest.fixture
+def ordner(tmp_path):
+    quelle = tmp_path / "quelle"
+    (quelle / "Gelände").mkdir(parents=True)
+    (quelle / "Gebäude").mkdir()
+    inhalt = {
+        "Gelände/dgm.xyz": b"350000 5700000 81.25\r\n" * 5000,
+        "Gelände/Gelände.tif": os.urandom(300000),
+        "Gelände/dgm.xyz.gz": os.urandom(1000),
+        "Gebäude/gebaeude.csv": "id,hoehe\nDENW_1,12.5\n".encode("utf-8") * 100,
+        "leer.txt": b"",
+    }
+    for name, daten in inhalt.items():
+        (quelle / name).write_bytes(daten)
+    return str(quelle), inhalt
+
+def _pruefen(zip_pfad, inhalt):
+    with zipfile.ZipFile(zip_pfad) as z:
+        assert z.testzip() is None
+        assert sorted(z.namelist()) == sorted(inhalt)
+        for name, daten in inhalt.items():
+            assert z.read(name) == daten
+        methoden = {info.filename: info.compress_type for info in z.infolist()}
+    assert methoden["Gelände/Gelände.tif"] == zipfile.ZIP_STORED
+    assert methoden["Gelände/dgm.xyz.gz"] == zipfile.ZIP_STORED
+    assert methoden["Gelände/dgm.xyz"] == zipfile.ZIP_DEFLATED
+    if shutil.which("unzip"):
+        ergebnis = subprocess.run(["unzip", "-tq", zip_pfad], capture_output=True)
+        assert ergebnis.returncode == 0, ergebnis.stdout + ergebnis.stderr
+
+def test_zip_erstellen(ordner, tmp_path):
+    quelle, inhalt = ordner
+    zip_pfad = str(tmp_path / "ergebnis.zip")
+    fortschritt = []
+    archiv.zip_erstellen(quelle, zip_pfad, threads=2, fortschritt=lambda erledigt, gesamt: fortschritt.append((erledigt, gesamt)))
+    _pruefen(zip_pfad, inhalt)
+    assert fortschritt[-1] == (len(inhalt), len(inhalt))
+    # Keine temporären Dateien neben der ZIP-Datei
+    assert sorted(os.listdir(str(tmp_path))) == ["ergebnis.zip", "quelle"]
+
+def test_zip_erstellen_zip64(ordner, tmp_path, monkeypatch):
+    # Größen, Offsets und das zentrale Verzeichnis liegen über der Grenze: alle ZIP64-Felder und der ZIP64-Endsatz
+    monkeypatch.setattr(archiv, "_ZIP64_LIMIT", 1000)
+    quelle, inhalt = ordner
+    zip_pfad = str(tmp_path / "ergebnis.zip")
+    archiv.zip_erstellen(quelle, zip_pfad)
+    with open(zip_pfad, "rb") as f:
+        daten = f.read()
+    assert b"PK\x06\x06" in daten and b"PK\x06\x07" in daten
+    _pruefen(zip_pfad, inhalt)
@@ -0,0 +1,89 @@
+# Abgebrochene Downloads werden mit einer Range-Anfrage ab dem bereits geschriebenen Byte fortgesetzt (siehe cache._herunterladen).
+# Die Session wird durch eine Attrappe ersetzt, die die Übertragung nach einer festen Anzahl Bytes abbricht.
+
+import base64
+import hashlib
+import os
+
+import pytest
+import requests
+
+from downloads import cache
+import downloads.get
+
+URL = "https://daten.example/dgm1_32_350_5700_1_nw_2023.tif"
+DATEN = b"II*\x00" + os.urandom(300000)
+ETAG = '"kachel-1"'
+
+class Antwort:
+    def __init__(self, status, headers, inhalt, abbruch=None):
+        self.status_code = status
+        self.headers = requests.structures.CaseInsensitiveDict(headers)
+        self._inhalt = inhalt
+        self._abbruch = abbruch
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self._inhalt), 4096):
+            if self._abbruch is not None and i >= self._abbruch:
+                raise requests.ConnectionError("Verbindung abgebrochen")
+            yield self._inhalt[i:i + 4096]
+
+class Server:
+    """Liefert DATEN, die erste Übertragung bricht nach abbruch Bytes ab."""
+    def __init__(self, abbruch=25 * 4096, range_unterstuetzt=True):
+        self.abbruch = abbruch
+        self.range_unterstuetzt = range_unterstuetzt
+        self.anfragen = []
+
+    def get(self, url, stream=False, headers=None):
+        headers = dict(headers or {})
+        self.anfragen.append(headers)
+        kopf = {"ETag": ETAG, "Content-MD5": base64.b64encode(hashlib.md5(DATEN).digest()).decode()}
+        abbruch = self.abbruch if len(self.anfragen) == 1 else None
+        bereich = headers.get("Range")
+        if bereich and self.range_unterstuetzt and headers.get("If-Range") == ETAG:
+            von = int(bereich.split("=")[1].rstrip("-"))
+            kopf.update({"Content-Range": "bytes {}-{}/{}".format(von, len(DATEN) - 1, len(DATEN)), "Content-Length": str(len(DATEN) - von)})
+            return Antwort(206, kopf, DATEN[von:], abbruch)
+        kopf["Content-Length"] = str(len(DATEN))
+        return Antwort(200, kopf, DATEN, abbruch)
+
+@pytest.fixture(autouse=True)
+def cache_ordner(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(downloads.get, "wartezeit", lambda versuch: 0)
+
+def test_fortsetzen_mit_range(tmp_path):
+    server = Server()
+    ziel = str(tmp_path / "kachel.tif")
+    assert cache.abrufen(URL, ziel, server)
+    with open(ziel, "rb") as f:
+        assert f.read() == DATEN
+    # Die zweite Anfrage setzt beim ersten fehlenden Byte fort, nur wenn die Datei unverändert ist
+    assert len(server.anfragen) == 2
+    assert server.anfragen[1] == {"Range": "bytes=102400-", "If-Range": ETAG}
+    # Keine Reste der temporären Datei im Cache
+    assert not [d for _, _, dateien in os.walk(cache.CACHE_DIR) for d in dateien if d.endswith(".tmp")]
+
+def test_ohne_range_vollstaendig_neu(tmp_path):
+    # Der Server ignoriert Range und sendet die ganze Datei (200), sie wird von vorn geschrieben
+    server = Server(range_unterstuetzt=False)
+    ziel = str(tmp_path / "kachel.tif")
+    assert cache.abrufen(URL, ziel, server)
+    with open(ziel, "rb") as f:
+        assert f.read() == DATEN
+    assert len(server.anfragen) == 2
+
+def test_cache_treffer_ohne_anfrage(tmp_path):
+    server = Server(abbruch=None)
+    assert cache.abrufen(URL, str(tmp_path / "a.tif"), server)
+    assert cache.abrufen(URL, str(tmp_path / "b.tif"), server)
+    assert len(server.anfragen) == 1
+    with open(str(tmp_path / "b.tif"), "rb") as f:
+        assert f.read() == DATEN
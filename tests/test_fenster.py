@@ -0,0 +1,68 @@
+# Das fensterweise Lesen über Range-Anfragen muss die gleichen Pixel liefern wie die ganze Kachel.
+# Die Kacheln liefert der lokale Testserver des Benchmarks (benchmark.server) mit Range-Unterstützung.
+
+import os
+
+import numpy as np
+import pytest
+import rasterio
+from shapely.geometry import Polygon
+
+import processing
+from downloads import cache, fenster
+from benchmark import server as testserver
+
+KACHELN = [(350, 5700), (351, 5700)]
+NAME = "dgm1_32_{}_{}_1_nw_2023.tif"
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    daten = testserver.Daten(str(tmp_path_factory.mktemp("daten")), pixel=500)
+    server = testserver.Testserver(daten, KACHELN, latenz=0)
+    server.starten()
+    yield server, daten
+    server.stoppen()
+
+@pytest.fixture(autouse=True)
+def cache_ordner(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path / "cache"))
+
+def _url(server, x, y):
+    return "{}/www.opengeodata.nrw.de/{}".format(server.basis, NAME.format(x, y))
+
+def test_fenster_wie_kachel(server, tmp_path):
+    server, daten = server
+    ziel = str(tmp_path / NAME.format(350, 5700))
+    bounds = (350200, 5700300, 350400, 5700500)
+    vorher = server.statistik().get("bereich", {"anfragen": 0})["anfragen"]
+    assert fenster.fenster_laden(_url(server, 350, 5700), ziel, bounds)
+    assert server.statistik()["bereich"]["anfragen"] > vorher
+    with rasterio.open(ziel) as ausschnitt, rasterio.open(daten.pfad(NAME.format(350, 5700))) as ganz:
+        # Ausschnitt mit Rand, auf ganze Pixel gerundet
+        assert ausschnitt.bounds.left == bounds[0] - fenster.FENSTER_RAND
+        assert ausschnitt.bounds.top == bounds[3] + fenster.FENSTER_RAND
+        assert ausschnitt.width < ganz.width
+        window = ganz.window(*ausschnitt.bounds)
+        np.testing.assert_array_equal(ausschnitt.read(1), ganz.read(1, window=window))
+
+def test_fenster_ausserhalb_ohne_datei(server, tmp_path):
+    server, _ = server
+    ziel = str(tmp_path / NAME.format(351, 5700))
+    assert fenster.fenster_laden(_url(server, 351, 5700), ziel, (350100, 5700100, 350200, 5700200))
+    assert not os.path.exists(ziel)
+
+def test_xyz_aus_fenstern_wie_aus_kacheln(server, tmp_path):
+    server, daten = server
+    polygon = Polygon([(350700, 5700200), (351300, 5700250), (351200, 5700600), (350800, 5700550)])
+    gebiet = polygon.bounds
+    ausschnitte = []
+    for x, y in KACHELN:
+        ziel = str(tmp_path / NAME.format(x, y))
+        assert fenster.fenster_laden(_url(server, x, y), ziel, gebiet)
+        ausschnitte.append(ziel)
+    ganz = [daten.pfad(NAME.format(x, y)) for x, y in KACHELN]
+    processing.tifs_to_xyz(ausschnitte, str(tmp_path / "fenster.xyz"), polygon=polygon, prozesse=1)
+    processing.tifs_to_xyz(ganz, str(tmp_path / "ganz.xyz"), polygon=polygon, prozesse=1)
+    with open(str(tmp_path / "fenster.xyz"), "rb") as a, open(str(tmp_path / "ganz.xyz"), "rb") as b:
+        inhalt = a.read()
+        assert inhalt and inhalt == b.read()
@@ -0,0 +1,144 @@
+# Die XYZ-Ausgabe muss Byte für Byte der ursprünglichen csv-Ausgabe entsprechen,
+# unabhängig davon, ob sie seriell, parallel, aus einem Mosaik, einem VRT oder komprimiert erzeugt wird.
+
+import csv
+import gzip
+import io
+
+import numpy as np
+import pytest
+import rasterio
+
+import processing
+from conftest import geotiff_schreiben
+
+def _csv_referenz(tif_file, spacing=1):
+    """Ursprüngliche Implementierung von tif_to_xyz (csv.writer je Zelle), liefert den Inhalt beider Dateien."""
+    with rasterio.open(tif_file) as dataset:
+        raster = dataset.read(1)
+        transform = dataset.transform
+    file, file32 = io.StringIO(newline=""), io.StringIO(newline="")
+    writer = csv.writer(file, delimiter=" ")
+    writer32 = csv.writer(file32, delimiter=" ")
+    for row in range(0, raster.shape[0], spacing):
+        for col in range(0, raster.shape[1], spacing):
+            x, y = transform * (col, row)
+            hoehe = raster[row, col]
+            writer.writerow([int(x), int(y), f"{hoehe:.2f}"])
+            writer32.writerow([32000000 + int(x), int(y), f"{hoehe:.2f}"])
+    return file.getvalue().encode("ascii"), file32.getvalue().encode("ascii")
+
+def _zeilen_referenz(x, y, z):
+    # Zeilen der ursprünglichen Ausgabe für einzelne Zellen
+    file, file32 = io.StringIO(newline=""), io.StringIO(newline="")
+    writer, writer32 = csv.writer(file, delimiter=" "), csv.writer(file32, delimiter=" ")
+    for xi, yi, hoehe in zip(x, y, z):
+        writer.writerow([int(xi), int(yi), f"{hoehe:.2f}"])
+        writer32.writerow([32000000 + int(xi), int(yi), f"{hoehe:.2f}"])
+    return file.getvalue().encode("ascii"), file32.getvalue().encode("ascii")
+
+def _lesen(pfad):
+    with open(pfad, "rb") as f:
+        return f.read()
+
+@pytest.mark.parametrize("dtype", ["float32", "float64", "int16", "uint8"])
+def test_format_xyz_wie_csv(dtype):
+    rng = np.random.default_rng(7)
+    n = 5000
+    # Rechtswerte mit sechs und weniger Stellen, auch negative Koordinaten
+    x = np.concatenate([rng.uniform(280000, 920000, n - 4), [-1.5, 0.7, 99999.9, 5.0]])
+    y = rng.uniform(5200000, 6100000, n)
+    if dtype.startswith("float"):
+        z = rng.normal(50, 200, n).astype(dtype)
+        z[:6] = np.array([0.005, -0.005, -0.0, 99.995, 1234.565, -12.345], dtype=dtype)
+    else:
+        info = np.iinfo(dtype)
+        z = rng.integers(info.min, info.max, n, endpoint=True).astype(dtype)
+    assert processing._format_xyz(x, y, z) == _zeilen_referenz(x, y, z)
+
+def test_format_xyz_nan_und_leer():
+    x = np.array([350000.5, 350001.5])
+    y = np.array([5700000.5, 5700001.5])
+    z = np.array([np.nan, 12.5], dtype=np.float32)
+    assert processing._format_xyz(x, y, z) == _zeilen_referenz(x, y, z)
+    assert processing._format_xyz(x[:0], y[:0], z[:0]) == (b"", b"")
+
+@pytest.mark.parametrize("spacing", [1, 3])
+def test_tif_to_xyz_wie_csv(kacheln, tmp_path, spacing):
+    xyz = str(tmp_path / "dgm.xyz")
+    # Kleine Blöcke, damit mehrere Streifen geschrieben werden
+    processing.tif_to_xyz(kacheln[0], xyz, spacing=spacing, block_cells=1000, prozesse=1)
+    text, text32 = _csv_referenz(kacheln[0], spacing)
+    assert _lesen(xyz) == text
+    assert _lesen(str(tmp_path / "dgm32.xyz")) == text32
+
+def test_tif_to_xyz_parallel_wie_seriell(kacheln, tmp_path, monkeypatch):
+    merged = str(tmp_path / "merged.tif")
+    processing.merge_tifs(kacheln, merged)
+    processing.tif_to_xyz(merged, str(tmp_path / "seriell.xyz"), block_cells=7000, prozesse=1)
+    # Auch kleine Raster auf Prozesse verteilen, Bänder kleiner als die Streifen
+    monkeypatch.setattr(processing, "XYZ_PARALLEL_AB", 0)
+    monkeypatch.setattr(processing, "XYZ_BAND_ZELLEN", 3000)
+    processing.tif_to_xyz(merged, str(tmp_path / "parallel.xyz"), block_cells=7000, prozesse=2)
+    assert _lesen(str(tmp_path / "parallel.xyz")) == _lesen(str(tmp_path / "seriell.xyz"))
+    assert _lesen(str(tmp_path / "parallel32.xyz")) == _lesen(str(tmp_path / "seriell32.xyz"))
+    assert _lesen(str(tmp_path / "seriell.xyz")) == _csv_referenz(merged)[0]
+
+@pytest.mark.parametrize("prozesse", [1, 2])
+def test_tif_to_xyz_gzip(kacheln, tmp_path, monkeypatch, prozesse):
+    monkeypatch.setattr(processing, "XYZ_PARALLEL_AB", 0)
+    processing.tif_to_xyz(kacheln[0], str(tmp_path / "dgm.xyz"), block_cells=5000, prozesse=prozesse, gzip_stufe=processing.XYZ_GZIP_STUFE)
+    text, text32 = _csv_referenz(kacheln[0])
+    assert gzip.decompress(_lesen(str(tmp_path / "dgm.xyz.gz"))) == text
+    assert gzip.decompress(_lesen(str(tmp_path / "dgm32.xyz.gz"))) == text32
+
+def test_merge_windowed_und_vrt_wie_merge(kacheln, tmp_path):
+    processing.merge_tifs(kacheln, str(tmp_path / "ganz.tif"))
+    # Speichergrenze klein genug für mehrere Fenster
+    processing.merge_tifs(kacheln, str(tmp_path / "fenster.tif"), max_memory=200 * 1024)
+    processing.merge_tifs(kacheln, str(tmp_path / "mosaik.vrt"))
+    with rasterio.open(str(tmp_path / "ganz.tif")) as ganz:
+        erwartet, transform = ganz.read(1), ganz.transform
+    for name in ("fenster.tif", "mosaik.vrt"):
+        with rasterio.open(str(tmp_path / name)) as src:
+            assert src.transform == transform
+            np.testing.assert_array_equal(src.read(1), erwartet)
+
+@pytest.mark.parametrize("spacing", [1, 4])
+def test_tifs_to_xyz_und_vrt_wie_zusammengesetzt(kacheln, tmp_path, spacing):
+    merged = str(tmp_path / "merged.tif")
+    processing.merge_tifs(kacheln, merged)
+    processing.tif_to_xyz(merged, str(tmp_path / "merged.xyz"), spacing=spacing, prozesse=1)
+    # Direkt aus den Kacheln mit kleinen Streifen
+    processing.tifs_to_xyz(kacheln, str(tmp_path / "kacheln.xyz"), spacing=spacing, max_memory=64 * 1024, prozesse=1)
+    vrt = str(tmp_path / "mosaik.vrt")
+    processing.vrt_erstellen(kacheln, vrt)
+    processing.tif_to_xyz(vrt, str(tmp_path / "vrt.xyz"), spacing=spacing, prozesse=1)
+    erwartet = _lesen(str(tmp_path / "merged.xyz"))
+    assert _lesen(str(tmp_path / "kacheln.xyz")) == erwartet
+    assert _lesen(str(tmp_path / "vrt.xyz")) == erwartet
+    assert _lesen(str(tmp_path / "kacheln32.xyz")) == _lesen(str(tmp_path / "merged32.xyz"))
+
+def test_tifs_to_xyz_polygon_parallel_wie_seriell(kacheln, tmp_path, monkeypatch):
+    from shapely.geometry import Polygon
+
+    polygon = Polygon([(350030, 5700010), (350370, 5700060), (350250, 5700390), (350060, 5700300)])
+    processing.tifs_to_xyz(kacheln, str(tmp_path / "seriell.xyz"), polygon=polygon, puffer=5, max_memory=64 * 1024, prozesse=1)
+    monkeypatch.setattr(processing, "XYZ_PARALLEL_AB", 0)
+    monkeypatch.setattr(processing, "XYZ_BAND_ZELLEN", 2000)
+    processing.tifs_to_xyz(kacheln, str(tmp_path / "parallel.xyz"), polygon=polygon, puffer=5, max_memory=64 * 1024, prozesse=2)
+    seriell = _lesen(str(tmp_path / "seriell.xyz"))
+    assert seriell and _lesen(str(tmp_path / "parallel.xyz")) == seriell
+    # Alle Punkte liegen im gepufferten Polygon
+    from shapely.geometry import Point
+    gebiet = polygon.buffer(5 + 1)
+    assert all(gebiet.contains(Point(float(z.split()[0]), float(z.split()[1]))) for z in seriell.decode().splitlines()[::97])
+
+def test_tifs_to_xyz_nodata_wie_csv(tmp_path):
+    # Lücke zwischen zwei Kacheln: im Mosaik steht NODATA wie bei merge_tifs
+    werte = np.arange(50 * 50, dtype=np.float32).reshape(50, 50) / 7
+    a = geotiff_schreiben(str(tmp_path / "a.tif"), werte, 350000, 5700050)
+    b = geotiff_schreiben(str(tmp_path / "b.tif"), werte + 1, 350100, 5700050)
+    processing.merge_tifs([a, b], str(tmp_path / "merged.tif"))
+    processing.tifs_to_xyz([a, b], str(tmp_path / "kacheln.xyz"), prozesse=1)
+    assert _lesen(str(tmp_path / "kacheln.xyz")) == _csv_referenz(str(tmp_path / "merged.tif"))[0]